@@ -1,11 +1,11 @@
 import json
 import logging
-import pickle
 
-from traitlets import Unicode
+from traitlets import Unicode, Bool
 from traitlets.config import Configurable
 
 from knowledge4ir.utils import body_field, SPOT_FIELD
+from knowledge4ir.salience.utils.vocabulary import load_vocabulary
 
 
 class AlignPredicted(Configurable):
@@ -17,17 +17,22 @@ class AlignPredicted(Configurable):
     output:
         add salience score for each entity in the doc raw json
     """
-    entity_id_pickle_in = Unicode(help='pickle of entity id').tag(config=True)
+    entity_id_pickle_in = Unicode(help='pickle (or vocabulary dir) of entity id').tag(config=True)
     content_field = Unicode(body_field, help='content field with salience').tag(config=True)
     predict_field = Unicode('predict', help='the field with prediced e salience').tag(config=True)
     corpus_type = Unicode('hashed', help='raw or hashed corpus').tag(config=True)
+    sorted_input = Bool(False, help='both the corpus and the predictions are'
+                                    ' sorted by docno (see'
+                                    ' utils.external_sort), align them with a'
+                                    ' streaming merge join in constant memory'
+                        ).tag(config=True)
 
     def __init__(self, **kwargs):
         super(AlignPredicted, self).__init__(**kwargs)
         self.h_eid_entity = {}
         self.h_eid_entity = {}
         if self.entity_id_pickle_in:
-            h_entity_id = pickle.load(open(self.entity_id_pickle_in))
+            h_entity_id = load_vocabulary(self.entity_id_pickle_in)
             self.h_eid_entity = dict(
                 [(item[1], item[0]) for item in h_entity_id.items()]
             )
@@ -37,6 +42,8 @@ class AlignPredicted(Configurable):
         }
 
     def align_predict_to_corpus(self, corpus_in, predict_in, out_name):
+        if self.sorted_input:
+            return self._merge_join_align(corpus_in, predict_in, out_name)
         h_key_predicted_info = self._load_predict(predict_in)
 
         out = open(out_name, 'w')
@@ -56,6 +63,66 @@ class AlignPredicted(Configurable):
         logging.info('aligning [%s] to [%s] finished, res [%s]',
                      predict_in, corpus_in, out_name)
 
+    def _merge_join_align(self, corpus_in, predict_in, out_name):
+        """
+        align docno sorted corpus_in and predict_in in one pass
+        same results as the in memory alignment:
+            docs without prediction are kept as is
+            predictions without doc are skipped
+            duplicated predictions of a docno: the last one is used
+            duplicated docs: each is aligned to the docno's prediction
+        """
+        predict_iter = self._iter_sorted(predict_in)
+        predict_key, h_predict = next(predict_iter, (None, None))
+        h_matched = None
+        matched_key = None
+        last_key = None
+        nb_aligned = 0
+        out = open(out_name, 'w')
+        for p, (key, h_info) in enumerate(self._iter_sorted(corpus_in)):
+            if not p % 1000:
+                logging.info('aligned [%d] lines', p)
+            if key != last_key:
+                h_matched = None
+                matched_key = None
+                while (h_predict is not None) and (predict_key < key):
+                    logging.warn('[%s] predicted but not in [%s]',
+                                 predict_key, corpus_in)
+                    predict_key, h_predict = next(predict_iter, (None, None))
+                while (h_predict is not None) and (predict_key == key):
+                    h_matched, matched_key = h_predict, predict_key
+                    predict_key, h_predict = next(predict_iter, (None, None))
+                last_key = key
+            if matched_key is None:
+                logging.warn('[%s] predicted res not in [%s]',
+                             key, predict_in)
+            else:
+                h_info = self.h_align_func[self.corpus_type](h_info,
+                                                              h_matched)
+                nb_aligned += 1
+            print >> out, json.dumps(h_info)
+        out.close()
+        logging.info('merge join aligned [%d] docs of [%s] to [%s], res [%s]',
+                     nb_aligned, predict_in, corpus_in, out_name)
+
+    def _iter_sorted(self, in_name):
+        """
+        yield (key, h_info) of in_name, checking the keys are sorted
+        """
+        last_key = None
+        for line in open(in_name):
+            if not line.strip():
+                continue
+            h_info = json.loads(line)
+            key = self._get_key(h_info)
+            if (last_key is not None) and (key < last_key):
+                logging.error('[%s] not sorted by docno: [%s] after [%s],'
+                              ' sort it with utils.external_sort',
+                              in_name, key, last_key)
+                raise ValueError
+            last_key = key
+            yield key, h_info
+
     def _load_predict(self, predict_in):
         l_h_predict = [json.loads(line) for line in open(predict_in)]
         assert l_h_predict
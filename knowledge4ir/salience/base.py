@@ -18,8 +18,7 @@ import numpy as np
 from traitlets.config import Configurable
 
 from knowledge4ir.salience.utils.data_io import DataIO
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class NNPara(Configurable):
@@ -62,6 +61,10 @@ class NNPara(Configurable):
                                            'entity event joint similarity matrix'
                                    ).tag(config=True)
     arg_voting = Bool(False, help='whether to enable voting to event argument').tag(config=True)
+    kernel_chunk = Int(0, help='kernels pooled at a time, 0 to pool all'
+                               ' kernels at once; smaller values cap the'
+                               ' kernel pooling memory at batch x entities x'
+                               ' neighbours x kernel_chunk').tag(config=True)
 
     def form_kernels(self):
         l_mu = [1.0]
@@ -94,10 +97,18 @@ class ExtData(Configurable):
     entity_nlss_in = Unicode(
         help='hashed entity natural language support sentence array').tag(
         config=True)
+    mmap_mode = Unicode(
+        help='np.load mmap_mode of the arrays, r to map them read only, so'
+             ' loading reads no data and forked workers share the pages;'
+             ' empty to read them into memory. the models copy the embedding'
+             ' tables into their nn.Embedding weights, so RSS still grows with'
+             ' the full tables once a model is built, use the pruned tables'
+             ' of prune_ext_data to bound it').tag(config=True)
 
     def __init__(self, **kwargs):
         super(ExtData, self).__init__(**kwargs)
         self.entity_emb = None
+        self.event_emb = None
         self.word_emb = None
         self.entity_desp = None
         self.entity_rdf = None
@@ -107,29 +118,42 @@ class ExtData(Configurable):
     def _load(self):
         if self.entity_emb_in:
             logging.info('loading entity_emb_in [%s]', self.entity_emb_in)
-            self.entity_emb = np.load(self.entity_emb_in)
+            self.entity_emb = self._load_npy(self.entity_emb_in)
             logging.info('shape %s', json.dumps(self.entity_emb.shape))
         if self.event_emb_in:
             logging.info('loading event_emb_in [%s]', self.event_emb_in)
-            self.event_emb = np.load(self.event_emb_in)
+            self.event_emb = self._load_npy(self.event_emb_in)
         if self.word_emb_in:
             logging.info('loading word_emb_in [%s]', self.word_emb_in)
-            self.word_emb = np.load(self.word_emb_in)
+            self.word_emb = self._load_npy(self.word_emb_in)
             logging.info('shape %s', json.dumps(self.word_emb.shape))
         if self.entity_desp_in:
             logging.info('loading entity_desp_in [%s]', self.entity_desp_in)
-            self.entity_desp = np.load(self.entity_desp_in)
+            self.entity_desp = self._load_npy(self.entity_desp_in)
             logging.info('shape %s', json.dumps(self.entity_desp.shape))
         if self.entity_rdf_in:
             logging.info('loading entity_rdf_in [%s]', self.entity_rdf_in)
-            self.entity_rdf = np.load(self.entity_rdf_in)
+            self.entity_rdf = self._load_npy(self.entity_rdf_in)
             logging.info('shape %s', json.dumps(self.entity_rdf.shape))
         if self.entity_nlss_in:
             logging.info('loading entity_nlss_in [%s]', self.entity_nlss_in)
-            self.entity_nlss = np.load(self.entity_nlss_in)
+            self.entity_nlss = self._load_npy(self.entity_nlss_in)
             logging.info('shape %s', json.dumps(self.entity_nlss.shape))
         logging.info('ext data loaded')
 
+    def _load_npy(self, in_name):
+        if self.mmap_mode:
+            return np.load(in_name, mmap_mode=self.mmap_mode)
+        return np.load(in_name)
+
+    def release_embeddings(self):
+        """
+        drop the loaded embedding tables, once the model has its own copies
+        """
+        self.entity_emb = None
+        self.event_emb = None
+        self.word_emb = None
+
     def assert_with_para(self, nn_para):
 
         if self.entity_emb_in:
@@ -154,6 +178,8 @@ class ExtData(Configurable):
 
 class SalienceBaseModel(nn.Module):
     io_group = 'raw'
+    # whether a doc's scores stay the same when it is padded in a batch
+    batch_predict_exact = True
 
     def __init__(self, para, ext_data=None):
         """
@@ -181,11 +207,15 @@ class SalienceBaseModel(nn.Module):
             parser = io_parser
         else:
             parser = DataIO()
-        if not parser.l_target_data:
-            parser.group_name = self.io_group
-            parser.config_target_group()
+        self.config_io(parser)
         return parser.parse_data(l_lines)
 
+    def config_io(self, io_parser):
+        if not io_parser.l_target_data:
+            io_parser.group_name = self.io_group
+            io_parser.config_target_group()
+        return io_parser
+
     def forward_intermediate(self, h_packed_data):
         return self.forward(h_packed_data)
 
@@ -199,6 +229,8 @@ class KernelPooling(nn.Module):
     init:
         v_mu: a 1-d dimension of mu's
         sigma: the sigma
+        kernel_chunk: number of kernels to pool at a time, 0 to pool all
+            kernels in one expanded tensor
     input:
         similar to Linear()
             a n-D tensor, last dimension is the one to enforce kernel pooling
@@ -206,7 +238,7 @@ class KernelPooling(nn.Module):
         n-K tensor, K is the v_mu.size(), number of kernels
     """
 
-    def __init__(self, l_mu=None, l_sigma=None):
+    def __init__(self, l_mu=None, l_sigma=None, kernel_chunk=0):
         super(KernelPooling, self).__init__()
         if l_mu is None:
             l_mu = [1, 0.9, 0.7, 0.5, 0.3, 0.1, -0.1, -0.3, -0.5, -0.7, -0.9]
@@ -215,19 +247,42 @@ class KernelPooling(nn.Module):
         if l_sigma is None:
             l_sigma = [1e-3] + [0.1] * (self.v_mu.size()[-1] - 1)
         self.v_sigma = Variable(torch.FloatTensor(l_sigma), requires_grad=False)
-        if use_cuda:
+        self.kernel_chunk = kernel_chunk
+        if use_cuda():
             self.v_mu = self.v_mu.cuda()
             self.v_sigma = self.v_sigma.cuda()
-        logging.info('[%d] pooling kernels: %s',
-                     self.K, json.dumps(zip(l_mu, l_sigma))
+        logging.info('[%d] pooling kernels: %s, [%d] at a time',
+                     self.K, json.dumps(zip(l_mu, l_sigma)),
+                     self.kernel_chunk if self.kernel_chunk else self.K
                      )
         return
 
+    def __setstate__(self, state):
+        super(KernelPooling, self).__setstate__(state)
+        # models pickled before kernel_chunk pool all the kernels at once
+        if 'kernel_chunk' not in self.__dict__:
+            self.kernel_chunk = 0
+
     def forward(self, in_tensor, mtx_score):
+        if (not self.kernel_chunk) or (self.kernel_chunk >= self.K):
+            return self._pool(in_tensor, mtx_score, self.v_mu, self.v_sigma)
+        l_sum_kernel_value = []
+        for st in xrange(0, self.K, self.kernel_chunk):
+            ed = min(st + self.kernel_chunk, self.K)
+            l_sum_kernel_value.append(self._pool(
+                in_tensor, mtx_score, self.v_mu[st:ed], self.v_sigma[st:ed]))
+        return torch.cat(l_sum_kernel_value, dim=-1)
+
+    @staticmethod
+    def _pool(in_tensor, mtx_score, v_mu, v_sigma):
+        """
+        log of the score weighted kernel sums, for the kernels in v_mu
+        the expanded tensor is batch x entities x neighbours x len(v_mu)
+        """
         in_tensor = in_tensor.unsqueeze(-1)
-        in_tensor = in_tensor.expand(in_tensor.size()[:-1] + (self.K,))
-        score = -(in_tensor - self.v_mu) * (in_tensor - self.v_mu)
-        kernel_value = torch.exp(score / (2.0 * self.v_sigma * self.v_sigma))
+        in_tensor = in_tensor.expand(in_tensor.size()[:-1] + v_mu.size())
+        score = -(in_tensor - v_mu) * (in_tensor - v_mu)
+        kernel_value = torch.exp(score / (2.0 * v_sigma * v_sigma))
         mtx_score = mtx_score.unsqueeze(-1).unsqueeze(1)
         mtx_score = mtx_score.expand_as(kernel_value)
         weighted_kernel_value = kernel_value * mtx_score
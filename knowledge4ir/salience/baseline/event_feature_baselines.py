@@ -23,8 +23,7 @@ import logging
 import json
 import numpy as np
 import torch
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class FeatureBasedBaseline(Configurable):
@@ -68,7 +67,7 @@ class FeatureBasedBaseline(Configurable):
 
     def eval_per_dim(self, h_packed_data, m_label, reverse_dim, key_name,
                      docno):
-        if use_cuda:
+        if use_cuda():
             feature_data = h_packed_data['ts_feature'].data.cpu()
             label_data = m_label.data.cpu()
         else:
@@ -86,7 +85,7 @@ class FeatureBasedBaseline(Configurable):
             l_h_out[f_dim][key_name] = docno
             mtx_e = h_packed_data['mtx_e']
 
-            if use_cuda:
+            if use_cuda():
                 l_e = mtx_e[0].cpu().data.numpy().tolist()
             else:
                 l_e = mtx_e[0].data.numpy().tolist()
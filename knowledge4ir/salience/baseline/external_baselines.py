@@ -25,9 +25,9 @@ from sumy.utils import get_stop_words
 from traitlets.config import Configurable
 from collections import defaultdict
 from knowledge4ir.salience.utils.evaluation import SalienceEva
+from knowledge4ir.salience.utils.vocabulary import load_vocabulary
 from knowledge4ir.utils import add_svm_feature, mutiply_svm_feature
 
-import pickle
 import logging
 import gzip
 
@@ -39,7 +39,7 @@ class SummarizationBaseline(Configurable):
     corpus_in = Unicode(help='input in text version').tag(config=True)
     test_out = Unicode(help='output').tag(config=True)
 
-    event_id_pickle_in = Unicode(help='pickle of event id').tag(config=True)
+    event_id_pickle_in = Unicode(help='pickle (or vocabulary dir) of event id').tag(config=True)
 
     def __init__(self, **kwargs):
         super(SummarizationBaseline, self).__init__(**kwargs)
@@ -52,7 +52,7 @@ class SummarizationBaseline(Configurable):
         self.summarizer = Summarizer(stemmer)
         self.summarizer.stop_words = get_stop_words(lang)
 
-        self.h_event_id = pickle.load(open(self.event_id_pickle_in))
+        self.h_event_id = load_vocabulary(self.event_id_pickle_in)
 
     def get_event_head(self, event_info):
         for f in event_info['feature']['sparseFeatureArray']:
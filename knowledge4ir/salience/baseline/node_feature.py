@@ -10,8 +10,7 @@ import torch.nn.functional as F
 from torch import nn as nn
 
 from knowledge4ir.salience.base import SalienceBaseModel
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class FeatureLR(SalienceBaseModel):
@@ -29,7 +28,7 @@ class FeatureLR(SalienceBaseModel):
             last_dim = hidden_d
         self.l_node_lr.append(nn.Linear(last_dim, 1, bias=False))
 
-        if use_cuda:
+        if use_cuda():
             for linear in self.l_node_lr:
                 linear.cuda()
 
@@ -54,7 +53,7 @@ class FrequencySalience(SalienceBaseModel):
     def __init__(self, para, ext_data=None):
         super(FrequencySalience, self).__init__(para, ext_data)
         self.linear = nn.Linear(1, 1)
-        if use_cuda:
+        if use_cuda():
             self.linear.cuda()
         return
 
@@ -66,7 +65,7 @@ class FrequencySalience(SalienceBaseModel):
         # output = mtx_score.unsqueeze(-1)
         # output = self.linear(output)
         # output = output.squeeze(-1)
-        if use_cuda:
+        if use_cuda():
             return output.cuda()
         else:
             return output
\ No newline at end of file
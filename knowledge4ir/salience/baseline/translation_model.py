@@ -8,8 +8,7 @@ import logging
 import torch
 import torch.nn as nn
 from knowledge4ir.salience.base import SalienceBaseModel
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class EmbPageRank(SalienceBaseModel):
@@ -18,6 +17,8 @@ class EmbPageRank(SalienceBaseModel):
         e=-1 is padding
     output: p(target e id is salient)
     """
+    # the translation matrix is normalized over all the doc's entities
+    batch_predict_exact = False
 
     def __init__(self, para, ext_data=None):
         super(EmbPageRank, self).__init__(para, ext_data)
@@ -27,7 +28,7 @@ class EmbPageRank(SalienceBaseModel):
         self.linear = nn.Linear(2, 1, bias=True)
         if ext_data.entity_emb is not None:
             self.embedding.weight.data.copy_(torch.from_numpy(ext_data.entity_emb))
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             self.linear.cuda()
@@ -52,7 +53,7 @@ class EmbPageRank(SalienceBaseModel):
 
         output = self.linear(torch.cat([mtx_score.unsqueeze(-1), output], dim=-1))
         output = output.squeeze(-1)
-        return output.cuda()
+        return output
 
 
 class EdgeCNN(SalienceBaseModel):
@@ -61,6 +62,8 @@ class EdgeCNN(SalienceBaseModel):
         e=-1 is padding
     output: p(target e id is salient)
     """
+    # the translation matrix is normalized over all the doc's entities
+    batch_predict_exact = False
 
     def __init__(self, para, ext_data=None):
         super(EdgeCNN, self).__init__(para, ext_data)
@@ -70,7 +73,7 @@ class EdgeCNN(SalienceBaseModel):
             self.embedding.weight.data.copy_(torch.from_numpy(ext_data.entity_emb))
         self.projection = nn.Linear(para.embedding_dim, para.embedding_dim, bias=False)
         self.linear = nn.Linear(1, 1, bias=True)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             self.projection.cuda()
@@ -95,7 +98,7 @@ class EdgeCNN(SalienceBaseModel):
 
         output = self.linear(output)
         output = output.squeeze(-1)
-        if use_cuda:
+        if use_cuda():
             return output.cuda()
         else:
             return output
@@ -23,7 +23,7 @@ class WordKNRM(KNRM):
             torch.from_numpy(ext_data.word_emb)
         )
         self.duet_linear = nn.Linear(self.K, 1, bias=True)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying word knrm parameters to cuda')
             self.word_embedding.cuda()
             self.duet_linear.cuda()
@@ -0,0 +1,132 @@
+"""
+micro-benchmark of chunked KernelPooling
+
+compares KernelPooling pooling all kernels in one expanded tensor
+(kernel_chunk = 0) with pooling kernel_chunk kernels at a time, on random
+translation matrices of the KNRM shape (batch x entities x entities), with the
+kernels of NNPara.form_kernels.
+checks that both give the same kernel features within tolerance, and reports
+the time per batch, the largest expanded tensor, and on cuda the peak memory.
+
+usage:
+    python -m knowledge4ir.salience.benchmark.kernel_pooling [--KernelPoolingBenchmark.x=y]
+"""
+
+import json
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+from traitlets import (
+    Int,
+    Float,
+    List,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.base import NNPara, KernelPooling
+from knowledge4ir.salience.utils.device import use_cuda
+
+
+class KernelPoolingBenchmark(Configurable):
+    batch_size = Int(64, help='docs per batch').tag(config=True)
+    nb_batch = Int(10, help='number of batches to time').tag(config=True)
+    max_e = Int(200, help='entities per doc').tag(config=True)
+    l_kernel_chunk = List(Int, default_value=[1, 4],
+                          help='kernel chunks to compare with pooling all'
+                          ).tag(config=True)
+    tolerance = Float(1e-4, help='max absolute difference allowed').tag(
+        config=True)
+    seed = Int(0, help='random seed').tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(KernelPoolingBenchmark, self).__init__(**kwargs)
+        self.para = NNPara(**kwargs)
+        self.l_mu, self.l_sigma = self.para.form_kernels()
+        np.random.seed(self.seed)
+
+    def _random_batch(self):
+        emb = np.random.randn(self.batch_size, self.max_e, 50)
+        emb /= np.linalg.norm(emb, axis=-1, keepdims=True)
+        trans_mtx = np.matmul(emb, emb.transpose(0, 2, 1)).astype(np.float32)
+        mtx_score = np.random.randint(
+            1, 10, (self.batch_size, self.max_e)).astype(np.float32)
+        trans_mtx = Variable(torch.from_numpy(trans_mtx))
+        mtx_score = Variable(torch.from_numpy(mtx_score))
+        if use_cuda():
+            trans_mtx = trans_mtx.cuda()
+            mtx_score = mtx_score.cuda()
+        return trans_mtx, mtx_score
+
+    def _time(self, kp, l_batch):
+        if use_cuda():
+            torch.cuda.synchronize()
+            if hasattr(torch.cuda, 'reset_max_memory_allocated'):
+                torch.cuda.reset_max_memory_allocated()
+        l_out = []
+        st = time.time()
+        for trans_mtx, mtx_score in l_batch:
+            l_out.append(kp(trans_mtx, mtx_score))
+            if use_cuda():
+                torch.cuda.synchronize()
+        ms = 1000 * (time.time() - st) / len(l_batch)
+        peak_mb = None
+        if use_cuda() and hasattr(torch.cuda, 'max_memory_allocated'):
+            peak_mb = torch.cuda.max_memory_allocated() / 1e6
+        return l_out, ms, peak_mb
+
+    def _expanded_mb(self, kernel_chunk):
+        nb_kernel = kernel_chunk if kernel_chunk else len(self.l_mu)
+        return 4.0 * self.batch_size * self.max_e * self.max_e * min(
+            nb_kernel, len(self.l_mu)) / 1e6
+
+    def run(self):
+        l_batch = [self._random_batch() for __ in xrange(self.nb_batch)]
+        kp = KernelPooling(self.l_mu, self.l_sigma)
+        l_ref, ms, peak_mb = self._time(kp, l_batch)
+        l_res = [{
+            'kernel_chunk': 0,
+            'ms_per_batch': ms,
+            'expanded_mb': self._expanded_mb(0),
+            'cuda_peak_mb': peak_mb,
+        }]
+        for kernel_chunk in self.l_kernel_chunk:
+            kp = KernelPooling(self.l_mu, self.l_sigma, kernel_chunk)
+            l_out, ms, peak_mb = self._time(kp, l_batch)
+            max_diff = max([(ref - out).abs().max().data.cpu().numpy().item()
+                            for ref, out in zip(l_ref, l_out)])
+            assert max_diff <= self.tolerance
+            l_res.append({
+                'kernel_chunk': kernel_chunk,
+                'ms_per_batch': ms,
+                'expanded_mb': self._expanded_mb(kernel_chunk),
+                'cuda_peak_mb': peak_mb,
+                'max_abs_diff': max_diff,
+            })
+        h_res = {
+            'nb_kernel': len(self.l_mu),
+            'batch_size': self.batch_size,
+            'max_e': self.max_e,
+            'runs': l_res,
+        }
+        logging.info('kernel pooling benchmark %s', json.dumps(h_res))
+        return h_res
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_command_line_config,
+    )
+
+    set_basic_log()
+    if '-h' in sys.argv[1:]:
+        KernelPoolingBenchmark.class_print_help()
+        NNPara.class_print_help()
+        sys.exit(-1)
+    benchmark = KernelPoolingBenchmark(
+        config=load_command_line_config(sys.argv[1:]))
+    print json.dumps(benchmark.run(), indent=1)
@@ -0,0 +1,98 @@
+"""
+accuracy vs latency sweep of pre-screening (PreScreener.top_n)
+
+loads a trained model, and predicts the test data with each top_n in l_top_n
+(0 for no pre-screening). reports the prediction time, docs per second and
+the SalienceEva metrics of each output (entity and event ones for the joint
+center), and the metric changes from the first top_n.
+
+usage:
+    python -m knowledge4ir.salience.benchmark.prescreen center_config [--PreScreenSweep.x=y]
+    the center config is the one the model is trained with
+"""
+
+import json
+import logging
+import os
+import time
+
+from traitlets import (
+    Bool,
+    Int,
+    List,
+    Unicode,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.center import SalienceModelCenter
+from knowledge4ir.salience.joint_center import JointSalienceModelCenter
+
+
+class PreScreenSweep(Configurable):
+    model_in = Unicode(help='trained model').tag(config=True)
+    test_in = Unicode(help='testing data').tag(config=True)
+    out_dir = Unicode(help='dir of the predictions and the report').tag(
+        config=True)
+    l_top_n = List(Int, default_value=[0, 100, 50, 20, 10],
+                   help='candidates kept per doc, 0 to keep all').tag(
+        config=True)
+    joint = Bool(False, help='use the joint entity and event center').tag(
+        config=True)
+
+    def __init__(self, **kwargs):
+        super(PreScreenSweep, self).__init__(**kwargs)
+        if self.joint:
+            self.center = JointSalienceModelCenter(**kwargs)
+        else:
+            self.center = SalienceModelCenter(**kwargs)
+
+    def run(self):
+        nb_doc = sum([1 for __ in open(self.test_in)])
+        l_res = []
+        for top_n in self.l_top_n:
+            self.center.load_model(self.model_in)
+            self.center.prescreener.top_n = top_n
+            out_name = os.path.join(self.out_dir, 'predict.top_%d.json' % top_n)
+            st = time.time()
+            self.center.predict(self.test_in, out_name)
+            sec = time.time() - st
+            # one eval per output, the joint center has entity and event ones
+            l_eva = [dict(json.load(open(name + '.eval')))
+                     for name in self.center._predict_out_names(out_name)]
+            l_res.append({
+                'top_n': top_n,
+                'sec': sec,
+                'docs_per_sec': nb_doc / max(sec, 1e-6),
+                'eval': l_eva,
+            })
+            logging.info('top [%d] predicted in [%.2f] sec, eval %s', top_n,
+                         sec, json.dumps(l_eva))
+
+        l_base_eva = l_res[0]['eval']
+        for h_res in l_res:
+            h_res['eval_diff'] = [
+                dict([(metric, h_eva[metric] - h_base[metric])
+                      for metric in h_base if metric in h_eva])
+                for h_eva, h_base in zip(h_res['eval'], l_base_eva)]
+        json.dump(l_res, open(os.path.join(self.out_dir, 'prescreen.json'),
+                              'w'), indent=1)
+        return l_res
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_py_config,
+        load_command_line_config,
+    )
+
+    set_basic_log()
+    if 2 > len(sys.argv):
+        print "1 para, center config, followed by command line configs"
+        PreScreenSweep.class_print_help()
+        sys.exit(-1)
+    conf = load_py_config(sys.argv[1])
+    conf.merge(load_command_line_config(sys.argv[2:]))
+    sweep = PreScreenSweep(config=conf)
+    print json.dumps(sweep.run(), indent=1)
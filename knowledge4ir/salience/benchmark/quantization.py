@@ -0,0 +1,83 @@
+"""
+accuracy vs memory report of quantized embedding tables
+
+loads a trained model, and predicts the test data with its embedding tables
+in float32, float16 and int8 (SalienceModelCenter.emb_quantization).
+reports the bytes of the embedding tables and the SalienceEva metrics of each,
+and the metric changes from float32.
+
+usage:
+    python -m knowledge4ir.salience.benchmark.quantization center_config [--QuantizationReport.x=y]
+    the center config is the one the model is trained with
+"""
+
+import json
+import logging
+import os
+
+from traitlets import (
+    List,
+    Unicode,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.center import SalienceModelCenter
+from knowledge4ir.salience.utils.quantize import embedding_nbytes
+
+
+class QuantizationReport(Configurable):
+    model_in = Unicode(help='trained model').tag(config=True)
+    test_in = Unicode(help='testing data').tag(config=True)
+    out_dir = Unicode(help='dir of the predictions and the report').tag(
+        config=True)
+    l_mode = List(Unicode, default_value=['', 'float16', 'int8'],
+                  help='quantization modes, empty for float32').tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(QuantizationReport, self).__init__(**kwargs)
+        self.center = SalienceModelCenter(**kwargs)
+
+    def run(self):
+        l_res = []
+        for mode in self.l_mode:
+            name = mode if mode else 'float32'
+            self.center.load_model(self.model_in)
+            self.center.emb_quantization = mode
+            out_name = os.path.join(self.out_dir, 'predict.%s.json' % name)
+            self.center.predict(self.test_in, out_name)
+            h_eva = dict(json.load(open(out_name + '.eval')))
+            l_res.append({
+                'mode': name,
+                'embedding_mb': embedding_nbytes(self.center.model) / 1e6,
+                'eval': h_eva,
+            })
+            logging.info('[%s] embedding [%.2f] MB, eval %s', name,
+                         l_res[-1]['embedding_mb'], json.dumps(h_eva))
+
+        h_base = l_res[0]['eval']
+        for h_res in l_res:
+            h_res['eval_diff'] = dict(
+                [(metric, h_res['eval'][metric] - h_base[metric])
+                 for metric in h_base if metric in h_res['eval']])
+        json.dump(l_res, open(os.path.join(self.out_dir, 'quantization.json'),
+                              'w'), indent=1)
+        return l_res
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_py_config,
+        load_command_line_config,
+    )
+
+    set_basic_log()
+    if 2 > len(sys.argv):
+        print "1 para, center config, followed by command line configs"
+        QuantizationReport.class_print_help()
+        sys.exit(-1)
+    conf = load_py_config(sys.argv[1])
+    conf.merge(load_command_line_config(sys.argv[2:]))
+    report = QuantizationReport(config=conf)
+    print json.dumps(report.run(), indent=1)
@@ -0,0 +1,142 @@
+"""
+benchmark of sparse gradient embedding training
+
+trains KNRM on random batches, once with the dense path (Adam on all the
+parameters) and once with SalienceModelCenter.sparse_emb (sparse embedding
+gradients, SparseDenseAdam), from the same initial weights.
+reports the time per train step, the bytes of the embedding gradient and of
+the optimizer states, and the average loss of each.
+
+usage:
+    python -m knowledge4ir.salience.benchmark.sparse_emb [--SparseEmbeddingBenchmark.x=y] [--NNPara.x=y]
+"""
+
+import copy
+import json
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+from traitlets import (
+    Float,
+    Int,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.base import NNPara, ExtData
+from knowledge4ir.salience.knrm_vote import KNRM
+from knowledge4ir.salience.utils.device import use_cuda
+from knowledge4ir.salience.utils.ranking_loss import hinge_loss
+from knowledge4ir.salience.utils.sparse_optim import SparseDenseAdam
+
+
+def _state_nbytes(optimizer):
+    l_optimizer = getattr(optimizer, 'l_optimizer', [optimizer])
+    nbytes = 0
+    for opt in l_optimizer:
+        for h_state in opt.state.values():
+            for value in h_state.values():
+                if torch.is_tensor(value):
+                    if value.is_sparse:
+                        value = value._values()
+                    nbytes += value.numel() * value.element_size()
+    return nbytes
+
+
+class SparseEmbeddingBenchmark(Configurable):
+    entity_vocab_size = Int(1000000, help='entity vocabulary size').tag(
+        config=True)
+    batch_size = Int(32, help='docs per batch').tag(config=True)
+    max_e = Int(100, help='entities per doc').tag(config=True)
+    nb_batch = Int(20, help='number of batches to train').tag(config=True)
+    learning_rate = Float(1e-3, help='learning rate').tag(config=True)
+    seed = Int(0, help='random seed').tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(SparseEmbeddingBenchmark, self).__init__(**kwargs)
+        self.para = NNPara(**kwargs)
+        self.para.entity_vocab_size = self.entity_vocab_size
+        np.random.seed(self.seed)
+        torch.manual_seed(self.seed)
+
+    def _random_batch(self):
+        mtx_e = np.random.randint(1, self.entity_vocab_size,
+                                  (self.batch_size, self.max_e))
+        mtx_score = np.random.randint(
+            1, 10, (self.batch_size, self.max_e)).astype(np.float32)
+        label = np.random.choice([-1, 1], (self.batch_size, self.max_e))
+        h_packed_data = {
+            'mtx_e': Variable(torch.from_numpy(mtx_e)),
+            'mtx_score': Variable(torch.from_numpy(mtx_score)),
+        }
+        m_label = Variable(torch.from_numpy(label.astype(np.float32)))
+        if use_cuda():
+            h_packed_data = dict([(key, value.cuda())
+                                  for key, value in h_packed_data.items()])
+            m_label = m_label.cuda()
+        return h_packed_data, m_label
+
+    def _train(self, model, optimizer, l_batch):
+        total_loss = 0
+        grad_bytes = 0
+        st = time.time()
+        for h_packed_data, m_label in l_batch:
+            optimizer.zero_grad()
+            loss = hinge_loss(model(h_packed_data), m_label)
+            loss.backward()
+            grad = model.embedding.weight.grad.data
+            if grad.is_sparse:
+                grad = grad._values()
+            grad_bytes = max(grad_bytes, grad.numel() * grad.element_size())
+            optimizer.step()
+            total_loss += loss.data[0]
+            if use_cuda():
+                torch.cuda.synchronize()
+        return {
+            'ms_per_batch': 1000 * (time.time() - st) / len(l_batch),
+            'emb_grad_mb': grad_bytes / 1e6,
+            'optimizer_state_mb': _state_nbytes(optimizer) / 1e6,
+            'average_loss': total_loss / len(l_batch),
+        }
+
+    def run(self):
+        l_batch = [self._random_batch() for __ in xrange(self.nb_batch)]
+        dense_model = KNRM(self.para, ExtData())
+        sparse_model = copy.deepcopy(dense_model)
+
+        dense_optimizer = torch.optim.Adam(
+            filter(lambda model_para: model_para.requires_grad,
+                   dense_model.parameters()),
+            lr=self.learning_rate)
+        h_res = {
+            'entity_vocab_size': self.entity_vocab_size,
+            'embedding_dim': self.para.embedding_dim,
+            'batch_size': self.batch_size,
+            'max_e': self.max_e,
+            'dense': self._train(dense_model, dense_optimizer, l_batch),
+            'sparse': self._train(sparse_model,
+                                  SparseDenseAdam(sparse_model,
+                                                  self.learning_rate),
+                                  l_batch),
+        }
+        logging.info('sparse embedding benchmark %s', json.dumps(h_res))
+        return h_res
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_command_line_config,
+    )
+
+    set_basic_log()
+    if '-h' in sys.argv[1:]:
+        SparseEmbeddingBenchmark.class_print_help()
+        NNPara.class_print_help()
+        sys.exit(-1)
+    benchmark = SparseEmbeddingBenchmark(
+        config=load_command_line_config(sys.argv[1:]))
+    print json.dumps(benchmark.run(), indent=1)
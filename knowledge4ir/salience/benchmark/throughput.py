@@ -0,0 +1,284 @@
+"""
+throughput benchmark of the SalienceModelCenter models on a synthetic corpus
+
+generates hashed docs in the CorpusHasher output schema (word ids of the text
+fields, spot and event fields with ids/features/salience, and the adjacent
+lists), and a matching ExtData of random embeddings, descriptions and NLSS.
+then for each model in SalienceModelCenter.h_model, on cpu, in its own process:
+    trains one epoch over the corpus, and predicts it
+and records the docs/sec of both, and the peak RSS of the process.
+models that fail to build or run (e.g. those needing the joint io) are
+recorded with their error, as are models whose process dies (e.g. killed
+for oom) without a result.
+
+the results are dumped as json, to compare data io and model changes across
+commits.
+
+usage:
+    python -m knowledge4ir.salience.benchmark.throughput [--ThroughputBenchmark.x=y]
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import traceback
+from Queue import Empty
+
+import numpy as np
+from traitlets import (
+    Int,
+    List,
+    Unicode,
+)
+from traitlets.config import Config, Configurable
+
+from knowledge4ir.salience.center import SalienceModelCenter
+from knowledge4ir.utils import (
+    body_field,
+    abstract_field,
+    salience_gold,
+)
+
+
+class ThroughputBenchmark(Configurable):
+    l_model_name = List(Unicode, default_value=[],
+                        help='models to benchmark, default all in h_model'
+                        ).tag(config=True)
+    nb_doc = Int(500, help='number of synthetic docs').tag(config=True)
+    max_e = Int(50, help='max entities in a doc').tag(config=True)
+    max_evm = Int(30, help='max events in a doc').tag(config=True)
+    max_arg = Int(3, help='max arguments of an event').tag(config=True)
+    max_w = Int(300, help='max words in a doc body').tag(config=True)
+    e_vocab_size = Int(10000, help='entity vocabulary size').tag(config=True)
+    evm_vocab_size = Int(1000, help='event vocabulary size').tag(config=True)
+    w_vocab_size = Int(20000, help='word vocabulary size').tag(config=True)
+    embedding_dim = Int(50, help='embedding dimension').tag(config=True)
+    e_feature_dim = Int(3, help='entity feature dimension').tag(config=True)
+    desp_len = Int(20, help='words per entity description').tag(config=True)
+    nb_nlss = Int(5, help='NLSS per entity').tag(config=True)
+    nlss_len = Int(20, help='words per NLSS').tag(config=True)
+    batch_size = Int(16, help='docs per training batch').tag(config=True)
+    predict_batch_size = Int(
+        16, help='docs per batch in predict').tag(config=True)
+    seed = Int(0, help='random seed').tag(config=True)
+    work_dir = Unicode(
+        help='dir for the synthetic data and models, default a tmp dir that'
+             ' is removed afterwards').tag(config=True)
+    out_name = Unicode('throughput.json', help='json results out').tag(
+        config=True)
+
+    def __init__(self, **kwargs):
+        super(ThroughputBenchmark, self).__init__(**kwargs)
+        self.rng = random.Random(self.seed)
+        np.random.seed(self.seed)
+        if not self.l_model_name:
+            self.l_model_name = sorted(SalienceModelCenter.h_model.keys())
+
+    def _synthetic_spot(self, l_e):
+        rng = self.rng
+        return {
+            'entities': l_e,
+            'features': [[rng.randint(1, 9)] + [
+                rng.random() for __ in xrange(self.e_feature_dim - 1)]
+                         for __ in l_e],
+            salience_gold: [rng.choice([0, 1]) for __ in l_e],
+        }
+
+    def _synthetic_doc(self, p):
+        rng = self.rng
+        l_e = rng.sample(xrange(1, self.e_vocab_size),
+                         rng.randint(1, self.max_e))
+        l_abs_e = rng.sample(l_e, rng.randint(0, len(l_e)))
+        l_h = [rng.randint(1, self.evm_vocab_size - 1)
+               for __ in xrange(rng.randint(0, self.max_evm))]
+        return {
+            'docno': 'synthetic_%d' % p,
+            body_field: [rng.randint(1, self.w_vocab_size - 1)
+                         for __ in xrange(rng.randint(1, self.max_w))],
+            abstract_field: [rng.randint(1, self.w_vocab_size - 1)
+                             for __ in xrange(rng.randint(1, self.max_w / 5))],
+            'spot': {
+                body_field: self._synthetic_spot(l_e),
+                abstract_field: self._synthetic_spot(l_abs_e),
+            },
+            'event': {
+                body_field: {
+                    'sparse_features': {'LexicalHead': l_h},
+                    'features': [[rng.random() for __ in xrange(15)]
+                                 for __ in l_h],
+                    'salience': [rng.choice([0, 1]) for __ in l_h],
+                },
+            },
+            'adjacent': [rng.sample(l_e, min(len(l_e),
+                                             rng.randint(0, self.max_arg)))
+                         for __ in l_h],
+        }
+
+    def _dump_data(self, work_dir):
+        corpus_in = os.path.join(work_dir, 'corpus.json')
+        with open(corpus_in, 'w') as out:
+            for p in xrange(self.nb_doc):
+                print >> out, json.dumps(self._synthetic_doc(p))
+
+        h_ext = {
+            'entity_emb_in': np.random.randn(
+                self.e_vocab_size, self.embedding_dim),
+            'word_emb_in': np.random.randn(
+                self.w_vocab_size, self.embedding_dim),
+            'entity_desp_in': np.random.randint(
+                0, self.w_vocab_size, (self.e_vocab_size, self.desp_len)),
+            'entity_nlss_in': np.random.randint(
+                0, self.w_vocab_size,
+                (self.e_vocab_size, self.nb_nlss, self.nlss_len)),
+        }
+        h_ext_in = {}
+        for key, mtx in h_ext.items():
+            if mtx.dtype == np.float64:
+                mtx = mtx.astype(np.float32)
+            h_ext_in[key] = os.path.join(work_dir, key + '.npy')
+            np.save(open(h_ext_in[key], 'wb'), mtx)
+        return corpus_in, h_ext_in
+
+    def _center_config(self, model_name, h_ext_in):
+        conf = Config()
+        conf.SalienceModelCenter.model_name = model_name
+        conf.SalienceModelCenter.device = 'cpu'
+        conf.SalienceModelCenter.nb_epochs = 1
+        conf.SalienceModelCenter.batch_size = self.batch_size
+        conf.SalienceModelCenter.predict_batch_size = self.predict_batch_size
+        conf.NNPara.node_feature_dim = self.e_feature_dim
+        conf.NNPara.e_feature_dim = self.e_feature_dim
+        conf.NNPara.desp_sent_len = self.desp_len
+        conf.DataIO.e_feature_dim = self.e_feature_dim
+        conf.DataIO.max_e_per_d = self.max_e
+        conf.DataIO.max_w_per_d = self.max_w
+        for key, in_name in h_ext_in.items():
+            setattr(conf.ExtData, key, in_name)
+        return conf
+
+    def _run_model(self, model_name, corpus_in, h_ext_in, work_dir):
+        h_res = {'model_name': model_name}
+        center = SalienceModelCenter(
+            config=self._center_config(model_name, h_ext_in))
+        model_out = os.path.join(work_dir, model_name, 'model')
+        st = time.time()
+        center.train(corpus_in, model_out_name=model_out)
+        h_res['train_docs_per_sec'] = self.nb_doc / max(time.time() - st,
+                                                        1e-6)
+        st = time.time()
+        center.predict(corpus_in, os.path.join(work_dir, model_name,
+                                               'predict.json'))
+        h_res['predict_docs_per_sec'] = self.nb_doc / max(time.time() - st,
+                                                          1e-6)
+        return h_res
+
+    def _run_model_process(self, model_name, corpus_in, h_ext_in, work_dir,
+                           queue):
+        try:
+            h_res = self._run_model(model_name, corpus_in, h_ext_in, work_dir)
+        except Exception:
+            logging.warn('model [%s] failed:\n%s', model_name,
+                         traceback.format_exc())
+            h_res = {
+                'model_name': model_name,
+                'error': traceback.format_exc().strip().splitlines()[-1],
+            }
+        # ru_maxrss is in KB on linux
+        h_res['peak_rss_mb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        queue.put(h_res)
+
+    @classmethod
+    def _wait_result(cls, model_name, proc, queue, poll_interval=5):
+        """
+        the result of the model's process, or its exit code as error if it
+        died without one
+        """
+        while True:
+            try:
+                return queue.get(timeout=poll_interval)
+            except Empty:
+                if proc.is_alive():
+                    continue
+            # it may have put the result right before exiting
+            try:
+                return queue.get(timeout=poll_interval)
+            except Empty:
+                logging.warn('model [%s] process died with exit code [%s]',
+                             model_name, proc.exitcode)
+                return {
+                    'model_name': model_name,
+                    'error': 'process died with exit code %s' % proc.exitcode,
+                }
+
+    @classmethod
+    def _git_commit(cls):
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+
+    def run(self):
+        work_dir = self.work_dir
+        if not work_dir:
+            work_dir = tempfile.mkdtemp(prefix='salience_throughput_')
+        elif not os.path.exists(work_dir):
+            os.makedirs(work_dir)
+        corpus_in, h_ext_in = self._dump_data(work_dir)
+
+        l_res = []
+        for model_name in self.l_model_name:
+            logging.info('benchmarking [%s]', model_name)
+            queue = multiprocessing.Queue()
+            proc = multiprocessing.Process(
+                target=self._run_model_process,
+                args=(model_name, corpus_in, h_ext_in, work_dir, queue))
+            proc.start()
+            h_res = self._wait_result(model_name, proc, queue)
+            proc.join()
+            logging.info('[%s] throughput %s', model_name, json.dumps(h_res))
+            l_res.append(h_res)
+
+        if not self.work_dir:
+            shutil.rmtree(work_dir)
+
+        h_total = {
+            'commit': self._git_commit(),
+            'device': 'cpu',
+            'nb_doc': self.nb_doc,
+            'max_e': self.max_e,
+            'max_evm': self.max_evm,
+            'max_w': self.max_w,
+            'embedding_dim': self.embedding_dim,
+            'batch_size': self.batch_size,
+            'predict_batch_size': self.predict_batch_size,
+            'models': l_res,
+        }
+        json.dump(h_total, open(self.out_name, 'w'), indent=1)
+        logging.info('throughput results dumped to [%s]', self.out_name)
+        return h_total
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_command_line_config,
+    )
+
+    set_basic_log()
+    if '-h' in sys.argv[1:]:
+        ThroughputBenchmark.class_print_help()
+        sys.exit(-1)
+    benchmark = ThroughputBenchmark(
+        config=load_command_line_config(sys.argv[1:]))
+    print json.dumps(benchmark.run(), indent=1)
@@ -0,0 +1,263 @@
+"""
+self-contained inference bundles of trained salience models
+
+export_bundle() packs what scoring a trained model needs into one file:
+    version: BUNDLE_VERSION, checked at loading
+    model_name: the model's key in SalienceModelCenter.h_model
+    para: the NNPara config values
+    io: the DataIO config values
+    state_dict: the model's trained weights
+    listed_modules: weights of sub modules kept in plain lists (e.g. the
+        description CNNs of GlossCNNKNRM), which state_dict() misses
+    ext_shapes: shapes of the ExtData embedding tables, their values are in
+        state_dict already
+    ext_data: the ExtData arrays the model reads at forward (desp, nlss, rdf)
+    entity_id_map: kept original entity ids, if the entity tables are sliced
+
+with l_kept_e (e.g. the entity_id_map.npy of prune_ext_data), the entity
+embedding and the desp/nlss/rdf rows are sliced to those entities, and the
+scorer maps doc entity ids the same way DataIO.entity_id_map_in does.
+
+SalienceScorer loads a bundle without any training config or ExtData path,
+and only does batched scoring of hashed docs (doc by doc for the models that
+are not exact in padded batches).
+
+only models using DataIO (not the joint EventDataIO ones) are supported.
+
+usage:
+    export: python -m knowledge4ir.salience.bundle center_config [--BundleExporter.x=y]
+"""
+
+import json
+import logging
+
+import numpy as np
+import torch
+from torch import nn
+from traitlets import (
+    Unicode,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.base import NNPara, ExtData
+from knowledge4ir.salience.utils.data_io import DataIO
+from knowledge4ir.salience.utils.device import map_location
+
+BUNDLE_VERSION = 1
+
+EXT_EMB_FIELDS = ['entity_emb', 'event_emb', 'word_emb']
+EXT_DATA_FIELDS = ['entity_desp', 'entity_rdf', 'entity_nlss']
+# attribute names of the entity embedding tables in the models
+ENTITY_EMB_NAMES = ['embedding']
+
+
+def _config_values(configurable):
+    return dict([(name, getattr(configurable, name))
+                 for name in configurable.trait_names(config=True)])
+
+
+def _listed_modules(model):
+    """
+    sub modules the model keeps in python lists, not registered to it
+    :return: h[attribute name] = list of modules
+    """
+    h_listed = {}
+    for name, value in model.__dict__.items():
+        if (type(value) is list) and value and all(
+                [isinstance(item, nn.Module) for item in value]):
+            h_listed[name] = value
+    return h_listed
+
+
+def _entity_embeddings(model, entity_vocab_size):
+    """
+    the entity embedding tables, by their attribute names, not their sizes,
+    so other tables of the same size are not sliced with them
+    """
+    l_emb = []
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Embedding):
+            continue
+        if name.split('.')[-1] not in ENTITY_EMB_NAMES:
+            continue
+        if module.num_embeddings != entity_vocab_size:
+            logging.error('entity embedding [%s] has [%d] rows, not the [%d]'
+                          ' entities', name, module.num_embeddings,
+                          entity_vocab_size)
+            raise ValueError
+        l_emb.append((name, module))
+    return l_emb
+
+
+def export_bundle(center, out_name, l_kept_e=None):
+    """
+    :param center: a SalienceModelCenter with the trained model loaded
+    :param out_name: the bundle file
+    :param l_kept_e: original entity ids to keep, 0 first, None to keep all
+    """
+    model = center.model
+    ext_data = center.ext_data
+    h_para = _config_values(center.para)
+    h_io = _config_values(center.io_parser)
+    h_io['entity_id_map_in'] = ''
+    h_io['l_target_data'] = list(center.io_parser.l_target_data)
+
+    h_state = dict([(key, value.cpu())
+                    for key, value in model.state_dict().items()])
+    h_ext_data = {}
+    for field in EXT_DATA_FIELDS:
+        if getattr(ext_data, field) is not None:
+            h_ext_data[field] = np.asarray(getattr(ext_data, field))
+    h_ext_shapes = {}
+    for field in EXT_EMB_FIELDS:
+        if getattr(ext_data, field) is not None:
+            h_ext_shapes[field] = list(getattr(ext_data, field).shape)
+
+    l_id_map = center.io_parser.l_kept_e_id
+    if l_kept_e is not None:
+        # the model's entity ids must still be the original ones to slice
+        assert l_id_map is None
+        l_id_map = l_kept_e
+        v_kept_e = np.array(l_kept_e, dtype=np.int64)
+        ts_kept_e = torch.from_numpy(v_kept_e)
+        for name, __ in _entity_embeddings(model, center.para.entity_vocab_size):
+            key = (name + '.weight') if name else 'weight'
+            h_state[key] = h_state[key].index_select(0, ts_kept_e)
+        for field in h_ext_data:
+            h_ext_data[field] = h_ext_data[field][v_kept_e]
+        if 'entity_emb' in h_ext_shapes:
+            h_ext_shapes['entity_emb'][0] = len(l_kept_e)
+        h_para['entity_vocab_size'] = len(l_kept_e)
+        logging.info('bundle entity tables sliced to [%d] entities',
+                     len(l_kept_e))
+
+    h_bundle = {
+        'version': BUNDLE_VERSION,
+        'model_name': center.model_name,
+        'para': h_para,
+        'io': h_io,
+        'state_dict': h_state,
+        'listed_modules': dict([
+            (name, [module.state_dict() for module in l_module])
+            for name, l_module in _listed_modules(model).items()]),
+        'ext_shapes': h_ext_shapes,
+        'ext_data': h_ext_data,
+        'entity_id_map': l_id_map,
+    }
+    torch.save(h_bundle, out_name)
+    logging.info('model [%s] bundled to [%s]', center.model_name, out_name)
+
+
+class SalienceScorer(object):
+    """
+    batched scoring with a bundled model
+    """
+
+    def __init__(self, bundle_in):
+        from knowledge4ir.salience.center import SalienceModelCenter
+
+        logging.info('loading salience bundle [%s]', bundle_in)
+        h_bundle = torch.load(bundle_in, map_location=map_location())
+        if h_bundle.get('version') != BUNDLE_VERSION:
+            logging.error('bundle version [%s] is not [%d]',
+                          h_bundle.get('version'), BUNDLE_VERSION)
+            raise ValueError
+        self.model_name = h_bundle['model_name']
+        para = NNPara(**h_bundle['para'])
+        ext_data = ExtData()
+        for field, shape in h_bundle['ext_shapes'].items():
+            # placeholders for the model init, overwritten by the state dict
+            setattr(ext_data, field, np.zeros(shape, dtype=np.float32))
+        for field, mtx in h_bundle['ext_data'].items():
+            setattr(ext_data, field, mtx)
+
+        self.model = SalienceModelCenter.h_model[self.model_name](para,
+                                                                  ext_data)
+        self.model.load_state_dict(h_bundle['state_dict'])
+        h_listed = _listed_modules(self.model)
+        for name, l_state in h_bundle['listed_modules'].items():
+            for module, h_state in zip(h_listed[name], l_state):
+                module.load_state_dict(h_state)
+        self.model.eval()
+        ext_data.release_embeddings()
+
+        self.io_parser = DataIO(**h_bundle['io'])
+        if h_bundle['entity_id_map'] is not None:
+            self.io_parser.l_kept_e_id = list(h_bundle['entity_id_map'])
+            self.io_parser.h_e_id_map = dict(zip(
+                self.io_parser.l_kept_e_id,
+                range(len(self.io_parser.l_kept_e_id))))
+        self.model.config_io(self.io_parser)
+        logging.info('model [%s] ready to score', self.model_name)
+
+    def score(self, l_h_info):
+        """
+        :param l_h_info: hashed docs, in CorpusHasher's format, json loaded
+        :return: a list of [(entity id, score)], one per doc, empty for docs
+            without entities
+        models not exact in padded batches (batch_predict_exact) score the
+        docs one by one, as SalienceModelCenter predicts them
+        """
+        l_res = [[] for __ in l_h_info]
+        l_p = [p for p, h_info in enumerate(l_h_info)
+               if not self.io_parser.is_empty_info(h_info)]
+        if not l_p:
+            return l_res
+        if getattr(self.model, 'batch_predict_exact', True):
+            ll_p = [l_p]
+        else:
+            ll_p = [[p] for p in l_p]
+        for l_batch_p in ll_p:
+            for p, l_e_score in zip(l_batch_p, self._score_batch(
+                    [l_h_info[p] for p in l_batch_p])):
+                l_res[p] = l_e_score
+        return l_res
+
+    def _score_batch(self, l_h_info):
+        l_doc = [self.io_parser.parse_doc(h_info) for h_info in l_h_info]
+        l_nb_e = [len(h_doc['mtx_e']) for h_doc in l_doc]
+        h_packed_data, __ = self.io_parser.parse_data(l_doc)
+        m_e = h_packed_data['mtx_e'].cpu().data
+        m_output = self.model(h_packed_data).cpu().data
+        l_res = []
+        for i, nb_e in enumerate(l_nb_e):
+            l_e = self.io_parser.original_entity_ids(
+                m_e[i][:nb_e].numpy().tolist())
+            l_res.append(zip(l_e, m_output[i][:nb_e].numpy().tolist()))
+        return l_res
+
+
+class BundleExporter(Configurable):
+    model_in = Unicode(help='trained model').tag(config=True)
+    bundle_out = Unicode(help='bundle output').tag(config=True)
+    entity_id_map_in = Unicode(
+        help='npy of the entity ids to keep, e.g. from prune_ext_data;'
+             ' empty to keep all').tag(config=True)
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_py_config,
+        load_command_line_config,
+    )
+    from knowledge4ir.salience.center import SalienceModelCenter
+
+    set_basic_log()
+    if 2 > len(sys.argv):
+        print "1 para, the center config of the model, followed by command" \
+              " line configs"
+        BundleExporter.class_print_help()
+        sys.exit(-1)
+    conf = load_py_config(sys.argv[1])
+    conf.merge(load_command_line_config(sys.argv[2:]))
+    para = BundleExporter(config=conf)
+    center = SalienceModelCenter(config=conf)
+    center.load_model(para.model_in)
+    l_kept_e = None
+    if para.entity_id_map_in:
+        l_kept_e = np.load(para.entity_id_map_in).tolist()
+    export_bundle(center, para.bundle_out, l_kept_e)
+    print json.dumps({'model_name': center.model_name,
+                      'bundle_out': para.bundle_out})
@@ -19,10 +19,12 @@ hyper-parameters:
 
 """
 
+import itertools
 import json
 import logging
 import math
 import os
+import random
 
 import numpy as np
 import torch
@@ -53,6 +55,20 @@ from knowledge4ir.salience.graph_model import (
     AverageArgumentKernelCRF,
 )
 from knowledge4ir.salience.utils.data_io import DataIO
+from knowledge4ir.salience.utils.binary_cache import BinaryCorpus
+from knowledge4ir.salience.utils.hashed_binary import (
+    HashedBinaryCorpus,
+    HashedDoc,
+    is_hashed_binary,
+)
+from knowledge4ir.salience.utils.batch_sampler import (
+    LineCorpus,
+    BucketBatchSampler,
+)
+from knowledge4ir.salience.utils.prefetch import (
+    PrefetchLoader,
+    PackedBatch,
+)
 from knowledge4ir.salience.deprecated.adj_knrm import AdjKNRM
 from knowledge4ir.salience.deprecated.duet import DuetGlossCNN
 from knowledge4ir.salience.deprecated.local_context import (
@@ -73,6 +89,14 @@ from knowledge4ir.salience.utils.data_io import (
     adj_edge_io,
 )
 from knowledge4ir.salience.utils.evaluation import SalienceEva
+from knowledge4ir.salience.utils import profiler
+from knowledge4ir.salience.utils.prescreen import PreScreener
+from knowledge4ir.salience.utils.sparse_optim import SparseDenseAdam
+from knowledge4ir.salience.utils.sharded_predict import sharded_predict
+from knowledge4ir.salience.utils.quantize import (
+    quantize_embeddings,
+    embedding_nbytes,
+)
 from knowledge4ir.salience.utils.ranking_loss import (
     hinge_loss,
     pairwise_loss,
@@ -83,8 +107,12 @@ from knowledge4ir.utils import (
     mutiply_svm_feature,
     salience_gold
 )
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import (
+    set_device,
+    to_device,
+    map_location,
+    use_cuda,
+)
 
 
 class SalienceModelCenter(Configurable):
@@ -110,11 +138,67 @@ class SalienceModelCenter(Configurable):
     #     config=True)
     # The above 3 configs should be deprecated with the old io.
 
+    device = Unicode('auto', help='device to run models and io on:'
+                                  ' auto | cpu | cuda').tag(config=True)
+
     use_new_io = Bool(True, help='whether use the new IO format').tag(
         config=True
     )
     predict_with_intermediate_res = Bool(
         False, help='whether to kee intermediate results').tag(config=True)
+    predict_batch_size = Int(
+        1, help='number of documents per batch in predict, 1 to predict doc by'
+                ' doc. Models normalizing over all the entities in the doc'
+                ' (batch_predict_exact False, e.g. trans) always predict doc'
+                ' by doc').tag(config=True)
+    use_binary_cache = Bool(
+        False, help='parse each input once into a binary cache at'
+                    ' [input].cache, and read docs from it afterwards'
+    ).tag(config=True)
+    bucket_batch = Bool(
+        False, help='batch training docs of similar sizes together, and shuffle'
+                    ' the batches between epochs').tag(config=True)
+    bucket_seed = Int(0, help='random seed of bucket batching').tag(config=True)
+    nb_io_worker = Int(
+        0, help='number of processes parsing upcoming training batches in the'
+                ' background, 0 to parse in the training loop').tag(config=True)
+    io_queue_size = Int(
+        4, help='max number of parsed batches waiting in the background'
+    ).tag(config=True)
+    io_ordered = Bool(
+        True, help='keep the batch order when parsing in the background,'
+                   ' always kept with checkpoint_frequency, for exact resume'
+    ).tag(config=True)
+    checkpoint_frequency = Int(
+        0, help='save a training checkpoint every N batches (and after each'
+                ' epoch), 0 to disable').tag(config=True)
+    checkpoint_out = Unicode(
+        help='checkpoint path, default [model out name].ckpt').tag(config=True)
+    resume = Bool(
+        False, help='resume training from the checkpoint if it exists'
+    ).tag(config=True)
+    encoder_cache = Unicode(
+        help='.npy of the precomputed external semantic entity encodings'
+             ' used in predict, built from the model and saved here if'
+             ' missing or computed with other model weights').tag(config=True)
+    nb_predict_worker = Int(
+        0, help='number of cpu processes predicting shards of the test data,'
+                ' 0 or 1 to predict in this process, needs device cpu'
+    ).tag(config=True)
+    emb_quantization = Unicode(
+        help='quantize the embedding tables of the model in predict:'
+             ' float16 | int8, empty to keep float32').tag(config=True)
+    sparse_emb = Bool(
+        False, help='train the embedding tables with sparse gradients and'
+                    ' SparseAdam, the other parameters with Adam').tag(
+        config=True)
+    profile = Bool(
+        False, help='record the time and tensor bytes of each sub module and'
+                    ' the time of each train phase, summarized per epoch'
+    ).tag(config=True)
+    profile_out = Unicode(
+        help='per epoch profile summaries, one json per line, default'
+             ' [model out name].profile').tag(config=True)
 
     h_model = {
         'frequency': FrequencySalience,
@@ -169,16 +253,18 @@ class SalienceModelCenter(Configurable):
 
     def __init__(self, **kwargs):
         super(SalienceModelCenter, self).__init__(**kwargs)
+        set_device(self.device)
         self.para = NNPara(**kwargs)
         self.ext_data = ExtData(**kwargs)
         self.ext_data.assert_with_para(self.para)
         self._setup_io(**kwargs)
+        self.prescreener = PreScreener(self.io_parser, **kwargs)
         h_loss = {
             "hinge": hinge_loss,  # hinge classification loss does not work
             "pairwise": pairwise_loss,
         }
         self.criterion = h_loss[self.loss_func]
-        self.class_weight = torch.cuda.FloatTensor(self.l_class_weights)
+        self.class_weight = to_device(torch.FloatTensor(self.l_class_weights))
 
         # if self.event_model and self.joint_model:
         #     logging.error("Please specify one mode only.")
@@ -189,7 +275,12 @@ class SalienceModelCenter(Configurable):
 
         self.patient_cnt = 0
         self.best_valid_loss = 0
-        self.ll_valid_line = []
+        self.h_corpus = {}
+        if self.checkpoint_frequency and not self.io_ordered:
+            # resume skips the first p batches, they must be the ones trained
+            logging.warn('checkpointing keeps the batch order, io_ordered'
+                         ' set to True')
+            self.io_ordered = True
 
     def _setup_io(self, **kwargs):
         self.io_parser = DataIO(**kwargs)
@@ -249,69 +340,95 @@ class SalienceModelCenter(Configurable):
         if not os.path.exists(model_dir):
             os.makedirs(model_dir)
 
-        if validation_in_name:
+        checkpoint_out = self.checkpoint_out
+        if not checkpoint_out:
+            checkpoint_out = model_out_name + '.ckpt'
+        h_state = None
+        if self.resume and os.path.exists(checkpoint_out):
+            h_state = self._load_checkpoint(checkpoint_out)
+            self.model.train()
+            if h_state.get('model_out_name'):
+                # the best models so far are there, keep saving to it
+                model_out_name = h_state['model_out_name']
+                logging.info('Model out name of the resumed run is [%s]',
+                             model_out_name)
+        elif validation_in_name:
             self._init_early_stopper(validation_in_name)
 
-        optimizer = torch.optim.Adam(
-            filter(lambda model_para: model_para.requires_grad,
-                   self.model.parameters()),
-            lr=self.learning_rate
-        )
+        optimizer = self._init_optimizer()
         l_epoch_loss = []
-        for epoch in xrange(self.nb_epochs):
+        start_epoch = 0
+        if h_state:
+            optimizer.load_state_dict(h_state['optimizer'])
+            l_epoch_loss = h_state['l_epoch_loss']
+            start_epoch = h_state['epoch']
+        profile_out = None
+        if self.profile:
+            profile_out = self.profile_out
+            if not profile_out:
+                profile_out = model_out_name + '.profile'
+            self._start_profile(optimizer, profile_out, h_state is None)
+        for epoch in xrange(start_epoch, self.nb_epochs):
             self._epoch_start()
 
             p = 0
             total_loss = 0
             data_cnt = 0
-            logging.info('start epoch [%d]', epoch)
-            l_this_batch_line = []
             es_cnt = 0
+            if h_state and h_state['epoch'] == epoch:
+                p = h_state['p']
+                total_loss = h_state['total_loss']
+                data_cnt = h_state['data_cnt']
+                es_cnt = h_state['es_cnt']
+                self._set_rng_state(h_state['rng'])
+                logging.info('resume epoch [%d] after batch [%d]', epoch, p)
+            logging.info('start epoch [%d]', epoch)
             es_flag = False
-            for line in open(train_in_name):
-                if self.io_parser.is_empty_line(line):
-                    continue
-                data_cnt += 1
-                es_cnt += 1
-                l_this_batch_line.append(line)
-                if len(l_this_batch_line) >= self.batch_size:
-                    this_loss = self._batch_train(l_this_batch_line,
-                                                  self.criterion, optimizer)
-                    p += 1
-                    total_loss += this_loss
-                    logging.debug('[%d] batch [%f] loss', p, this_loss)
-                    assert not math.isnan(this_loss)
-                    if not p % 100:
-                        logging.info('batch [%d] [%d] data, average loss [%f]',
-                                     p, data_cnt, total_loss / p)
-                        self._train_info()
-                    l_this_batch_line = []
-                    if es_cnt >= self.early_stopping_frequency:
-                        logging.info(
-                            'checking dev loss at [%d]-[%d] vs frequency [%d]',
-                            epoch, es_cnt,
-                            self.early_stopping_frequency)
-                        es_cnt = 0
-                        if validation_in_name:
-                            self.model.eval()
-                            if self._early_stop(model_out_name):
-                                logging.info(
-                                    'early stopped at [%d] epoch [%d] data',
-                                    epoch, data_cnt)
-                                es_flag = True
-                                break
-                            self.model.train()
-            if es_flag:
-                break
-
-            if l_this_batch_line:
-                this_loss = self._batch_train(l_this_batch_line, self.criterion,
-                                              optimizer)
+            batch_iter = self._prefetch(itertools.islice(
+                self._train_batches(train_in_name, epoch), p, None))
+            if profile_out:
+                batch_iter = profiler.timed_iter('wait_batch', batch_iter)
+            for l_this_batch_line in batch_iter:
+                data_cnt += len(l_this_batch_line)
+                es_cnt += len(l_this_batch_line)
+                this_loss = self._batch_train(l_this_batch_line,
+                                              self.criterion, optimizer)
                 p += 1
                 total_loss += this_loss
                 logging.debug('[%d] batch [%f] loss', p, this_loss)
                 assert not math.isnan(this_loss)
-                l_this_batch_line = []
+                if not p % 100:
+                    logging.info('batch [%d] [%d] data, average loss [%f]',
+                                 p, data_cnt, total_loss / p)
+                    self._train_info()
+                if es_cnt >= self.early_stopping_frequency:
+                    logging.info(
+                        'checking dev loss at [%d]-[%d] vs frequency [%d]',
+                        epoch, es_cnt,
+                        self.early_stopping_frequency)
+                    es_cnt = 0
+                    if validation_in_name:
+                        self.model.eval()
+                        if self._early_stop(validation_in_name,
+                                            model_out_name):
+                            logging.info(
+                                'early stopped at [%d] epoch [%d] data',
+                                epoch, data_cnt)
+                            es_flag = True
+                            break
+                        self.model.train()
+                if self.checkpoint_frequency and \
+                        not p % self.checkpoint_frequency:
+                    self._save_checkpoint(checkpoint_out, optimizer, {
+                        'epoch': epoch, 'p': p, 'total_loss': total_loss,
+                        'data_cnt': data_cnt, 'es_cnt': es_cnt,
+                        'l_epoch_loss': l_epoch_loss,
+                        'model_out_name': model_out_name,
+                    })
+            if profile_out:
+                self._profile_epoch_end(epoch, profile_out)
+            if es_flag:
+                break
 
             logging.info(
                 'epoch [%d] finished with loss [%f] on [%d] batch [%d] doc',
@@ -323,13 +440,23 @@ class SalienceModelCenter(Configurable):
             # validation
             if validation_in_name:
                 self.model.eval()
-                if self._early_stop(model_out_name):
+                if self._early_stop(validation_in_name, model_out_name):
                     logging.info('early stopped at [%d] epoch', epoch)
                     break
                 self.model.train()
 
+            if self.checkpoint_frequency:
+                self._save_checkpoint(checkpoint_out, optimizer, {
+                    'epoch': epoch + 1, 'p': 0, 'total_loss': 0,
+                    'data_cnt': 0, 'es_cnt': 0,
+                    'l_epoch_loss': l_epoch_loss,
+                    'model_out_name': model_out_name,
+                })
+
         logging.info('[%d] epoch done with loss %s', self.nb_epochs,
                      json.dumps(l_epoch_loss))
+        if profile_out:
+            self._stop_profile(optimizer)
 
         if model_out_name:
             # self.model.save_model(model_out_name)
@@ -337,6 +464,15 @@ class SalienceModelCenter(Configurable):
             torch.save(self.model, model_out_name)
         return
 
+    def _init_optimizer(self):
+        if self.sparse_emb:
+            return SparseDenseAdam(self.model, self.learning_rate)
+        return torch.optim.Adam(
+            filter(lambda model_para: model_para.requires_grad,
+                   self.model.parameters()),
+            lr=self.learning_rate
+        )
+
     def _train_info(self):
         pass
 
@@ -346,26 +482,124 @@ class SalienceModelCenter(Configurable):
     def _epoch_end(self):
         pass
 
+    def _start_profile(self, optimizer, profile_out, new_file=True):
+        """
+        attach the profiler hooks to the model, and time the train phases
+        the phases are instance attributes wrapping the methods, only set
+        here, so the train path is untouched when not profiling
+        data_io and the module forwards include those of validation
+        """
+        logging.info('profiling to [%s]', profile_out)
+        if new_file:
+            open(profile_out, 'w').close()
+        profiler.reset()
+        profiler.attach(self.model)
+        self._batch_train = profiler.timed('batch_train', self._batch_train)
+        self._data_io = profiler.timed('data_io', self._data_io)
+        self._valid_loss = profiler.timed('validation', self._valid_loss)
+        optimizer.step = profiler.timed('optimizer_step', optimizer.step)
+
+    def _stop_profile(self, optimizer):
+        profiler.detach(self.model)
+        for name in ['_batch_train', '_data_io', '_valid_loss']:
+            self.__dict__.pop(name, None)
+        optimizer.__dict__.pop('step', None)
+
+    def _profile_epoch_end(self, epoch, profile_out):
+        h_profile = profiler.summary()
+        profiler.reset()
+        for phase, h_stat in sorted(h_profile['phases'].items(),
+                                    key=lambda item: -item[1]['sec']):
+            logging.info('epoch [%d] phase [%s] [%d] calls [%.2f] sec',
+                         epoch, phase, h_stat['calls'], h_stat['sec'])
+        for name, h_stat in sorted(h_profile['modules'].items(),
+                                   key=lambda item: -item[1]['forward_sec']):
+            logging.info(
+                'epoch [%d] module [%s] [%d] calls, forward [%.2f] sec'
+                ' [%.1f] MB, backward [%.2f] sec [%.1f] MB grad',
+                epoch, name, h_stat['calls'], h_stat['forward_sec'],
+                h_stat['output_mb'], h_stat['backward_sec'],
+                h_stat['grad_mb'])
+        h_profile['epoch'] = epoch
+        with open(profile_out, 'a') as out:
+            print >> out, json.dumps(h_profile)
+
     def _init_early_stopper(self, validation_in_name):
         self.patient_cnt = 0
         self.best_valid_loss = None
-        self.ll_valid_line = []
-        logging.info('loading validation data from [%s]', validation_in_name)
-        l_valid_lines = [l for l in open(validation_in_name).read().splitlines()
-                         if not self.io_parser.is_empty_line(l)]
-        self.ll_valid_line = [l_valid_lines[i:i + self.batch_size]
-                              for i in
-                              xrange(0, len(l_valid_lines), self.batch_size)]
-        logging.info('validation with [%d] doc', len(l_valid_lines))
-        self.best_valid_loss = sum([self._batch_test(l_one_batch)
-                                    for l_one_batch in self.ll_valid_line]
-                                   ) / float(len(self.ll_valid_line))
+        logging.info('validation with data in [%s]', validation_in_name)
+        self.best_valid_loss = self._valid_loss(validation_in_name)
         logging.info('initial validation loss [%.4f]', self.best_valid_loss)
 
-    def _early_stop(self, model_out_name):
-        this_valid_loss = sum([self._batch_test(l_one_batch)
-                               for l_one_batch in self.ll_valid_line]
-                              ) / float(len(self.ll_valid_line))
+    def _valid_loss(self, validation_in_name):
+        """
+        the average batch loss on validation data
+        streamed batch by batch, without keeping the data in memory
+        """
+        total_loss = 0
+        nb_batch = 0
+        nb_doc = 0
+        for l_one_batch in self._prefetch(self._batches(validation_in_name)):
+            total_loss += self._batch_test(l_one_batch)
+            nb_batch += 1
+            nb_doc += len(l_one_batch)
+        logging.debug('validated on [%d] doc', nb_doc)
+        return total_loss / float(max(nb_batch, 1))
+
+    def _save_checkpoint(self, checkpoint_out, optimizer, h_cursor):
+        """
+        save the model, optimizer, rng states, early stopper and data cursor
+        written to a tmp file and renamed, so a crash never leaves it broken
+        :param checkpoint_out: checkpoint path
+        :param optimizer:
+        :param h_cursor: epoch, p (batches done in the epoch), and its counters,
+            and the model out name the best models are saved to
+        :return:
+        """
+        h_state = dict(h_cursor)
+        h_state.update({
+            'model': self.model,
+            'optimizer': optimizer.state_dict(),
+            'rng': self._get_rng_state(),
+            'best_valid_loss': self.best_valid_loss,
+            'patient_cnt': self.patient_cnt,
+        })
+        torch.save(h_state, checkpoint_out + '.tmp')
+        os.rename(checkpoint_out + '.tmp', checkpoint_out)
+        logging.info('checkpoint saved to [%s] at epoch [%d] batch [%d]',
+                     checkpoint_out, h_cursor['epoch'], h_cursor['p'])
+
+    def _load_checkpoint(self, checkpoint_out):
+        logging.info('resuming from checkpoint [%s]', checkpoint_out)
+        h_state = torch.load(checkpoint_out, map_location=map_location())
+        self.model = h_state['model']
+        self.best_valid_loss = h_state['best_valid_loss']
+        self.patient_cnt = h_state['patient_cnt']
+        logging.info('checkpoint at epoch [%d] batch [%d]',
+                     h_state['epoch'], h_state['p'])
+        return h_state
+
+    @classmethod
+    def _get_rng_state(cls):
+        h_rng = {
+            'random': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+        }
+        if use_cuda():
+            h_rng['cuda'] = torch.cuda.get_rng_state()
+        return h_rng
+
+    @classmethod
+    def _set_rng_state(cls, h_rng):
+        random.setstate(h_rng['random'])
+        np.random.set_state(h_rng['numpy'])
+        torch.set_rng_state(h_rng['torch'])
+        if use_cuda() and 'cuda' in h_rng:
+            torch.cuda.set_rng_state(h_rng['cuda'])
+
+    def _early_stop(self, validation_in_name, model_out_name):
+        this_valid_loss = self._valid_loss(validation_in_name)
         logging.info('valid loss [%f]', this_valid_loss)
         if self.best_valid_loss is None:
             self.best_valid_loss = this_valid_loss
@@ -384,7 +618,8 @@ class SalienceModelCenter(Configurable):
                              self.patient_cnt)
                 logging.info('loading best model [%s] with loss [%f]',
                              model_out_name, self.best_valid_loss)
-                self.model = torch.load(model_out_name)
+                self.model = torch.load(model_out_name,
+                                        map_location=map_location())
                 return True
         else:
             self.patient_cnt = 0
@@ -399,9 +634,115 @@ class SalienceModelCenter(Configurable):
             self.best_valid_loss = this_valid_loss
         return False
 
+    def _train_batches(self, train_in_name, epoch):
+        """
+        yield the training batches of an epoch
+        in file order, or bucketed by doc size if bucket_batch
+        :param train_in_name: training data
+        :param epoch: to shuffle the buckets
+        :return: lists of docs
+        """
+        if self.bucket_batch:
+            corpus = self._get_corpus(train_in_name)
+            sampler = BucketBatchSampler(corpus.doc_size(), self.batch_size,
+                                         self.bucket_seed)
+            l_batch = sampler.batches(epoch)
+            logging.info('[%d] bucketed batches, padding rate [%.4f]',
+                         len(l_batch), sampler.padding_rate(l_batch))
+            for l_p in l_batch:
+                yield [corpus.get_doc(p) for p in l_p]
+            return
+        for l_this_batch_line in self._batches(train_in_name):
+            yield l_this_batch_line
+
+    def _batches(self, in_name):
+        """
+        yield the docs of in_name in file order, batch_size at a time
+        """
+        l_this_batch_line = []
+        for line in self._iter_doc(in_name):
+            l_this_batch_line.append(line)
+            if len(l_this_batch_line) >= self.batch_size:
+                yield l_this_batch_line
+                l_this_batch_line = []
+        if l_this_batch_line:
+            yield l_this_batch_line
+
+    def _prefetch(self, batch_iter):
+        """
+        parse the batches in background processes if nb_io_worker > 0
+        :param batch_iter: batches of docs
+        :return: the batches, as PackedBatch if prefetched
+        """
+        if self.nb_io_worker <= 0:
+            return batch_iter
+        if not self.use_new_io:
+            logging.error('background io only works with the new io')
+            raise NotImplementedError
+        self.model.config_io(self.io_parser)
+        loader = PrefetchLoader(self.io_parser, self.nb_io_worker,
+                                self.io_queue_size, self.io_ordered)
+        return loader(batch_iter)
+
+    def _iter_doc(self, in_name):
+        """
+        yield the non-empty docs in in_name
+        as raw lines, or as parsed docs from its binary cache if use_binary_cache,
+        or as HashedDocs if in_name is a hashed binary layout dir
+        :param in_name: hashed data
+        :return:
+        """
+        if self.use_binary_cache or is_hashed_binary(in_name):
+            corpus = self._get_corpus(in_name)
+            for p in xrange(len(corpus)):
+                yield corpus.get_doc(p)
+            return
+        for line in open(in_name):
+            if self.io_parser.is_empty_line(line):
+                continue
+            yield line
+
+    def _get_corpus(self, in_name):
+        """
+        random access to the non-empty docs of in_name
+        its binary cache if use_binary_cache, (re)built if missing or made with
+        different io configs; its HashedBinaryCorpus if in_name is a hashed
+        binary layout; otherwise its LineCorpus
+        :param in_name: hashed data
+        :return: BinaryCorpus, HashedBinaryCorpus or LineCorpus
+        """
+        if in_name in self.h_corpus:
+            return self.h_corpus[in_name]
+        if not self.use_new_io:
+            logging.error('doc corpus only works with the new io')
+            raise NotImplementedError
+        self.model.config_io(self.io_parser)
+        if self.use_binary_cache:
+            if type(self.io_parser) is not DataIO:
+                logging.error('binary cache only works with DataIO')
+                raise NotImplementedError
+            cache_dir = in_name + '.cache'
+            if not BinaryCorpus.is_valid(cache_dir, self.io_parser,
+                                         in_name):
+                BinaryCorpus.build(in_name, cache_dir, self.io_parser)
+            self.h_corpus[in_name] = BinaryCorpus(cache_dir)
+        elif is_hashed_binary(in_name):
+            self.h_corpus[in_name] = HashedBinaryCorpus(in_name,
+                                                        self.io_parser)
+        else:
+            self.h_corpus[in_name] = LineCorpus(in_name, self.io_parser)
+        return self.h_corpus[in_name]
+
+    @classmethod
+    def _load_info(cls, line):
+        if type(line) is dict or isinstance(line, HashedDoc):
+            # already parsed from the binary cache, or a HashedDoc
+            return line
+        return json.loads(line)
+
     def load_model(self, model_out_name):
         logging.info('loading trained model from [%s]', model_out_name)
-        self.model = torch.load(model_out_name)
+        self.model = torch.load(model_out_name, map_location=map_location())
 
     def _batch_train(self, l_line, criterion, optimizer):
         h_packed_data, m_label = self._data_io(l_line)
@@ -428,15 +769,18 @@ class SalienceModelCenter(Configurable):
 
         self.model.debug_mode(debug)
         self.model.eval()
+        self._setup_encoder_cache()
+        self._quantize()
+        if self.nb_predict_worker > 1:
+            sharded_predict(self, test_in_name, label_out_name,
+                            self.nb_predict_worker)
+            return
 
         out = open(label_out_name, 'w')
         logging.info('start predicting for [%s]', test_in_name)
         p = 0
         h_total_eva = dict()
-        for line in open(test_in_name):
-            if self.io_parser.is_empty_line(line):
-                continue
-            h_out, h_this_eva = self._per_doc_predict(line)
+        for h_out, h_this_eva in self._predict_stream(test_in_name):
             if h_out is None:
                 continue
             h_total_eva = add_svm_feature(h_total_eva, h_this_eva)
@@ -459,13 +803,174 @@ class SalienceModelCenter(Configurable):
         out.close()
         return
 
-    def _per_doc_predict(self, line):
-        h_info = json.loads(line)
+    def _predict_out_names(self, label_out_name):
+        """
+        the files predict() writes the predictions to
+        """
+        return [label_out_name]
+
+    def _setup_encoder_cache(self):
+        if not self.encoder_cache:
+            return
+        if getattr(self.model, 'e_ext_emb', None) is not None:
+            # already set up, e.g. by the parent of a predict worker
+            return
+        if not hasattr(self.model, 'precompute_encoder_cache'):
+            logging.info('model [%s] has no encoder cache, ignore [%s]',
+                         self.model_name, self.encoder_cache)
+            return
+        if not (os.path.exists(self.encoder_cache) and
+                self.model.load_encoder_cache(self.encoder_cache)):
+            self.model.precompute_encoder_cache()
+            self.model.save_encoder_cache(self.encoder_cache)
+
+    def _quantize(self):
+        if not self.emb_quantization:
+            return
+        quantize_embeddings(self.model, self.emb_quantization)
+        # the model holds its own tables, the float32 ones are not used again
+        self.ext_data.release_embeddings()
+        logging.info('embedding tables quantized to [%s], [%d] bytes',
+                     self.emb_quantization, embedding_nbytes(self.model))
+
+    def _predict_stream(self, test_in_name):
+        """
+        yield the predicted (h_out, h_eva) of each non-empty doc in test_in_name
+        docs are grouped into batches of predict_batch_size
+        :param test_in_name:
+        :return:
+        """
+        if self.prescreener.top_n:
+            for h_out, h_this_eva in self._prescreened_predict_stream(
+                    test_in_name):
+                yield h_out, h_this_eva
+            return
+        batch_size = self._predict_batch_size()
+        l_this_batch_line = []
+        for line in self._iter_doc(test_in_name):
+            if batch_size <= 1:
+                yield self._per_doc_predict(line)
+                continue
+            l_this_batch_line.append(line)
+            if len(l_this_batch_line) >= batch_size:
+                for h_out, h_this_eva in self._batch_predict(l_this_batch_line):
+                    yield h_out, h_this_eva
+                l_this_batch_line = []
+        if l_this_batch_line:
+            for h_out, h_this_eva in self._batch_predict(l_this_batch_line):
+                yield h_out, h_this_eva
+
+    def _predict_batch_size(self):
+        """
+        predict_batch_size, or 1 for models whose scores depend on the padding
+        """
+        if self.predict_batch_size > 1 and not getattr(
+                self.model, 'batch_predict_exact', True):
+            logging.warn('model [%s] is not exact in padded batches,'
+                         ' predicting doc by doc', self.model_name)
+            return 1
+        return self.predict_batch_size
+
+    def _prescreened_predict_stream(self, test_in_name):
+        """
+        _predict_stream, with each doc's candidates pre-screened first
+        """
+        batch_size = max(self._predict_batch_size(), 1)
+        l_this_batch = []
+        for line in self._iter_doc(test_in_name):
+            l_this_batch.append(self._prescreen(line))
+            if len(l_this_batch) >= batch_size:
+                for res in self._prescreened_batch_predict(l_this_batch):
+                    yield res
+                l_this_batch = []
+        if l_this_batch:
+            for res in self._prescreened_batch_predict(l_this_batch):
+                yield res
+
+    def _prescreened_batch_predict(self, l_screened):
+        l_line = [line for line, __, __ in l_screened]
+        if self._predict_batch_size() <= 1:
+            l_res = [self._per_doc_predict(line) for line in l_line]
+        else:
+            l_res = self._batch_predict(l_line)
+        for (h_out, __), (__, h_pruned, h_label) in zip(l_res, l_screened):
+            h_out = self.prescreener.merge(h_out, h_pruned['entity'],
+                                           h_label['entity'], self.evaluator)
+            yield h_out, (h_out or {}).get('eval')
+
+    def _prescreen(self, line):
+        """
+        :return: the doc with only the top candidates, as a HashedDoc, the
+            pruned candidates, the labels of the kept ones
+        """
+        if type(line) is dict:
+            logging.error('pre-screening needs the hashed docs, not the'
+                          ' binary cache')
+            raise NotImplementedError
+        h_info, h_pruned = self.prescreener.screen(
+            self.io_parser.load_info(line))
+        return (HashedDoc(h_info), h_pruned,
+                self.prescreener.kept_labels(h_info))
+
+    @classmethod
+    def _get_key_docno(cls, h_info):
         key_name = 'docno'
         if key_name not in h_info:
             key_name = 'qid'
             assert key_name in h_info
-        docno = h_info[key_name]
+        return key_name, h_info[key_name]
+
+    def _batch_predict(self, l_line):
+        """
+        predict a batch of docs with one padded forward pass
+        the padded entities are cut off by the label mask (real labels are +1/-1,
+        paddings are 0), so each doc gets the same output as _per_doc_predict,
+        up to float rounding in the padded matmul
+        :param l_line: non-empty doc lines
+        :return: list of (h_out, h_eva), (None, None) for docs with no entity
+        """
+        l_key_docno = [self._get_key_docno(self._load_info(line))
+                       for line in l_line]
+        h_packed_data, m_label = self._data_io(l_line)
+        m_e = h_packed_data['mtx_e']
+        if (m_e is None) or (m_label is None):
+            return [(None, None)] * len(l_line)
+        m_output = self.model(h_packed_data).cpu().data
+        m_e = m_e.cpu().data
+        m_label = m_label.cpu().data
+        ts_middle = None
+        if self.predict_with_intermediate_res:
+            ts_middle = self.model.forward_intermediate(
+                h_packed_data).cpu().data
+
+        m_mask = m_label.ne(0)
+        l_h_eva = self.evaluator.evaluate_batch(
+            m_output.numpy(), m_label.numpy(), m_mask.numpy())
+
+        l_res = []
+        for p, (key_name, docno) in enumerate(l_key_docno):
+            nb_e = int(m_mask[p].sum())
+            if not nb_e:
+                l_res.append((None, None))
+                continue
+            l_score = m_output[p][:nb_e].numpy().tolist()
+            l_e = self.io_parser.original_entity_ids(
+                m_e[p][:nb_e].numpy().tolist())
+            h_out = dict()
+            h_out[key_name] = docno
+            h_out[self.io_parser.content_field] = {'predict': zip(l_e, l_score)}
+            if ts_middle is not None:
+                l_middle_features = ts_middle[p][:nb_e].numpy().tolist()
+                h_out[self.io_parser.content_field][
+                    'predict_features'] = zip(l_e, l_middle_features)
+            h_this_eva = l_h_eva[p]
+            h_out['eval'] = h_this_eva
+            l_res.append((h_out, h_this_eva))
+        return l_res
+
+    def _per_doc_predict(self, line):
+        h_info = self._load_info(line)
+        key_name, docno = self._get_key_docno(h_info)
         h_packed_data, v_label = self._data_io([line])
         v_e = h_packed_data['mtx_e']
         # v_w = h_packed_data['mtx_score']
@@ -478,7 +983,7 @@ class SalienceModelCenter(Configurable):
         l_score = output.data.numpy().tolist()
         h_out = dict()
         h_out[key_name] = docno
-        l_e = v_e.data.numpy().tolist()
+        l_e = self.io_parser.original_entity_ids(v_e.data.numpy().tolist())
         h_out[self.io_parser.content_field] = {'predict': zip(l_e, l_score)}
 
         if self.predict_with_intermediate_res:
@@ -502,6 +1007,8 @@ class SalienceModelCenter(Configurable):
         return loss.data[0]
 
     def _data_io(self, l_line):
+        if isinstance(l_line, PackedBatch):
+            return l_line.packed
         if self.use_new_io:
             return self.model.data_io(l_line, self.io_parser)
         else:
@@ -524,6 +1031,7 @@ if __name__ == '__main__':
     from knowledge4ir.utils import (
         set_basic_log,
         load_py_config,
+        load_command_line_config,
     )
 
 
@@ -539,14 +1047,16 @@ if __name__ == '__main__':
         debug = Bool(False, help='Debug mode').tag(config=True)
 
 
-    if 2 != len(sys.argv):
+    if 2 > len(sys.argv):
         print "unit test model train test"
-        print "1 para, config"
+        print "1 para, config, followed by command line configs, e.g."
+        print "    --SalienceModelCenter.resume=True"
         SalienceModelCenter.class_print_help()
         Main.class_print_help()
         sys.exit(-1)
 
     conf = load_py_config(sys.argv[1])
+    conf.merge(load_command_line_config(sys.argv[2:]))
     para = Main(config=conf)
 
     set_basic_log(logging.getLevelName(para.log_level))
@@ -16,8 +16,7 @@ import logging
 import json
 import torch.nn.functional as F
 import numpy as np
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class KernelCRF(KNRM):
@@ -27,7 +26,7 @@ class KernelCRF(KNRM):
         super(KernelCRF, self).__init__(para, ext_data)
         self.node_feature_dim = para.node_feature_dim
         self.node_lr = nn.Linear(self.node_feature_dim, 1, bias=False)
-        if use_cuda:
+        if use_cuda():
             self.node_lr.cuda()
         return
 
@@ -70,7 +69,7 @@ class LinearKernelCRF(KNRM):
         self.node_lr = nn.Linear(self.node_feature_dim, 1, bias=False)
         logging.info('node feature dim %d', self.node_feature_dim)
         self.linear_combine = nn.Linear(2, 1)
-        if use_cuda:
+        if use_cuda():
             self.node_lr.cuda()
             self.linear_combine.cuda()
         return
@@ -13,8 +13,7 @@ import json
 
 from torch import nn as nn
 from knowledge4ir.salience.knrm_vote import KNRM
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class AdjKNRM(KNRM):
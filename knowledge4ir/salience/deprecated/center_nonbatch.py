@@ -41,8 +41,7 @@ from knowledge4ir.utils import (
     abstract_field,
     term2lm,
 )
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class NbSalienceModelCenter(Configurable):
@@ -179,9 +178,9 @@ class NbSalienceModelCenter(Configurable):
         z = float(sum([item[1] for item in l_e_tf]))
         l_w = [item[1] / z for item in l_e_tf]
         l_label = [1 if e in s_salient_e else 0 for e in l_e]
-        v_e = Variable(torch.LongTensor(l_e)).cuda() if use_cuda else Variable(torch.LongTensor(l_e))
-        v_w = Variable(torch.FloatTensor(l_w)).cuda() if use_cuda else Variable(torch.FloatTensor(l_w))
-        v_label = Variable(torch.LongTensor(l_label)).cuda() if use_cuda else Variable(torch.FloatTensor(l_label))
+        v_e = Variable(torch.LongTensor(l_e)).cuda() if use_cuda() else Variable(torch.LongTensor(l_e))
+        v_w = Variable(torch.FloatTensor(l_w)).cuda() if use_cuda() else Variable(torch.FloatTensor(l_w))
+        v_label = Variable(torch.LongTensor(l_label)).cuda() if use_cuda() else Variable(torch.FloatTensor(l_label))
 
         return v_e, v_w, v_label
 
@@ -36,7 +36,7 @@ class DuetGlossCNN(DuetKNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             for i in xrange(len(self.l_gloss_cnn)):
                 self.l_gloss_cnn[i].cuda()
                 self.l_gloss_linear[i].cuda()
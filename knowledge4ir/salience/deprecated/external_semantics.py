@@ -37,7 +37,7 @@ class DespWordAvgEmbKNRM(KNRM):
 
         self.e_desp_mtx = Variable(torch.LongTensor(ext_data.entity_desp))
         logging.info('desp word avg knrm model initialized')
-        if use_cuda:
+        if use_cuda():
             self.word_att_emb.cuda()
             self.word_emb.cuda()
             self.e_desp_mtx = self.e_desp_mtx.cuda()
@@ -128,7 +128,7 @@ class DespSentRNNEmbedKNRM(KNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             self.desp_rnn.cuda()
             self.word_emb.cuda()
             self.e_desp_mtx = self.e_desp_mtx.cuda()
@@ -156,7 +156,7 @@ class DespSentRNNEmbedKNRM(KNRM):
         ts_desp_emb = ts_desp_emb.view((-1,) + ts_desp_emb.size()[-2:])
 
         h0 = Variable(torch.randn(2, ts_desp_emb.size()[0], ts_desp_emb.size()[-1]))
-        if use_cuda:
+        if use_cuda():
             h0 = h0.cuda()
         logging.debug('starting the bi-gru with shape %s', json.dumps(h0.size()))
         logging.debug('and input sequence shape %s', json.dumps(ts_desp_emb.size()))
@@ -204,7 +204,7 @@ class LinearGlossCNNEmbedKNRM(KNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             for i in xrange(len(self.l_gloss_cnn)):
                 self.l_gloss_cnn[i].cuda()
                 self.l_gloss_linear[i].cuda()
@@ -290,7 +290,7 @@ class GlossCNNEmbedKNRM(KNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             self.gloss_cnn.cuda()
             self.word_emb.cuda()
             self.e_desp_mtx = self.e_desp_mtx.cuda()
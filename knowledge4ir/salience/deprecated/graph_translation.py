@@ -5,7 +5,7 @@ import numpy as np
 import torch
 from torch import nn as nn
 from torch.nn import functional as F
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class GraphTranslation(nn.Module):
@@ -19,7 +19,7 @@ class GraphTranslation(nn.Module):
         super(GraphTranslation, self).__init__()
         self.embedding = nn.Embedding(vocab_size, embedding_dim)
         self.linear = nn.Linear(1, 2, bias=True)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             self.linear.cuda()
@@ -68,7 +68,7 @@ class GraphTranslation(nn.Module):
 
         output = F.log_softmax(self.linear(output))
         output = output.squeeze(-1)
-        if use_cuda:
+        if use_cuda():
             return output.cuda()
         else:
             return output
\ No newline at end of file
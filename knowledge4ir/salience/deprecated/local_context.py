@@ -17,8 +17,7 @@ import logging
 import json
 import torch.nn.functional as F
 import numpy as np
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class LocalAvgWordVotes(SalienceBaseModel):
@@ -43,7 +42,7 @@ class LocalAvgWordVotes(SalienceBaseModel):
         self.word_embedding.requires_grad = para.train_word_emb   # not training the word embedding
         self.linear_combine = nn.Linear(self.final_combine_dim, 1)   # combine the max pool and sum pool of votes
 
-        if use_cuda:
+        if use_cuda():
             logging.info('transferring model to gpu...')
             self.embedding.cuda()
             self.linear_combine.cuda()
@@ -107,7 +106,7 @@ class LocalRNNVotes(LocalAvgWordVotes):
             batch_first=True,
             bidirectional=True
         )
-        if use_cuda:
+        if use_cuda():
             self.rnn.cuda()
 
     def forward(self, h_packed_data):
@@ -142,7 +141,7 @@ class LocalRNNVotes(LocalAvgWordVotes):
             (-1,) + ts_e_sent_word_embedding.size()[-2:]
         )
         h0 = Variable(torch.randn(2, batch_rnn_input.size()[0], self.embedding_dim))
-        if use_cuda:
+        if use_cuda():
             h0 = h0.cuda()
         __, rnn_out = self.rnn(batch_rnn_input, h0)
         rnn_out = rnn_out.transpose(0, 1)
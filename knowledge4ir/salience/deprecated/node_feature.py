@@ -23,7 +23,7 @@ class EmbeddingLR(nn.Module):
             self.l_linear.append(nn.Linear(embedding_dim, out_dim, bias=False))
         if pre_embedding is not None:
             self.embedding.weight.data.copy_(torch.from_numpy(pre_embedding))
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             for linear in self.l_linear:
@@ -13,10 +13,8 @@ import torch
 from torch import nn as nn
 from torch.autograd import Variable
 
-from knowledge4ir.salience.external_semantics.description import use_cuda
 from knowledge4ir.salience.knrm_vote import KNRM
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class DuetKNRM(KNRM):
@@ -35,7 +33,7 @@ class DuetKNRM(KNRM):
             torch.from_numpy(ext_data.word_emb)
         )
         self.duet_linear = nn.Linear(self.K * 2, 1, bias=True)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying duet knrm parameters to cuda')
             self.word_embedding.cuda()
             self.duet_linear.cuda()
@@ -100,7 +98,7 @@ class GlossCNNEmbDuet(DuetKNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             for i in xrange(len(self.l_gloss_cnn)):
                 self.l_gloss_cnn[i].cuda()
             self.word_emb.cuda()
@@ -31,15 +31,18 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable
 
+from knowledge4ir.salience.external_semantics.encoder_cache import (
+    EntityEncoderCache,
+)
 from knowledge4ir.salience.knrm_vote import KNRM
+from knowledge4ir.salience.utils.device import use_cuda
 
-use_cuda = torch.cuda.is_available()
 
-
-class GlossCNNKNRM(KNRM):
+class GlossCNNKNRM(EntityEncoderCache, KNRM):
     """
     Cnn of the description's first 20 words
     multiple CNN filters
+    the CNN encodings are shared per entity, see EntityEncoderCache
     """
 
     def __init__(self, para, ext_data=None):
@@ -66,7 +69,7 @@ class GlossCNNKNRM(KNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             for i in xrange(len(self.l_gloss_cnn)):
                 self.l_gloss_cnn[i].cuda()
             self.word_emb.cuda()
@@ -75,31 +78,41 @@ class GlossCNNKNRM(KNRM):
             self.word_emb.cuda()
             self.e_desp_mtx = self.e_desp_mtx.cuda()
             self.emb_merge.cuda()
+        self.e_ext_emb = None
 
     def forward(self, h_packed_data):
         mtx_e = h_packed_data['mtx_e']
         mtx_score = h_packed_data['mtx_score']
         mtx_embedding = self.embedding(mtx_e)    # memory based embedding
 
-        ts_desp = self.e_desp_mtx[mtx_e.view(-1)].view(
-            mtx_e.size() + (self.e_desp_mtx.size()[-1],)
-        )     # batch, e id, desp word id
+        # batch * entity * (cnn filters * nb cnn)
+        cnn_emb = self._ext_embedding(mtx_e)
+
+        enriched_e_embedding = self.emb_merge(
+            torch.cat([mtx_embedding, cnn_emb], dim=-1)
+        )
+
+        return self._knrm_opt(enriched_e_embedding, mtx_score)
+
+    def _entity_table_size(self):
+        return self.e_desp_mtx.size()[0]
+
+    def _encoder_modules(self):
+        return [self.word_emb] + self.l_gloss_cnn
+
+    def _encode_entities(self, v_e):
+        ts_desp = self.e_desp_mtx[v_e]     # entity, desp word id
 
         v_desp_words = ts_desp.view(-1)
         ts_desp_emb = self.word_emb(v_desp_words)
 
-        # batch * entity * desp words * word embedding
+        # entity * desp words * word embedding
         ts_desp_emb = ts_desp_emb.view(ts_desp.size() + ts_desp_emb.size()[-1:])
 
         l_cnn_emb = []
         for cnn in self.l_gloss_cnn:
-            l_cnn_emb.append(self._sentence_cnn(ts_desp_emb, mtx_e, cnn))
-
-        enriched_e_embedding = self.emb_merge(
-            torch.cat([mtx_embedding] + l_cnn_emb, dim=-1)
-        )
-
-        return self._knrm_opt(enriched_e_embedding, mtx_score)
+            l_cnn_emb.append(self._sentence_cnn(ts_desp_emb, v_e, cnn))
+        return torch.cat(l_cnn_emb, dim=-1)
 
     def _sentence_cnn(self, ts_desp_emb, mtx_e, cnn):
         ts_desp_emb = ts_desp_emb.view((-1,) + ts_desp_emb.size()[-2:])
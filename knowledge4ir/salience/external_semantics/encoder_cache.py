@@ -0,0 +1,128 @@
+"""
+cache of the entity encodings from external semantics
+
+the external semantic models (GlossCNNKNRM, NlssCnnKnrm) encode each entity's
+description/NLSS with a CNN. The encoding only depends on the entity id and
+the model weights, so:
+    training: each distinct entity in a batch is encoded once, and the
+        encoding is shared by all its appearances in the batch
+    inference: the encodings of the whole entity table are computed once,
+        optionally saved to a .npy, and forward becomes a lookup
+        the .npy has a [name].meta.json with the md5 digest of the encoder
+        weights it was computed with, a cache of other weights is not loaded
+
+a model using it implements _encode_entities(v_e), mapping a 1-d Variable of
+entity ids to their [len(v_e), dim] encodings, and _encoder_modules(), the
+modules _encode_entities uses, whose weights the digest covers.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import torch
+from torch.autograd import Variable
+
+from knowledge4ir.salience.utils.device import use_cuda
+
+
+class EntityEncoderCache(object):
+    encode_batch_size = 1024
+
+    def _encode_entities(self, v_e):
+        raise NotImplementedError
+
+    def _entity_table_size(self):
+        raise NotImplementedError
+
+    def _encoder_modules(self):
+        raise NotImplementedError
+
+    def _ext_embedding(self, mtx_e):
+        """
+        the external semantic encoding of each entity in mtx_e
+        :param mtx_e: batch * e per doc, entity ids
+        :return: batch * e per doc * encoding dim
+        """
+        e_ext_emb = getattr(self, 'e_ext_emb', None)
+        if (e_ext_emb is not None) and (not self.training):
+            ts_emb = e_ext_emb[mtx_e.view(-1)]
+            return ts_emb.view(mtx_e.size() + ts_emb.size()[-1:])
+
+        l_uniq_e, l_inverse = np.unique(mtx_e.data.cpu().numpy().reshape(-1),
+                                        return_inverse=True)
+        v_uniq_e = Variable(torch.from_numpy(l_uniq_e).long())
+        v_inverse = Variable(torch.from_numpy(l_inverse).long())
+        if use_cuda():
+            v_uniq_e = v_uniq_e.cuda()
+            v_inverse = v_inverse.cuda()
+        uniq_emb = self._encode_entities(v_uniq_e)
+        ts_emb = uniq_emb.index_select(0, v_inverse)
+        return ts_emb.view(mtx_e.size() + uniq_emb.size()[-1:])
+
+    def precompute_encoder_cache(self):
+        """
+        encode the whole entity table, used by forward until train() is called
+        """
+        nb_e = self._entity_table_size()
+        logging.info('precomputing external semantic encodings of [%d] entities',
+                     nb_e)
+        l_emb = []
+        for st in xrange(0, nb_e, self.encode_batch_size):
+            v_e = Variable(torch.arange(
+                st, min(st + self.encode_batch_size, nb_e)).long(),
+                volatile=True)
+            if use_cuda():
+                v_e = v_e.cuda()
+            l_emb.append(self._encode_entities(v_e).data)
+        self.e_ext_emb = Variable(torch.cat(l_emb, dim=0), requires_grad=False)
+        logging.info('encoding cache shape %s', str(self.e_ext_emb.size()))
+
+    def weights_digest(self):
+        """
+        md5 of the parameters of the encoder modules, the rest of the model
+        (e.g. the entity embedding tables) does not change the encodings
+        """
+        md5 = hashlib.md5()
+        for p, module in enumerate(self._encoder_modules()):
+            for name, value in sorted(module.state_dict().items()):
+                md5.update('%d.%s' % (p, name))
+                md5.update(np.ascontiguousarray(value.cpu().numpy()).data)
+        return md5.hexdigest()
+
+    def save_encoder_cache(self, out_name):
+        logging.info('saving external semantic encodings to [%s]', out_name)
+        np.save(open(out_name, 'wb'), self.e_ext_emb.data.cpu().numpy())
+        json.dump({'weights_digest': self.weights_digest()},
+                  open(out_name + '.meta.json', 'w'))
+
+    def load_encoder_cache(self, in_name):
+        """
+        :return: whether loaded, False if in_name is of other model weights
+        """
+        meta_name = in_name + '.meta.json'
+        if not os.path.exists(meta_name) or json.load(open(meta_name)).get(
+                'weights_digest') != self.weights_digest():
+            logging.info('external semantic encodings [%s] are not of the'
+                         ' current model weights', in_name)
+            return False
+        logging.info('loading external semantic encodings from [%s]', in_name)
+        e_ext_emb = np.load(in_name)
+        if e_ext_emb.shape[0] != self._entity_table_size():
+            logging.info('external semantic encodings [%s] have [%d] entities,'
+                         ' not [%d]', in_name, e_ext_emb.shape[0],
+                         self._entity_table_size())
+            return False
+        self.e_ext_emb = Variable(torch.from_numpy(e_ext_emb),
+                                  requires_grad=False)
+        if use_cuda():
+            self.e_ext_emb = self.e_ext_emb.cuda()
+        return True
+
+    def train(self, mode=True):
+        if mode:
+            # weights may change, the cached encodings would be stale
+            self.e_ext_emb = None
+        return super(EntityEncoderCache, self).train(mode)
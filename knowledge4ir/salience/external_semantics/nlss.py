@@ -20,12 +20,14 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable
 from knowledge4ir.salience.base import SalienceBaseModel, KernelPooling
+from knowledge4ir.salience.external_semantics.encoder_cache import (
+    EntityEncoderCache,
+)
 from knowledge4ir.salience.knrm_vote import KNRM
+from knowledge4ir.salience.utils.device import use_cuda
 
-use_cuda = torch.cuda.is_available()
 
-
-class NlssCnnKnrm(KNRM):
+class NlssCnnKnrm(EntityEncoderCache, KNRM):
 
     def __init__(self, para, ext_data=None):
         super(NlssCnnKnrm, self).__init__(para, ext_data)
@@ -51,29 +53,42 @@ class NlssCnnKnrm(KNRM):
             para.embedding_dim,
             bias=False
         )
-        if use_cuda:
+        if use_cuda():
             self.sentence_cnn.cuda()
             self.word_emb.cuda()
             self.e_nlss = self.e_nlss.cuda()
             self.emb_merge.cuda()
+        self.e_ext_emb = None
 
     def forward(self, h_packed_data):
         mtx_e = h_packed_data['mtx_e']
         mtx_score = h_packed_data['mtx_score']
         mtx_embedding = self.embedding(mtx_e)    # memory based embedding
 
-        ts_nlss = self.e_nlss[mtx_e.view(-1)].view(
-            mtx_e.size() + self.e_nlss.size()[-2:]
-        )     # batch, e id, nlss, words
+        cnn_emb = self._ext_embedding(mtx_e)    # batch, e id, filters
+        enriched_e_embedding = self.emb_merge(
+            torch.cat((mtx_embedding, cnn_emb), dim=-1)
+        )
+
+        return self._knrm_opt(enriched_e_embedding, mtx_score)
+
+    def _entity_table_size(self):
+        return self.e_nlss.size()[0]
+
+    def _encoder_modules(self):
+        return [self.word_emb, self.sentence_cnn]
+
+    def _encode_entities(self, v_e):
+        ts_nlss = self.e_nlss[v_e]     # e id, nlss, words
 
         v_nlss_words = ts_nlss.view(-1)
         ts_nlss_emb = self.word_emb(v_nlss_words)
 
-        # batch * entity * nlss *  words * word embedding
+        # entity * nlss *  words * word embedding
         ts_nlss_emb = ts_nlss_emb.view(ts_nlss.size() + ts_nlss_emb.size()[-1:])
 
         # reshape for CNN:
-        # now is (batch * entity * nlss) * nlss's words * word embedding
+        # now is (entity * nlss) * nlss's words * word embedding
         ts_nlss_emb = ts_nlss_emb.view((-1,) + ts_nlss_emb.size()[-2:])
         ts_nlss_emb = ts_nlss_emb.transpose(-1, -2)   # now batch * embedding * words
         logging.debug('cnn input sequence shape %s', json.dumps(ts_nlss_emb.size()))
@@ -82,7 +97,7 @@ class NlssCnnKnrm(KNRM):
         cnn_filter = cnn_filter.transpose(-2, -1).contiguous()   # batch * strides * filters
         cnn_filter = cnn_filter.view(
             ts_nlss.size()[:-1] + cnn_filter.size()[-2:]
-        )    # batch * entity * nlss * strides * filters
+        )    # entity * nlss * strides * filters
         logging.debug('cnn out converted to shape %s', json.dumps(cnn_filter.size()))
         cnn_emb, __ = torch.max(
             cnn_filter, dim=-2, keepdim=False
@@ -91,10 +106,4 @@ class NlssCnnKnrm(KNRM):
             cnn_emb, dim=-2, keepdim=False
         )
         logging.debug('max pooled CNN Emb shape %s', json.dumps(cnn_emb.size()))
-        enriched_e_embedding = self.emb_merge(
-            torch.cat((mtx_embedding, cnn_emb), dim=-1)
-        )
-
-        return self._knrm_opt(enriched_e_embedding, mtx_score)
-
-
+        return cnn_emb
@@ -15,12 +15,26 @@ import torch.nn.functional as F
 import numpy as np
 
 from knowledge4ir.salience.utils.debugger import Debugger
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 import pickle
 
 
+def adjacent_bmm(adjacent, features):
+    """
+    batched adjacent * features
+    :param adjacent: dense [b, n, n], or sparse block-diagonal [b * n, b * n]
+        (EventDataIO.sparse_adjacent_nodes)
+    :param features: [b, n, d]
+    :return: [b, n, d]
+    """
+    if adjacent.data.is_sparse:
+        b, n, d = features.size()
+        return torch.mm(adjacent, features.contiguous().view(b * n, d)).view(
+            b, n, d)
+    return torch.bmm(adjacent, features)
+
+
 class MaskKernelCrf(LinearKernelCRF):
     def __init__(self, para, ext_data=None):
         super(MaskKernelCrf, self).__init__(para, ext_data)
@@ -94,7 +108,7 @@ class StructEventKernelCRF(MaskKNRM):
         else:
             logging.info('Running model without masking.')
 
-        if use_cuda:
+        if use_cuda():
             self.node_lr.cuda()
 
     def forward(self, h_packed_data):
@@ -195,7 +209,7 @@ class MultiEventKernelCRF(StructEventKernelCRF):
                 # If arguments are used, we override the Linear to include
                 # argument output.
                 self.linear = nn.Linear(self.K * 2 + 1, 1, bias=True)
-                if use_cuda:
+                if use_cuda():
                     self.linear.cuda()
         else:
             self.setup_multi_kernel(para, l_mu, l_sigma)
@@ -204,8 +218,8 @@ class MultiEventKernelCRF(StructEventKernelCRF):
             # Argument voting always have its own kernel, to simplify
             # experiments.
             logging.info("Initializing argument kernels.")
-            self.kp_args = KernelPooling(l_mu, l_sigma)
-            if use_cuda:
+            self.kp_args = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
+            if use_cuda():
                 self.kp_args.cuda()
 
         self.arg_voting = para.arg_voting
@@ -230,8 +244,8 @@ class MultiEventKernelCRF(StructEventKernelCRF):
         elif self.kernel_type == 2:
             # Type 2, events have their own votes, yet there are
             # no direction in entity event similarities.
-            self.kp_evm = KernelPooling(l_mu, l_sigma)
-            self.kp_ent_evm = KernelPooling(l_mu, l_sigma)
+            self.kp_evm = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
+            self.kp_ent_evm = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
             self.kp_evm_ent = self.kp_ent_evm
 
             # The output layers are not shared.
@@ -243,9 +257,9 @@ class MultiEventKernelCRF(StructEventKernelCRF):
         elif self.kernel_type == 3:
             # Type 3, there are even direction between event entity
             # similarities
-            self.kp_evm = KernelPooling(l_mu, l_sigma)
-            self.kp_ent_evm = KernelPooling(l_mu, l_sigma)
-            self.kp_evm_ent = KernelPooling(l_mu, l_sigma)
+            self.kp_evm = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
+            self.kp_ent_evm = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
+            self.kp_evm_ent = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
 
             # The output layers are not shared.
             self.e_linear = nn.Linear(self.K * 2 + 1, 1, bias=True)
@@ -254,7 +268,7 @@ class MultiEventKernelCRF(StructEventKernelCRF):
             else:
                 self.evm_linear = nn.Linear(self.K * 2 + 1, 1, bias=True)
 
-        if use_cuda:
+        if use_cuda():
             self.kp_evm.cuda()
             self.kp_ent_evm.cuda()
             self.kp_evm_ent.cuda()
@@ -270,7 +284,7 @@ class MultiEventKernelCRF(StructEventKernelCRF):
         if self.event_labels_only:
             # mask to keep only event outputs.
             mask = Variable(torch.zeros(e_output.size()))
-            if use_cuda:
+            if use_cuda():
                 mask = mask.cuda()
             e_output = e_output * mask
 
@@ -358,7 +372,7 @@ class MultiEventKernelCRF(StructEventKernelCRF):
             # pad to len(evm) + len(entity)
             left_pads = Variable(
                 torch.zeros(mtx_e.size()[0], mtx_e.size()[1], self.K))
-            if use_cuda:
+            if use_cuda():
                 left_pads = left_pads.cuda()
 
             kp_arg_mtx_padded = torch.cat([left_pads, kp_arg_mtx], 1)
@@ -452,7 +466,7 @@ class MultiEventKernelCRF(StructEventKernelCRF):
             if has_entities:
                 # Empty kernel features from events.
                 kp_ent_event_mtx = Variable(torch.zeros(kp_e_mtx.size()))
-                if use_cuda:
+                if use_cuda():
                     kp_ent_event_mtx = kp_ent_event_mtx.cuda()
                 l_entity_features.append(kp_ent_event_mtx)
 
@@ -555,7 +569,7 @@ class FeatureConcatKernelCRF(StructEventKernelCRF):
         # These features are the kernelized voting to the related entities.
         # I think putting them together with the events are making the kernels
         # confusing.
-        edge_features = torch.bmm(adjacent, features)
+        edge_features = adjacent_bmm(adjacent, features)
         full_features = torch.cat((features, edge_features), -1)
 
         output = self.linear(full_features).squeeze(-1)
@@ -599,7 +613,7 @@ class AverageArgumentKernelCRF(StructEventKernelCRF):
         self.evm_arg_linear = nn.Linear(self.embedding_dim * 2,
                                         self.embedding_dim)
 
-        if use_cuda:
+        if use_cuda():
             self.args_linear.cuda()
             self.evm_arg_linear.cuda()
 
@@ -609,7 +623,7 @@ class AverageArgumentKernelCRF(StructEventKernelCRF):
         if ts_args is None:
             # This is actually wrong, you cannot simulate the embedding with zeros.
             mtx_arg = torch.zeros(mtx_p_embedding.size())
-            if use_cuda:
+            if use_cuda():
                 mtx_arg = mtx_arg.cuda()
         else:
             mtx_arg_embedding_sum = self._argument_sum(ts_args, ts_arg_mask)
@@ -636,7 +650,7 @@ class GraphCNNKernelCRF(StructEventKernelCRF):
     def __init__(self, para, ext_data=None):
         super(GraphCNNKernelCRF, self).__init__(para, ext_data)
         self.w_cnn = nn.Linear(self.K + 1, self.K + 1, bias=True)
-        if use_cuda:
+        if use_cuda():
             self.w_cnn.cuda()
 
     def compute_score(self, h_packed_data):
@@ -657,7 +671,7 @@ class GraphCNNKernelCRF(StructEventKernelCRF):
         return torch.cat((kp_mtx, node_score), -1)
 
     def gcnn_layer(self, adjacent, gcnn_input):
-        gcnn_features = torch.bmm(adjacent, gcnn_input)
+        gcnn_features = adjacent_bmm(adjacent, gcnn_input)
         return F.dropout(F.relu(self.w_cnn(gcnn_features)))
 
     def _softmax_feature_size(self):
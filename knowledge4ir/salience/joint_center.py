@@ -53,13 +53,14 @@ from knowledge4ir.salience.graph_model import (
     ResidualGraphCNNKernelCRF,
 )
 from knowledge4ir.salience.utils.joint_data_io import EventDataIO
+from knowledge4ir.salience.utils.prefetch import PackedBatch
+from knowledge4ir.salience.utils.sharded_predict import sharded_predict
 
 from knowledge4ir.utils import (
     add_svm_feature,
     mutiply_svm_feature,
 )
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class JointSalienceModelCenter(SalienceModelCenter):
@@ -139,6 +140,10 @@ class JointSalienceModelCenter(SalienceModelCenter):
               model_out_name=None):
         if not model_out_name:
             model_out_name = train_in_name + '.model_%s' % self.model_name
+        if not self.checkpoint_out:
+            # without the time stamp, so a restarted run finds it
+            self.checkpoint_out = model_out_name + '.ckpt'
+        # a resumed run keeps the time stamped name in its checkpoint
         name, ext = os.path.splitext(model_out_name)
         model_out_name = name + "_" + self.init_time + ext
         super(JointSalienceModelCenter, self).train(train_in_name,
@@ -223,14 +228,14 @@ class JointSalienceModelCenter(SalienceModelCenter):
 
         self.model.debug_mode(debug)
         self.model.eval()
+        if self.nb_predict_worker > 1:
+            sharded_predict(self, test_in_name, label_out_name,
+                            self.nb_predict_worker,
+                            self._predict_out_names(label_out_name, timestamp))
+            return
 
-        name, ext = os.path.splitext(label_out_name)
-        if timestamp:
-            ent_label_out_name = name + "_entity_" + self.init_time + ext
-            evm_label_out_name = name + "_event_" + self.init_time + ext
-        else:
-            ent_label_out_name = name + "_entity" + ext
-            evm_label_out_name = name + "_event" + ext
+        ent_label_out_name, evm_label_out_name = self._predict_out_names(
+            label_out_name, timestamp)
 
         ent_out = open(ent_label_out_name, 'w')
         evm_out = open(evm_label_out_name, 'w')
@@ -247,13 +252,19 @@ class JointSalienceModelCenter(SalienceModelCenter):
 
         h_total_ent_eva = dict()
         h_total_evm_eva = dict()
-        for line in open(test_in_name):
-            if self.io_parser.is_empty_line(line):
-                continue
+        for line in self._iter_doc(test_in_name):
+            h_pruned = None
+            if self.prescreener.top_n:
+                line, h_pruned, h_label = self._prescreen(line)
             l_h_out = self._per_doc_predict(line)
 
             if not l_h_out:
                 continue
+            if h_pruned:
+                l_h_out = [self.prescreener.merge(h_out, h_pruned[name],
+                                                  h_label[name],
+                                                  self.evaluator)
+                           for h_out, name in zip(l_h_out, self.output_names)]
 
             for h_out, name, out in zip(l_h_out, self.output_names, outs):
                 if not h_out:
@@ -317,6 +328,16 @@ class JointSalienceModelCenter(SalienceModelCenter):
         evm_out.close()
         return
 
+    def _predict_out_names(self, label_out_name, timestamp=True):
+        name, ext = os.path.splitext(label_out_name)
+        if timestamp:
+            ent_label_out_name = name + "_entity_" + self.init_time + ext
+            evm_label_out_name = name + "_event_" + self.init_time + ext
+        else:
+            ent_label_out_name = name + "_entity" + ext
+            evm_label_out_name = name + "_event" + ext
+        return [ent_label_out_name, evm_label_out_name]
+
     @staticmethod
     def tab_scores(h_e_mean_eva, h_evm_mean_eva):
         logging.info("Results to copy to Excel:")
@@ -413,7 +434,7 @@ class JointSalienceModelCenter(SalienceModelCenter):
         return l_h_out
 
     def _merged_output(self, line, key_name, docno):
-        l_h_out = [{}] * len(self.output_names)
+        l_h_out = [{} for __ in self.output_names]
 
         h_combined = {key_name: docno}
         l_h_out[0][key_name] = docno
@@ -479,7 +500,7 @@ class JointSalienceModelCenter(SalienceModelCenter):
         return l_h_out
 
     def _per_doc_predict(self, line):
-        h_info = json.loads(line)
+        h_info = self._load_info(line)
         key_name = 'docno'
         if key_name not in h_info:
             key_name = 'qid'
@@ -494,6 +515,8 @@ class JointSalienceModelCenter(SalienceModelCenter):
             return self._merged_output(line, key_name, docno)
 
     def _data_io(self, l_line):
+        if isinstance(l_line, PackedBatch):
+            return l_line.packed
         return self.model.data_io(l_line, self.io_parser)
 
 
@@ -9,8 +9,7 @@ import torch
 from torch import nn as nn
 
 from knowledge4ir.salience.base import SalienceBaseModel, KernelPooling
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class MaskKNRM(SalienceBaseModel):
@@ -18,11 +17,11 @@ class MaskKNRM(SalienceBaseModel):
         super(MaskKNRM, self).__init__(para, ext_data)
         l_mu, l_sigma = para.form_kernels()
         self.K = len(l_mu)
-        self.kp = KernelPooling(l_mu, l_sigma)
+        self.kp = KernelPooling(l_mu, l_sigma, para.kernel_chunk)
         self.dropout = nn.Dropout(p=para.dropout_rate)
         self.linear = nn.Linear(self._softmax_feature_size(), 1, bias=True)
         self._load_embedding(para, ext_data)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying knrm parameter to cuda')
             self.embedding.cuda()
             self.kp.cuda()
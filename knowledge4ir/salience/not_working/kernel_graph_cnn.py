@@ -25,7 +25,7 @@ class KernelGraphWalk(SalienceBaseModel):
         # self.linear = nn.Linear(self.K, 1, bias=True)
         if pre_embedding is not None:
             self.embedding.weight.data.copy_(torch.from_numpy(pre_embedding))
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             self.kp.cuda()
@@ -51,7 +51,7 @@ class KernelGraphWalk(SalienceBaseModel):
             kp_mtx = self.kp(trans_mtx, output)
             output = linear(kp_mtx)
             output = output.squeeze(-1)
-        if use_cuda:
+        if use_cuda():
             return output.cuda()
         else:
             return output
@@ -61,7 +61,7 @@ class HighwayKCNN(KNRM):
     def __init__(self, para, pre_embedding=None):
         super(HighwayKCNN, self).__init__(para, pre_embedding)
         self.linear_combine = nn.Linear(2, 1)
-        if use_cuda:
+        if use_cuda():
             self.linear_combine.cuda()
         return
 
@@ -10,7 +10,7 @@ from torch.autograd import Variable
 from torch import optim
 import torch.nn.functional as F
 import logging
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class BiGRU(nn.Module):
@@ -23,7 +23,7 @@ class BiGRU(nn.Module):
         super(BiGRU, self).__init__()
         self.embedding = nn.Embedding(vocab_size, embedding_dim)
         self.linear = nn.Linear(1, 2, bias=True)
-        if use_cuda:
+        if use_cuda():
             logging.info('copying parameter to cuda')
             self.embedding.cuda()
             self.linear.cuda()
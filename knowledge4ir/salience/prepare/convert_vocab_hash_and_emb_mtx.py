@@ -1,71 +1,67 @@
 """
 for term hash and embedding numpy mtx
 input:
-    word2vec format embedding
+    word2vec format embedding, text, or binary if ends with .bin
+    streamed twice (see stream_word2vec), the model is never loaded
 output:
-    word -> id's pickle dict
-    entity -> id's pickle dict
+    word -> id's pickle dict, and vocabulary dir (salience.utils.vocabulary)
+    entity -> id's pickle dict, and vocabulary dir
     word embedding mtx, np.save() format, each row corresponds to word's id (start from 0's unk embedding)
     entity embedding mtx, one row for each entity, start from 0's unk embedding
 """
 
 import pickle
-import numpy as np
-import json
 import logging
+from knowledge4ir.salience.utils.vocabulary import dump_vocabulary
+from knowledge4ir.salience.prepare.stream_word2vec import (
+    iter_word2vec_words,
+    word2vec_to_npy,
+)
 
 
-def process(in_name, out_pre):
+def _is_entity(v):
+    return v.startswith('/m/')
+
+
+def _is_word(v):
+    return not _is_entity(v)
 
-    l_word_emb = []
-    l_e_emb = []
-    l_word = []
-    l_e = []
-    v_size, d = 0, 300
-
-    for p, line in enumerate(open(in_name)):
-
-        if not p:
-            v_size, d = line.strip().split()
-            d = int(d)
-            l_word.append('UNK')
-            l_e.append('/m/UNK')
-            l_word_emb.append(np.random.rand(d))
-            l_e_emb.append(np.random.rand(d))
-            continue
-        if not p % 10000:
-            print "read [%d] lines" % p
-
-        cols = line.strip().split()
-        v = cols[0]
-        emb = [float(col) for col in cols[1:]]
-        assert len(emb) == d
-        if v.startswith('/m/'):
-            l_e.append(v)
-            l_e_emb.append(emb)
+
+def process(in_name, out_pre):
+    h_w = {'UNK': 0}
+    h_e = {'/m/UNK': 0}
+    nb_w, nb_e = 1, 1
+
+    for p, v in enumerate(iter_word2vec_words(in_name)):
+        if not p % 100000:
+            print "read [%d] words" % p
+        if _is_entity(v):
+            h_e[v] = nb_e
+            nb_e += 1
         else:
-            l_word.append(v)
-            l_word_emb.append(emb)
+            h_w[v] = nb_w
+            nb_w += 1
 
-    print "[%d] word [%d] e" % (len(l_word), len(l_e))
+    print "[%d] word [%d] e" % (nb_w, nb_e)
     print "dumping word hash..."
-    h_w = dict(zip(l_word, range(len(l_word))))
     pickle.dump(h_w, open(out_pre + '.word.pickle', 'w'))
+    dump_vocabulary(h_w, out_pre + '.word.vocab')
     print "dumping entity hash..."
-    h_e = dict(zip(l_e, range(len(l_e))))
     pickle.dump(h_e, open(out_pre + '.entity.pickle', 'w'))
-    print "dumping word emb..."
-    mtx_emb = np.array(l_word_emb)
-    np.save(open(out_pre + '_word_emb.npy', 'w'), mtx_emb)
-    print "dumping entity emb..."
-    mtx_emb = np.array(l_e_emb)
-    np.save(open(out_pre + '_entity_emb.npy', 'w'), mtx_emb)
+    dump_vocabulary(h_e, out_pre + '.entity.vocab')
+    print "dumping word and entity emb..."
+    word2vec_to_npy(in_name, [(_is_word, nb_w, out_pre + '_word_emb.npy'),
+                              (_is_entity, nb_e,
+                               out_pre + '_entity_emb.npy')])
 
     print "finished"
 
 
 if __name__ == '__main__':
     import sys
+    from knowledge4ir.utils import set_basic_log
+
+    set_basic_log(logging.INFO)
     if 3 != len(sys.argv):
         print "make embedding npy mtx and vocabulary hash"
         print "2 para: word2vec in + out pre"
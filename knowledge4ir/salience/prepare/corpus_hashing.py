@@ -1,9 +1,40 @@
 """
 hash the json format training and testing corpus
+
+with nb_worker > 1, chunks of chunk_lines lines are hashed by forked worker
+processes, which share the word/entity/event id dicts copy-on-write (or the
+mapped pages of vocabulary dirs, see salience.utils.vocabulary), and are
+written back in the input order.
+the ids of the other event sparse features (the lookups) are given in the
+order they are first met, so workers leave placeholders for them, and the
+writer assigns them in the input order, the output is the same bytes as the
+serial one.
+
+out_format binary writes the hashed docs to the columnar layout of
+salience.utils.hashed_binary (out_name is a dir) instead of json lines, which
+the salience centers read without json decoding.
+
+incremental keeps a manifest next to the output (out_name + '.manifest'):
+the vocabulary versions and the hashing config, then one line per input doc:
+docno, md5 of its raw line, its position in the output (-1 if dropped).
+the next run with the same vocabularies and config only hashes the lines
+whose digest is not in the manifest, and splices the old hashed docs of the
+others into the new output, in the new input order. docs no longer in the
+input are gone. the event feature lookups are loaded from lookup_out_dir, so
+the ids in the old docs stay valid and new values get new ids (the ids are
+not the ones a full run would give). a changed vocabulary or config hashes
+everything again.
 """
 
+import hashlib
 import json
 import logging
+import os
+import re
+import shutil
+from collections import deque
+
+import multiprocessing as mp
 from traitlets.config import Configurable
 from traitlets import (
     Int,
@@ -18,8 +49,20 @@ import numpy as np
 import gzip
 from collections import defaultdict
 from itertools import chain
+from knowledge4ir.salience.utils.hashed_binary import (
+    HashedBinaryWriter,
+    HashedBinaryCorpus,
+)
+from knowledge4ir.salience.utils.vocabulary import (
+    load_vocabulary,
+    vocabulary_version,
+)
 
 UNK_TOKEN = "UNK"
+MANIFEST_VERSION = 1
+DEFERRED_PREFIX = u'\x00lookup_'
+DEFERRED_ID = DEFERRED_PREFIX + u'%d'
+DEFERRED_ID_PATTERN = re.compile(r'"\\u0000lookup_(\d+)"')
 
 
 def get_lookup():
@@ -28,6 +71,15 @@ def get_lookup():
     return unk, lookup
 
 
+def load_lookup(h_id):
+    """
+    a lookup that continues the ids of a saved one
+    """
+    unk, lookup = get_lookup()
+    lookup.update(h_id)
+    return lookup
+
+
 def fix_lookup(lookup):
     return defaultdict(lambda: UNK_TOKEN, lookup)
 
@@ -43,9 +95,12 @@ def load_frame_names(frame_file):
 
 
 class CorpusHasher(Configurable):
-    word_id_pickle_in = Unicode(help='pickle of word id').tag(config=True)
-    entity_id_pickle_in = Unicode(help='pickle of entity id').tag(config=True)
-    event_id_pickle_in = Unicode(help='pickle of event id').tag(config=True)
+    word_id_pickle_in = Unicode(help='pickle (or vocabulary dir) of word id'
+                                ).tag(config=True)
+    entity_id_pickle_in = Unicode(help='pickle (or vocabulary dir) of entity'
+                                       ' id').tag(config=True)
+    event_id_pickle_in = Unicode(help='pickle (or vocabulary dir) of event id'
+                                 ).tag(config=True)
     corpus_in = Unicode(help='input').tag(config=True)
     out_name = Unicode().tag(config=True)
     lookup_out_dir = Unicode(help='Directory to write additional lookups').tag(
@@ -66,23 +121,41 @@ class CorpusHasher(Configurable):
 
     content_field = Unicode(help='the main content field').tag(config=True)
     salience_field = Unicode(help='the salience field').tag(config=True)
+    nb_worker = Int(1, help='number of hashing processes, 1 to hash in this'
+                            ' process').tag(config=True)
+    chunk_lines = Int(1000, help='lines per chunk sent to a hashing process'
+                      ).tag(config=True)
+    out_format = Unicode('json', help='json: json lines; binary: the'
+                                      ' columnar layout of hashed_binary, in'
+                                      ' the out_name dir').tag(config=True)
+    incremental = Bool(False, help='only hash the docs new or changed since'
+                                   ' the last run, by the manifest next to'
+                                   ' out_name').tag(config=True)
 
     lookups = {}
 
     def __init__(self, **kwargs):
         super(CorpusHasher, self).__init__(**kwargs)
-        self.h_word_id = pickle.load(open(self.word_id_pickle_in))
-        self.h_entity_id = pickle.load(open(self.entity_id_pickle_in))
+        self.h_word_id = load_vocabulary(self.word_id_pickle_in)
+        self.h_entity_id = load_vocabulary(self.entity_id_pickle_in)
 
         logging.info('loaded [%d] word ids, [%d] entity ids]',
                      len(self.h_word_id), len(self.h_entity_id))
 
         if self.hash_events:
             if self.event_id_pickle_in:
-                self.h_event_id = pickle.load(open(self.event_id_pickle_in))
+                self.h_event_id = load_vocabulary(self.event_id_pickle_in)
                 logging.info("Loaded [%d] event ids.", len(self.h_event_id))
 
         self.sparse_feature_dicts = {}
+        self.defer_lookups = False
+        self.l_deferred = []
+
+        self.h_digest_old = None
+        self.get_old_doc = None
+        self.manifest_out = None
+        self.nb_out = 0
+        self.nb_reused = 0
 
     def _hash_spots(self, h_info, h_hashed):
         h_hashed['spot'] = dict()
@@ -190,9 +263,8 @@ class CorpusHasher(Configurable):
                     else:
                         # Create a new lookup for other features, which
                         # accumulate the feature id.
-                        if fname not in self.lookups:
-                            _, self.lookups[fname] = get_lookup()
-                        sparse_data[fname].append(self.lookups[fname][fvalue])
+                        sparse_data[fname].append(
+                            self._lookup_id(fname, fvalue))
 
             l_salience = self._get_event_salience(l_ana)
 
@@ -206,6 +278,15 @@ class CorpusHasher(Configurable):
                 this_field_data['loc'] = ll_loc
             h_hashed['event'][field] = this_field_data
 
+    def _lookup_id(self, fname, fvalue):
+        if self.defer_lookups:
+            # assigned by the writer, see _resolve_lookups
+            self.l_deferred.append((fname, fvalue))
+            return DEFERRED_ID % (len(self.l_deferred) - 1)
+        if fname not in self.lookups:
+            _, self.lookups[fname] = get_lookup()
+        return self.lookups[fname][fvalue]
+
     def _hash_graph(self, h_info, h_hashed):
         h_adjacent = {}
         for adjacences in h_info['adjacentList']:
@@ -239,28 +320,290 @@ class CorpusHasher(Configurable):
 
         return h_hashed
 
+    def hash_doc(self, line):
+        """
+        :return: the hashed doc, None if its content field has no entity
+        """
+        return self._hash_info(json.loads(line))
+
+    def _hash_info(self, h_info):
+        h_hashed = self.hash_per_info(h_info)
+        if self.content_field:
+            if not h_hashed['spot'][self.content_field]['entities']:
+                return None
+        return h_hashed
+
+    def hash_line(self, line):
+        """
+        :return: the hashed doc json, None if its content field has no entity
+        """
+        h_hashed = self.hash_doc(line)
+        if h_hashed is None:
+            return None
+        return json.dumps(h_hashed)
+
+    def _hash_out(self, line):
+        """
+        :return: the hashed doc, json or dict by out_format, or None,
+            and its docno (or qid)
+        """
+        h_info = json.loads(line)
+        key = h_info.get('docno', h_info.get('qid', ''))
+        h_hashed = self._hash_info(h_info)
+        if h_hashed is None or self.out_format == 'binary':
+            return h_hashed, key
+        return json.dumps(h_hashed), key
+
+    def _write(self, out, doc):
+        if self.out_format == 'binary':
+            out.add(doc)
+        else:
+            print >> out, doc
+
     def process(self):
-        out = open(self.out_name, 'w')
+        out_name = self.out_name
+        if self.incremental:
+            self._start_incremental()
+            out_name = self.out_name.rstrip('/') + '.tmp'
+        if self.out_format == 'binary':
+            out = HashedBinaryWriter(out_name)
+        else:
+            out = open(out_name, 'w')
         open_func = gzip.open if self.corpus_in.endswith("gz") else open
         with open_func(self.corpus_in) as in_f:
-            for p, line in enumerate(in_f):
-                h_hashed = self.hash_per_info(json.loads(line))
-                if self.content_field:
-                    if not h_hashed['spot'][self.content_field]['entities']:
-                        continue
-                print >> out, json.dumps(h_hashed)
-                if not p % 1000:
-                    logging.info('processing [%d] lines', p)
+            if self.nb_worker > 1:
+                self._parallel_process(in_f, out)
+            else:
+                for p, (digest, old, line) in enumerate(self._entries(in_f)):
+                    res = None
+                    if line is not None:
+                        res = self._hash_out(line) + ([],)
+                    self._write_entry(out, (digest, old, line), res)
+                    if not p % 1000:
+                        logging.info('processing [%d] lines', p)
 
         if self.lookup_out_dir:
             self._save_event_lookup()
 
         out.close()
+        if self.incremental:
+            self._finish_incremental(out_name)
         logging.info('finished')
         return
 
+    def _entries(self, in_f):
+        """
+        (digest, old manifest entry, line) of the input lines
+        the line is None if its hashed doc is reused from the last run
+        """
+        for line in in_f:
+            if self.h_digest_old is None:
+                yield None, None, line
+                continue
+            digest = hashlib.md5(line).hexdigest()
+            old = self.h_digest_old.get(digest)
+            yield digest, old, None if old is not None else line
+
+    def _write_entry(self, out, entry, res):
+        """
+        :param entry: (digest, old manifest entry, line), from _entries
+        :param res: (hashed doc, docno, deferred lookups) of the line,
+            None for a reused doc
+        """
+        digest, old, __ = entry
+        if res is None:
+            key, p_old = old
+            doc = self.get_old_doc(p_old) if p_old >= 0 else None
+            self.nb_reused += 1
+        else:
+            doc, key, l_deferred = res
+            if l_deferred:
+                doc = self._resolve_lookups(doc, l_deferred)
+        p_out = -1
+        if doc is not None:
+            self._write(out, doc)
+            p_out = self.nb_out
+            self.nb_out += 1
+        if self.manifest_out is not None:
+            key = key.encode('utf-8') if isinstance(key, unicode) else str(key)
+            if '\n' in key:
+                # tabs are fine, the manifest lines are split from the right
+                logging.error('docno [%r] has a newline', key)
+                raise ValueError
+            print >> self.manifest_out, '%s\t%s\t%d' % (key, digest, p_out)
+
+    def _manifest_header(self):
+        h_vocab = {}
+        for name in ['word_id_pickle_in', 'entity_id_pickle_in',
+                     'event_id_pickle_in']:
+            in_name = getattr(self, name)
+            if in_name and (name != 'event_id_pickle_in' or self.hash_events):
+                h_vocab[name] = vocabulary_version(in_name)
+        h_config = dict([(name, getattr(self, name)) for name in [
+            'with_feature', 'max_e_per_d', 'with_position',
+            'max_position_per_e', 'hash_events', 'hash_graph',
+            'frame_name_file', 'content_field', 'salience_field',
+            'out_format']])
+        return {'version': MANIFEST_VERSION, 'vocab': h_vocab,
+                'config': h_config}
+
+    def _load_manifest(self, manifest_name, h_header):
+        """
+        :return: {digest: (docno, position in the output)} of the last run,
+            None if it can not be reused
+        """
+        if not os.path.exists(manifest_name) or not os.path.exists(
+                self.out_name):
+            logging.info('no manifest or output of a last run, hashing all')
+            return None
+        with open(manifest_name) as f:
+            if json.loads(f.readline()) != h_header:
+                logging.info('vocabulary or hashing config changed since the'
+                             ' last run, hashing all')
+                return None
+            h_digest = {}
+            for line in f:
+                key, digest, p_out = line.rstrip('\n').rsplit('\t', 2)
+                h_digest[digest] = (key.decode('utf-8'), int(p_out))
+        logging.info('manifest [%s] loaded, [%d] docs', manifest_name,
+                     len(h_digest))
+        return h_digest
+
+    def _open_old_output(self):
+        """
+        :return: the function from a position to the doc of the last output
+            and the number of docs in it
+        """
+        if self.out_format == 'binary':
+            corpus = HashedBinaryCorpus(self.out_name)
+            return corpus.get_doc, len(corpus)
+        f = open(self.out_name)
+        l_offset = []
+        while True:
+            offset = f.tell()
+            if not f.readline():
+                break
+            l_offset.append(offset)
+
+        def get_doc(p):
+            f.seek(l_offset[p])
+            return f.readline().rstrip('\n')
+        return get_doc, len(l_offset)
+
+    def _start_incremental(self):
+        if self.hash_events and not self.lookup_out_dir:
+            logging.error('incremental hashing of events needs lookup_out_dir'
+                          ' to keep the event feature ids')
+            raise ValueError
+        manifest_name = self.out_name.rstrip('/') + '.manifest'
+        h_header = self._manifest_header()
+        self.h_digest_old = self._load_manifest(manifest_name, h_header)
+        if self.h_digest_old:
+            self.get_old_doc, nb_old = self._open_old_output()
+            if max([p_out for __, p_out in self.h_digest_old.values()]
+                   ) >= nb_old:
+                logging.info('last output [%s] does not match its manifest,'
+                             ' hashing all', self.out_name)
+                self.h_digest_old = {}
+        if self.h_digest_old and self.hash_events:
+            self._load_event_lookup()
+        if self.h_digest_old is None:
+            self.h_digest_old = {}
+        self.manifest_out = open(manifest_name + '.tmp', 'w')
+        print >> self.manifest_out, json.dumps(h_header)
+        self.manifest_out.flush()
+
+    def _finish_incremental(self, out_name):
+        self.manifest_out.close()
+        if os.path.isdir(self.out_name):
+            shutil.rmtree(self.out_name)
+        os.rename(out_name, self.out_name.rstrip('/'))
+        manifest_name = self.out_name.rstrip('/') + '.manifest'
+        os.rename(manifest_name + '.tmp', manifest_name)
+        logging.info('incremental hashing wrote [%d] docs, [%d] input lines'
+                     ' reused from the last run', self.nb_out, self.nb_reused)
+
+    def _chunks(self, in_f):
+        l_entry = []
+        for entry in self._entries(in_f):
+            l_entry.append(entry)
+            if len(l_entry) >= self.chunk_lines:
+                yield l_entry
+                l_entry = []
+        if l_entry:
+            yield l_entry
+
+    def _parallel_process(self, in_f, out):
+        """
+        hash the chunks in nb_worker processes, at most 2 chunks per worker
+        in flight, and write them in the input order
+        """
+        global _hasher
+        _hasher = self
+        self.defer_lookups = True
+        pool = mp.Pool(self.nb_worker)
+        self.defer_lookups = False
+        logging.info('hashing with [%d] processes', self.nb_worker)
+
+        q_pending = deque()
+        p = 0
+        for l_entry in self._chunks(in_f):
+            l_line = [line for __, __, line in l_entry if line is not None]
+            q_pending.append(
+                (l_entry, pool.apply_async(_hash_chunk, (l_line,))))
+            if len(q_pending) >= 2 * self.nb_worker:
+                l_entry, res = q_pending.popleft()
+                p = self._write_chunk(l_entry, res.get(), out, p)
+        while q_pending:
+            l_entry, res = q_pending.popleft()
+            p = self._write_chunk(l_entry, res.get(), out, p)
+        pool.close()
+        pool.join()
+        _hasher = None
+
+    def _write_chunk(self, l_entry, l_res, out, p):
+        it_res = iter(l_res)
+        for entry in l_entry:
+            res = next(it_res) if entry[2] is not None else None
+            self._write_entry(out, entry, res)
+            if not p % 1000:
+                logging.info('processing [%d] lines', p)
+            p += 1
+        return p
+
+    def _resolve_lookups(self, doc, l_deferred):
+        """
+        assign the deferred lookup ids in the order the serial hashing would,
+        and put them in the hashed doc (json or dict)
+        ids are assigned for docs not written too, as the serial hashing does
+        """
+        l_id = [self._lookup_id(fname, fvalue) for fname, fvalue in l_deferred]
+        if doc is None:
+            return None
+        if type(doc) is dict:
+            for h_field in doc.get('event', {}).values():
+                for l_value in h_field.get('sparse_features', {}).values():
+                    for p, value in enumerate(l_value):
+                        if isinstance(value, unicode) and value.startswith(
+                                DEFERRED_PREFIX):
+                            l_value[p] = l_id[int(value[len(DEFERRED_PREFIX):])]
+            return doc
+        return DEFERRED_ID_PATTERN.sub(
+            lambda match: str(l_id[int(match.group(1))]), doc)
+
+    def _load_event_lookup(self):
+        for name in os.listdir(self.lookup_out_dir):
+            if not (name.startswith('event_feature_')
+                    and name.endswith('.pickle')):
+                continue
+            fname = name[len('event_feature_'):-len('.pickle')]
+            self.lookups[fname] = load_lookup(pickle.load(open(
+                os.path.join(self.lookup_out_dir, name))))
+        logging.info('loaded the event feature lookups of the last run: %s',
+                     json.dumps(dict([(fname, len(lookup)) for fname, lookup
+                                      in self.lookups.items()])))
+
     def _save_event_lookup(self):
-        import os
         if not os.path.exists(self.lookup_out_dir):
             os.makedirs(self.lookup_out_dir)
             logging.info("Additional lookup index are written to %s",
@@ -345,6 +688,23 @@ class CorpusHasher(Configurable):
         return ll_loc
 
 
+_hasher = None
+
+
+def _hash_chunk(l_line):
+    """
+    hash a chunk in a worker process, with the CorpusHasher forked from the
+    parent
+    :return: [(hashed doc, json or dict by out_format, or None, docno,
+        deferred lookups)]
+    """
+    l_res = []
+    for line in l_line:
+        _hasher.l_deferred = []
+        l_res.append(_hasher._hash_out(line) + (_hasher.l_deferred,))
+    return l_res
+
+
 if __name__ == '__main__':
     import sys
     from knowledge4ir.utils import (
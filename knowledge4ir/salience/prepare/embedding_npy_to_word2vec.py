@@ -5,7 +5,7 @@ convert npy data to word2vec format
 import json
 import numpy as np
 import sys
-import pickle
+from knowledge4ir.salience.utils.vocabulary import load_vocabulary
 
 
 def convert_one_line(mtx, k, l_id):
@@ -21,7 +21,7 @@ def process(emb_in, id_dict_in, out_name):
     print "loading embedding"
     emb_mtx = np.load(open(emb_in))
     print "loading name id dict"
-    h_name_id = pickle.load(open(id_dict_in))
+    h_name_id = load_vocabulary(id_dict_in)
     l_name = [''] * len(h_name_id)
     for name, i in h_name_id.items():
         l_name[i] = name
@@ -6,8 +6,8 @@ semantics:
     entity triples
 
 input:
-    e id hash dict (from convert_vocab_hash_and_emb_mtx.py)
-    word id hash dict
+    e id hash dict (from convert_vocab_hash_and_emb_mtx.py), pickle or vocabulary dir
+    word id hash dict, pickle or vocabulary dir
     type id hash dict
     semantics in json format
         id: str
@@ -29,10 +29,10 @@ import logging
 import gzip
 import json
 import numpy as np
-import pickle
 from knowledge4ir.utils import (
     tokenize_and_remove_punctuation,
 )
+from knowledge4ir.salience.utils.vocabulary import load_vocabulary
 reload(sys)  # Reload does the trick!
 sys.setdefaultencoding('UTF8')
 
@@ -73,10 +73,10 @@ class ExtSemanticPrep(Configurable):
 
     def _load_ids(self):
         logging.info('loading e id [%s]...', self.e_id_hash_in)
-        self.h_e_id = pickle.load(open(self.e_id_hash_in))
+        self.h_e_id = load_vocabulary(self.e_id_hash_in)
         logging.info('%d entities', len(self.h_e_id))
         logging.info('loading w id [%s]...', self.word_id_hash_in)
-        self.h_w_id = pickle.load(open(self.word_id_hash_in))
+        self.h_w_id = load_vocabulary(self.word_id_hash_in)
         logging.info('%d words', len(self.h_w_id))
 
     def _load_semantics(self):
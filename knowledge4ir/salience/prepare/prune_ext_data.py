@@ -0,0 +1,102 @@
+"""
+prune the entity tables of ExtData to the entities a hashed corpus uses
+
+input:
+    hashed corpora (CorpusHasher output, json lines or binary layout)
+    the entity embedding, desp, rdf, nlss npy arrays, any of them
+output, in out_dir:
+    entity_id_map.npy: the kept entity ids, sorted, 0 (unk) first
+        the new id of a kept entity is its position in it
+    [table name].pruned.npy: the rows of the kept entities, in the same order
+
+to use the pruned tables, point ExtData's entity_*_in at them and set
+DataIO.entity_id_map_in to entity_id_map.npy. Docs keep their original ids,
+DataIO maps them when parsing, and predictions are written with the original
+ids.
+word tables are not pruned, desp and nlss refer to them by the original word
+ids. Load them with ExtData.mmap_mode instead.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+from traitlets import (
+    List,
+    Unicode,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.utils.hashed_binary import iter_hashed_info
+from knowledge4ir.utils import SPOT_FIELD
+
+
+class ExtDataPruner(Configurable):
+    l_corpus_in = List(Unicode, help='hashed corpora to keep entities of').tag(
+        config=True)
+    spot_field = Unicode(SPOT_FIELD, help='spot field').tag(config=True)
+    entity_emb_in = Unicode(help='hashed numpy entity embedding path').tag(
+        config=True)
+    entity_desp_in = Unicode(help='hashed desp numpy array').tag(config=True)
+    entity_rdf_in = Unicode(help='hashed rdf triple numpy array').tag(
+        config=True)
+    entity_nlss_in = Unicode(
+        help='hashed entity natural language support sentence array').tag(
+        config=True)
+    out_dir = Unicode(help='output dir').tag(config=True)
+
+    def _corpus_entities(self):
+        s_e = set()
+        for corpus_in in self.l_corpus_in:
+            logging.info('scanning entities in [%s]', corpus_in)
+            for p, h_info in enumerate(iter_hashed_info(corpus_in)):
+                for spots in h_info.get(self.spot_field, {}).values():
+                    if type(spots) is dict:
+                        spots = spots.get('entities', [])
+                    s_e.update(spots)
+                if not (p + 1) % 10000:
+                    logging.info('scanned [%d] docs, [%d] entities', p + 1,
+                                 len(s_e))
+        s_e.discard(0)
+        return [0] + sorted(s_e)
+
+    def process(self):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        l_kept_e = self._corpus_entities()
+        logging.info('[%d] entities kept', len(l_kept_e))
+        v_kept_e = np.array(l_kept_e, dtype=np.int64)
+        np.save(open(os.path.join(self.out_dir, 'entity_id_map.npy'), 'wb'),
+                v_kept_e)
+
+        for in_name in [self.entity_emb_in, self.entity_desp_in,
+                        self.entity_rdf_in, self.entity_nlss_in]:
+            if not in_name:
+                continue
+            mtx = np.load(in_name, mmap_mode='r')
+            pruned_mtx = np.ascontiguousarray(mtx[v_kept_e])
+            out_name = os.path.join(
+                self.out_dir,
+                os.path.basename(in_name).replace('.npy', '') + '.pruned.npy')
+            np.save(open(out_name, 'wb'), pruned_mtx)
+            logging.info('[%s] %s pruned to [%s] %s', in_name,
+                         json.dumps(mtx.shape), out_name,
+                         json.dumps(pruned_mtx.shape))
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import (
+        set_basic_log,
+        load_py_config,
+    )
+
+    set_basic_log()
+    if 2 != len(sys.argv):
+        print "prune ExtData entity tables to the entities of hashed corpora"
+        print "1 para: config"
+        ExtDataPruner.class_print_help()
+        sys.exit(-1)
+    pruner = ExtDataPruner(config=load_py_config(sys.argv[1]))
+    pruner.process()
@@ -0,0 +1,125 @@
+"""
+stream word2vec embeddings into npy matrices, without loading the model
+
+reads the word2vec text format, or the binary format (files ending with .bin),
+one entry at a time:
+    iter_word2vec_words(): the words only, binary vectors are skipped by seek
+    word2vec_to_npy(): writes the vectors of the entries each matrix keeps
+        into npy files preallocated with np.lib.format.open_memmap, all in
+        one pass
+so the peak memory is the word -> id dicts, not the model.
+as convert_vocab_hash_and_emb_mtx.py and take_event_embedding.py always made
+them, row 0 (UNK) is np.random.rand, and each kept entry fills the next row
+in the file order, duplicate words included. Their word -> id dicts give a
+duplicate word its last row, and a literal UNK entry its own row.
+"""
+
+import logging
+import struct
+
+import numpy as np
+
+
+def _is_binary(in_name):
+    return in_name.endswith('.bin')
+
+
+def word2vec_header(in_name):
+    """
+    :return: vocabulary size, dimension
+    """
+    with open(in_name, 'rb') as f:
+        v_size, d = f.readline().split()
+    return int(v_size), int(d)
+
+
+def _read_binary_word(f):
+    l_c = []
+    while True:
+        c = f.read(1)
+        if not c:
+            return None
+        if c == ' ':
+            break
+        if c != '\n':
+            l_c.append(c)
+    return ''.join(l_c)
+
+
+def iter_word2vec(in_name, with_vector=True):
+    """
+    :return: (word, np vector or None) of each entry, in the file order
+    """
+    v_size, d = word2vec_header(in_name)
+    with open(in_name, 'rb') as f:
+        f.readline()
+        if _is_binary(in_name):
+            for p in xrange(v_size):
+                word = _read_binary_word(f)
+                if word is None:
+                    break
+                if with_vector:
+                    yield word, np.fromstring(f.read(4 * d), dtype='<f4')
+                else:
+                    f.seek(4 * d, 1)
+                    yield word, None
+            return
+        for line in f:
+            cols = line.split(None, 1)
+            if not cols:
+                continue
+            if not with_vector:
+                yield cols[0], None
+                continue
+            emb = np.fromstring(cols[1], sep=' ') if len(cols) > 1 else []
+            if len(emb) != d:
+                logging.error('[%s] has [%d] dimensions, not [%d]', cols[0],
+                              len(emb), d)
+                raise ValueError
+            yield cols[0], emb
+
+
+def iter_word2vec_words(in_name):
+    for word, __ in iter_word2vec(in_name, with_vector=False):
+        yield word
+
+
+def word2vec_to_npy(in_name, l_keep_out, dtype='float64'):
+    """
+    :param in_name: word2vec text or binary file
+    :param l_keep_out: [(word -> whether kept function, nb of rows, npy out
+        name)], row 0 is random, the kept entries are rows 1 to nb of rows - 1
+    :return: the nb of rows filled from the file, for each matrix
+    """
+    v_size, d = word2vec_header(in_name)
+    l_mtx = []
+    for __, nb_row, out_name in l_keep_out:
+        logging.info('preallocating [%s] %dx%d', out_name, nb_row, d)
+        l_mtx.append(np.lib.format.open_memmap(
+            out_name, mode='w+', dtype=dtype, shape=(nb_row, d)))
+        l_mtx[-1][0] = np.random.rand(d)
+    l_next = [1] * len(l_keep_out)
+
+    for p, (word, emb) in enumerate(iter_word2vec(in_name)):
+        if not p % 100000:
+            logging.info('read [%d/%d] embeddings', p, v_size)
+        for i, (keep, nb_row, out_name) in enumerate(l_keep_out):
+            if not keep(word):
+                continue
+            if l_next[i] >= nb_row:
+                logging.error('[%s] keeps more than [%d] rows of [%s]',
+                              out_name, nb_row, in_name)
+                raise ValueError
+            l_mtx[i][l_next[i]] = emb
+            l_next[i] += 1
+
+    for (__, nb_row, out_name), mtx, nb_filled in zip(l_keep_out, l_mtx,
+                                                      l_next):
+        if nb_filled != nb_row:
+            logging.error('[%s] has [%d] of its [%d] rows in [%s]', out_name,
+                          nb_filled, nb_row, in_name)
+            raise ValueError
+        mtx.flush()
+        logging.info('[%s] written, [%d] rows', out_name, nb_row)
+    del l_mtx
+    return [nb_filled - 1 for nb_filled in l_next]
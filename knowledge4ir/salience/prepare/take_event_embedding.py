@@ -1,7 +1,12 @@
 import json
-import numpy as np
+import logging
 import pickle
 import gzip
+from knowledge4ir.salience.utils.vocabulary import dump_vocabulary
+from knowledge4ir.salience.prepare.stream_word2vec import (
+    iter_word2vec_words,
+    word2vec_to_npy,
+)
 
 
 def get_event_vocab(dataset):
@@ -25,42 +30,32 @@ def process(train_dataset, in_name, out_pre):
     vocab = get_event_vocab(train_dataset)
     print "Event vocabulary size [%d]" % (len(vocab))
 
-    l_word_emb = []
-    l_word = []
-    v_size, d = 0, 300
-
-    for p, line in enumerate(open(in_name)):
-        if not p:
-            v_size, d = line.strip().split()
-            d = int(d)
-            l_word.append('UNK')
-            l_word_emb.append(np.random.rand(d))
-            continue
-        if not p % 10000:
-            print "Read [%d] lines of embeddings" % p
-
-        cols = line.strip().split()
-        v = cols[0]
-        emb = [float(col) for col in cols[1:]]
-        assert len(emb) == d
+    h_w = {'UNK': 0}
+    nb_w = 1
+    for p, v in enumerate(iter_word2vec_words(in_name)):
+        if not p % 100000:
+            print "Read [%d] words of embeddings" % p
         if v in vocab:
-            l_word.append(v)
-            l_word_emb.append(emb)
+            h_w[v] = nb_w
+            nb_w += 1
 
     print "[%d] events extracted from embedding out of [%d]" % (
-        len(l_word), len(vocab))
+        nb_w, len(vocab))
     print "dumping event hash..."
-    h_w = dict(zip(l_word, range(len(l_word))))
     pickle.dump(h_w, open(out_pre + '.event.pickle', 'w'))
+    dump_vocabulary(h_w, out_pre + '.event.vocab')
     print "dumping event emb..."
-    mtx_emb = np.array(l_word_emb)
-    np.save(open(out_pre + '_event_emb.npy', 'w'), mtx_emb)
+    word2vec_to_npy(in_name, [(vocab.__contains__, nb_w,
+                               out_pre + '_event_emb.npy')])
 
     print "finished"
 
 
 if __name__ == '__main__':
     import sys
+    from knowledge4ir.utils import set_basic_log
+
+    set_basic_log(logging.INFO)
 
     if 4 != len(sys.argv):
         print "make embedding event vocabulary from training and then hash"
@@ -0,0 +1,94 @@
+"""
+length bucketed batching
+
+DataIO pads each batch to its largest doc, so batches formed in file order
+are as wide as their longest doc.
+BucketBatchSampler sorts docs by size and cuts the sorted list into batches,
+so docs in one batch have similar numbers of entities (events, words),
+and the batches are shuffled between epochs.
+The docs are then read by position, from a LineCorpus (raw hashed lines)
+or a BinaryCorpus (binary cache).
+"""
+
+import json
+import logging
+
+import numpy as np
+
+
+class LineCorpus(object):
+    """
+    random access to the non-empty docs of a hashed data file
+    keeps the byte offset and the size (io_parser.doc_size) of each doc
+    """
+
+    def __init__(self, in_name, io_parser):
+        self.in_name = in_name
+        self.l_offset = []
+        self.l_size = []
+        offset = 0
+        logging.info('indexing docs in [%s]', in_name)
+        for line in open(in_name):
+            h_info = json.loads(line)
+            if not io_parser.is_empty_info(h_info):
+                self.l_offset.append(offset)
+                self.l_size.append(io_parser.doc_size(h_info))
+            offset += len(line)
+        self.in_file = open(in_name)
+        logging.info('[%d] docs indexed', len(self.l_offset))
+
+    def __len__(self):
+        return len(self.l_offset)
+
+    def get_doc(self, p):
+        self.in_file.seek(self.l_offset[p])
+        return self.in_file.readline()
+
+    def doc_size(self):
+        return self.l_size
+
+
+class BucketBatchSampler(object):
+    """
+    batches of docs with similar sizes
+    each epoch: random permutation, stable sort by size (so ties are grouped
+    differently every epoch), cut into batches, and shuffle the batches.
+    the order is fixed by seed and epoch.
+    """
+
+    def __init__(self, l_size, batch_size, seed=0):
+        """
+        :param l_size: size of each doc, comparable, e.g. (nb_e, nb_w)
+        :param batch_size: number of docs per batch
+        :param seed: random seed, combined with the epoch
+        """
+        self.l_size = l_size
+        self.batch_size = batch_size
+        self.seed = seed
+
+    def __len__(self):
+        return int(np.ceil(len(self.l_size) / float(self.batch_size)))
+
+    def batches(self, epoch=0):
+        """
+        :param epoch:
+        :return: list of batches, each a list of doc positions
+        """
+        rng = np.random.RandomState(self.seed + epoch)
+        l_p = rng.permutation(len(self.l_size)).tolist()
+        l_p.sort(key=lambda p: self.l_size[p])
+        l_batch = [l_p[i:i + self.batch_size]
+                   for i in xrange(0, len(l_p), self.batch_size)]
+        rng.shuffle(l_batch)
+        return l_batch
+
+    def padding_rate(self, l_batch):
+        """
+        the fraction of padded cells (on the first size dim) in l_batch
+        """
+        total, padded = 0, 0
+        for l_p in l_batch:
+            l_len = [self.l_size[p][0] for p in l_p]
+            total += max(l_len) * len(l_len)
+            padded += max(l_len) * len(l_len) - sum(l_len)
+        return padded / float(max(total, 1))
@@ -0,0 +1,250 @@
+"""
+binary cache of the parsed salience docs
+
+a hashed corpus is parsed once by DataIO (json decode, tf sort, max_e_per_d
+cut), and each target field is written to a flat binary file:
+    [cache_dir]/meta.json: schema, nb of docs, the io config it was built with,
+        and the path, size and mtime of the source corpus
+    [cache_dir]/[field].bin: the field's values of all docs, concatenated
+    [cache_dir]/[field].offset.bin: int64, nb_doc + 1 offsets into [field].bin
+    [cache_dir]/[field].width.bin: int64, per doc row width, 2-d fields only
+    [cache_dir]/docno.txt: key name \t docno, utf-8, one line per doc, as
+        the docno.txt of hashed_binary
+the bin files are memory-mapped at reading, a doc is a slice of each of them,
+so reading the cached docs does no json decoding.
+
+only non-empty docs (by DataIO.is_empty_line) are kept.
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+from knowledge4ir.salience.utils.hashed_binary import (
+    docno_line,
+    iter_hashed_info,
+    load_docno_lines,
+    is_hashed_binary,
+    SCHEMA_NAME,
+)
+
+CACHE_VERSION = 2
+
+# field -> (dtype, dim of one doc's data)
+h_field_schema = {
+    'mtx_e': ('int64', 1),
+    'mtx_score': ('float32', 1),
+    'label': ('float32', 1),
+    'ts_feature': ('float32', 2),
+    'mtx_w': ('int64', 1),
+    'mtx_w_score': ('float32', 1),
+}
+
+
+class BinaryCorpus(object):
+    """
+    read docs from a binary cache built by BinaryCorpus.build()
+    get_doc(p) returns the same per doc dict as DataIO.parse_doc(),
+    with the doc's key (docno or qid) in it, which DataIO.parse_data() takes
+    in place of a raw line
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.h_meta = self.load_meta(cache_dir)
+        self.nb_doc = self.h_meta['nb_doc']
+        self.l_field = self.h_meta['fields']
+        self.h_data = {}
+        self.h_offset = {}
+        self.h_width = {}
+        for field in self.l_field:
+            dtype, dim = h_field_schema[field]
+            self.h_offset[field] = self._mmap(field + '.offset.bin', 'int64')
+            self.h_data[field] = self._mmap(field + '.bin', dtype)
+            if dim == 2:
+                self.h_width[field] = self._mmap(field + '.width.bin', 'int64')
+        self.l_key_docno = load_docno_lines(
+            os.path.join(cache_dir, 'docno.txt'))
+        assert len(self.l_key_docno) == self.nb_doc
+        logging.info('binary cache [%s] loaded, [%d] docs, fields %s',
+                     cache_dir, self.nb_doc, json.dumps(self.l_field))
+
+    def __len__(self):
+        return self.nb_doc
+
+    def _mmap(self, name, dtype):
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.getsize(path):
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def get_doc(self, p):
+        h_doc = {}
+        for field in self.l_field:
+            st, ed = self.h_offset[field][p], self.h_offset[field][p + 1]
+            data = self.h_data[field][st:ed]
+            if field in self.h_width:
+                width = self.h_width[field][p]
+                if width:
+                    data = data.reshape(-1, width)
+                    h_doc[field] = data.tolist()
+                else:
+                    # rows with no feature, keep one empty row per entity
+                    nb_row = self.h_offset['mtx_e'][p + 1] - \
+                             self.h_offset['mtx_e'][p]
+                    h_doc[field] = [[] for __ in xrange(nb_row)]
+            else:
+                h_doc[field] = data.tolist()
+        key_name, docno = self.l_key_docno[p]
+        h_doc[key_name] = docno
+        return h_doc
+
+    def doc_len(self, field='mtx_e'):
+        """
+        the nb of elements of field in each doc
+        :return: np array of nb_doc
+        """
+        return np.diff(np.asarray(self.h_offset[field]))
+
+    def doc_size(self):
+        """
+        same as DataIO.doc_size() of each doc
+        :return: list of (nb of entities, nb of words)
+        """
+        l_nb_e = self.doc_len('mtx_e').tolist()
+        if 'mtx_w' in self.l_field:
+            l_nb_w = self.doc_len('mtx_w').tolist()
+        else:
+            l_nb_w = [0] * self.nb_doc
+        return zip(l_nb_e, l_nb_w)
+
+    @classmethod
+    def io_signature(cls, io_parser):
+        """
+        the io configs the cached docs depend on
+        """
+        return {
+            'targets': sorted([field for field in io_parser.l_target_data
+                               if field in h_field_schema]),
+            'spot_field': io_parser.spot_field,
+            'content_field': io_parser.content_field,
+            'salience_label_field': io_parser.salience_label_field,
+            'salience_field': io_parser.salience_field,
+            'max_e_per_d': io_parser.max_e_per_d,
+            'max_w_per_d': io_parser.max_w_per_d,
+            'e_feature_dim': io_parser.e_feature_dim,
+            'entity_id_map_in': io_parser.entity_id_map_in,
+        }
+
+    @classmethod
+    def source_signature(cls, in_name):
+        """
+        path, size and mtime of the hashed corpus, a binary layout by its
+        schema.json, which is written last
+        """
+        stat_name = in_name
+        if is_hashed_binary(in_name):
+            stat_name = os.path.join(in_name, SCHEMA_NAME)
+        stat = os.stat(stat_name)
+        return {
+            'path': os.path.abspath(in_name),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+        }
+
+    @classmethod
+    def load_meta(cls, cache_dir):
+        return json.load(open(os.path.join(cache_dir, 'meta.json')))
+
+    @classmethod
+    def is_valid(cls, cache_dir, io_parser, in_name):
+        if not os.path.exists(os.path.join(cache_dir, 'meta.json')):
+            return False
+        h_meta = cls.load_meta(cache_dir)
+        if h_meta.get('version') != CACHE_VERSION:
+            logging.info('binary cache [%s] version out of date', cache_dir)
+            return False
+        if h_meta.get('io') != cls.io_signature(io_parser):
+            logging.info('binary cache [%s] built with different io config',
+                         cache_dir)
+            return False
+        if h_meta.get('source') != cls.source_signature(in_name):
+            logging.info('binary cache [%s] built from a different version of'
+                         ' [%s]', cache_dir, in_name)
+            return False
+        return True
+
+    @classmethod
+    def build(cls, in_name, cache_dir, io_parser):
+        """
+        parse the hashed docs in in_name with io_parser, and dump to cache_dir
+        streamed doc by doc, memory does not grow with the corpus
+        :param in_name: hashed corpus, json lines or a hashed binary layout
+        :param cache_dir: output dir
+        :param io_parser: a DataIO with its target group configured
+        :return:
+        """
+        h_signature = cls.io_signature(io_parser)
+        # taken before reading, a corpus rewritten meanwhile is not valid
+        h_source = cls.source_signature(in_name)
+        l_field = h_signature['targets']
+        logging.info('building binary cache [%s] from [%s], fields %s',
+                     cache_dir, in_name, json.dumps(l_field))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        meta_name = os.path.join(cache_dir, 'meta.json')
+        if os.path.exists(meta_name):
+            os.remove(meta_name)
+
+        h_out = {}
+        h_offset_out = {}
+        h_width_out = {}
+        h_offset = dict([(field, 0) for field in l_field])
+        for field in l_field:
+            h_out[field] = open(os.path.join(cache_dir, field + '.bin'), 'wb')
+            h_offset_out[field] = open(
+                os.path.join(cache_dir, field + '.offset.bin'), 'wb')
+            np.zeros(1, dtype='int64').tofile(h_offset_out[field])
+            if h_field_schema[field][1] == 2:
+                h_width_out[field] = open(
+                    os.path.join(cache_dir, field + '.width.bin'), 'wb')
+        docno_out = open(os.path.join(cache_dir, 'docno.txt'), 'w')
+
+        nb_doc = 0
+        for p, h_info in enumerate(iter_hashed_info(in_name)):
+            if not p % 10000:
+                logging.info('cached [%d] lines', p)
+            if io_parser.is_empty_info(h_info):
+                continue
+            h_doc = io_parser.parse_doc(h_info)
+            for field in l_field:
+                dtype, dim = h_field_schema[field]
+                data = h_doc[field]
+                if dim == 2:
+                    width = max([len(row) for row in data] + [0])
+                    data = [row + [0] * (width - len(row)) for row in data]
+                    np.array([width], dtype='int64').tofile(h_width_out[field])
+                v = np.array(data, dtype=dtype).reshape(-1)
+                v.tofile(h_out[field])
+                h_offset[field] += v.shape[0]
+                np.array([h_offset[field]], dtype='int64').tofile(
+                    h_offset_out[field])
+            key_name = 'docno' if 'docno' in h_info else 'qid'
+            print >> docno_out, docno_line(key_name, h_info[key_name])
+            nb_doc += 1
+
+        for out in h_out.values() + h_offset_out.values() + h_width_out.values():
+            out.close()
+        docno_out.close()
+        h_meta = {
+            'version': CACHE_VERSION,
+            'nb_doc': nb_doc,
+            'fields': l_field,
+            'io': h_signature,
+            'source': h_source,
+        }
+        json.dump(h_meta, open(meta_name, 'w'), indent=1)
+        logging.info('binary cache [%s] built with [%d] docs', cache_dir, nb_doc)
+        return
@@ -23,8 +23,8 @@ from traitlets import (
     Unicode,
     List,
 )
-
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
+from knowledge4ir.salience.utils.hashed_binary import HashedDoc
 
 
 class DataIO(Configurable):
@@ -49,9 +49,18 @@ class DataIO(Configurable):
     entity_vocab_size = Int(help='vocabulary size of entity').tag(config=True)
     e_feature_dim = Int(help='entity feature dimension').tag(config=True)
     evm_feature_dim = Int(help='event feature dimension').tag(config=True)
+    entity_id_map_in = Unicode(
+        help='npy of the entity ids kept by prune_ext_data, entity i in the'
+             ' docs is read as its position in it, entities not kept are'
+             ' dropped from the docs').tag(config=True)
 
     def __init__(self, **kwargs):
         super(DataIO, self).__init__(**kwargs)
+        self.h_e_id_map = None
+        self.l_kept_e_id = None
+        self.nb_unseen_e = 0
+        if self.entity_id_map_in:
+            self._load_entity_id_map()
 
         self.h_target_group = {
             'raw': ['mtx_e', 'mtx_score', 'label'],
@@ -78,30 +87,127 @@ class DataIO(Configurable):
     def _data_config(self):
         pass
 
+    def _load_entity_id_map(self):
+        logging.info('loading entity id map [%s]', self.entity_id_map_in)
+        self.l_kept_e_id = np.load(self.entity_id_map_in).tolist()
+        self.h_e_id_map = dict(zip(self.l_kept_e_id,
+                                   range(len(self.l_kept_e_id))))
+        logging.info('[%d] entity ids kept', len(self.l_kept_e_id))
+
+    def map_entity_ids(self, h_this_data):
+        """
+        map a parsed doc's entity ids, dropping the entities not in the map,
+        whose predictions would otherwise be written back as entity 0
+        """
+        if self.h_e_id_map is None:
+            return h_this_data
+        l_e = h_this_data['mtx_e']
+        l_keep = [p for p, e in enumerate(l_e) if e in self.h_e_id_map]
+        if len(l_keep) < len(l_e):
+            if not self.nb_unseen_e:
+                logging.warn('entities not in [%s] are dropped from the docs',
+                             self.entity_id_map_in)
+            self.nb_unseen_e += len(l_e) - len(l_keep)
+            logging.debug('[%d] entities not in the id map dropped, [%d] in'
+                          ' total', len(l_e) - len(l_keep), self.nb_unseen_e)
+            nb_e = len(l_e)
+            for key, value in h_this_data.items():
+                if len(value) == nb_e:
+                    h_this_data[key] = [value[p] for p in l_keep]
+            if not l_keep:
+                # the dummy entity of an empty doc, as _parse_entity
+                h_this_data.update({
+                    'mtx_e': [0],
+                    'mtx_score': [0],
+                    'ts_feature': [[0] * self.e_feature_dim],
+                    'label': [0],
+                })
+        h_this_data['mtx_e'] = [self.h_e_id_map[e] for e in
+                                h_this_data['mtx_e']]
+        return h_this_data
+
+    def original_entity_ids(self, l_e):
+        """
+        the ids in the docs of the (mapped) entity ids the models see
+        """
+        if self.l_kept_e_id is None:
+            return l_e
+        return [self.l_kept_e_id[e] for e in l_e]
+
     def config_target_group(self):
         logging.info('io configing via group [%s]', self.group_name)
         self.l_target_data = self.h_target_group[self.group_name]
         print self.h_target_group[self.group_name]
         logging.info('io targets %s', json.dumps(self.l_target_data))
 
+    @classmethod
+    def load_info(cls, line):
+        """
+        a hashed doc from its json line, or as it is if read from the binary
+        layout (HashedDoc)
+        """
+        if isinstance(line, HashedDoc):
+            return line
+        return json.loads(line)
+
     def is_empty_line(self, line):
-        h = json.loads(line)
-        l_e = h[self.spot_field].get(self.content_field)
+        return self.is_empty_info(self.load_info(line))
+
+    def is_empty_info(self, h_info):
+        l_e = h_info[self.spot_field].get(self.content_field)
         if type(l_e) == dict:
             l_e = l_e.get('entities')
         return not l_e
 
+    def doc_size(self, h_info):
+        """
+        the size of the doc after parse_doc, without parsing it
+        used to batch docs of similar sizes together
+        :param h_info: a loaded hashed doc
+        :return: (nb of entities, nb of words), words are 0 if not targeted
+        """
+        entity_spots = h_info.get(self.spot_field, {}).get(self.content_field,
+                                                           {})
+        if type(entity_spots) is list:
+            nb_e = len(set(entity_spots))
+        else:
+            nb_e = len(entity_spots.get('entities', []))
+        nb_w = 0
+        if 'mtx_w' in self.l_target_data:
+            nb_w = min(len(set(h_info.get(self.content_field, []))),
+                       self.max_w_per_d)
+        # _parse_entity adds a dummy entity to empty docs
+        return max(min(nb_e, self.max_e_per_d), 1), nb_w
+
+    def parse_doc(self, h_info):
+        """
+        parse one doc's target data, before padding
+        :param h_info: a loaded hashed doc
+        :return: h_this_data, the doc's lists of each target
+        """
+        h_this_data = self._parse_entity(h_info)
+        h_this_data = self.map_entity_ids(h_this_data)
+        if 'mtx_w' in self.l_target_data:
+            h_this_data.update(self._parse_word(h_info))
+        return h_this_data
+
     def parse_data(self, l_line):
+        """
+        :param l_line: hashed doc lines or HashedDocs, or docs already parsed
+            by parse_doc (e.g. those read from a binary cache)
+        :return: h_parsed_data, label
+        """
         l_data = []
         while len(l_data) < len(self.l_target_data):
             l_data.append([])
         h_parsed_data = dict(zip(self.l_target_data, l_data))
         for line in l_line:
-            h_info = json.loads(line)
-            h_this_data = self._parse_entity(h_info)
-
-            if 'mtx_w' in h_parsed_data:
-                h_this_data.update(self._parse_word(h_info))
+            if isinstance(line, HashedDoc):
+                h_this_data = self.parse_doc(line)
+            elif type(line) is dict:
+                h_this_data = line
+            else:
+                h_this_data = self.parse_doc(json.loads(line))
 
             for key in h_parsed_data.keys():
                 assert key in h_this_data
@@ -137,7 +243,7 @@ class DataIO(Configurable):
                 'convert to variable with data_type [%s] not implemented',
                 data_type)
             raise NotImplementedError
-        if use_cuda:
+        if use_cuda():
             v = v.cuda()
         return v
 
@@ -324,11 +430,11 @@ def raw_io(l_line, num_features, spot_field=SPOT_FIELD,
     ll_w = padding(ll_w, 0)
     ll_label = padding(ll_label, 0)
     m_e = Variable(torch.LongTensor(ll_e)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_e))
+        if use_cuda() else Variable(torch.LongTensor(ll_e))
     m_w = Variable(torch.FloatTensor(ll_w)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_w))
+        if use_cuda() else Variable(torch.FloatTensor(ll_w))
     m_label = Variable(torch.FloatTensor(ll_label)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_label))
+        if use_cuda() else Variable(torch.FloatTensor(ll_label))
 
     h_packed_data = {
         "mtx_e": m_e,
@@ -416,11 +522,11 @@ def feature_io(l_line, num_features, spot_field=SPOT_FIELD, in_field=body_field,
         lll_feature = padding(lll_feature, 0)
 
     m_e = Variable(torch.LongTensor(ll_e)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_e))
+        if use_cuda() else Variable(torch.LongTensor(ll_e))
     m_label = Variable(torch.FloatTensor(ll_label)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_label))
+        if use_cuda() else Variable(torch.FloatTensor(ll_label))
     ts_feature = Variable(torch.FloatTensor(lll_feature)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(lll_feature))
+        if use_cuda() else Variable(torch.FloatTensor(lll_feature))
 
     if num_features:
         h_packed_data = {
@@ -486,11 +592,11 @@ def uw_io(l_line, spot_field=SPOT_FIELD,
     lll_sent = padding(lll_sent, l_empty_e_sent)
 
     m_e = Variable(torch.LongTensor(ll_e)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_e))
+        if use_cuda() else Variable(torch.LongTensor(ll_e))
     m_label = Variable(torch.FloatTensor(ll_label)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_label))
+        if use_cuda() else Variable(torch.FloatTensor(ll_label))
     ts_local_context = Variable(torch.LongTensor(lll_sent)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(lll_sent))
+        if use_cuda() else Variable(torch.LongTensor(lll_sent))
     h_packed_data = {
         "mtx_e": m_e,
         "ts_local_context": ts_local_context
@@ -554,15 +660,15 @@ def duet_io(l_line, spot_field=SPOT_FIELD,
     ll_words = padding(ll_words, 0)
     ll_word_score = padding(ll_word_score, 0)
     m_e = Variable(torch.LongTensor(ll_e)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_e))
+        if use_cuda() else Variable(torch.LongTensor(ll_e))
     m_w = Variable(torch.FloatTensor(ll_score)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_score))
+        if use_cuda() else Variable(torch.FloatTensor(ll_score))
     m_label = Variable(torch.FloatTensor(ll_label)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_label))
+        if use_cuda() else Variable(torch.FloatTensor(ll_label))
     m_word = Variable(torch.LongTensor(ll_words)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_words))
+        if use_cuda() else Variable(torch.LongTensor(ll_words))
     m_word_score = Variable(torch.FloatTensor(ll_word_score)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_word_score))
+        if use_cuda() else Variable(torch.FloatTensor(ll_word_score))
     h_packed_data = {
         "mtx_e": m_e,
         "mtx_score": m_w,
@@ -601,14 +707,14 @@ def adj_edge_io(
     ll_label = padding(ll_label, 0)
     lll_e_distance = three_d_padding(lll_e_distance, -1)
     m_e = Variable(torch.LongTensor(ll_e)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(ll_e))
+        if use_cuda() else Variable(torch.LongTensor(ll_e))
     m_w = Variable(torch.FloatTensor(ll_w)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_w))
+        if use_cuda() else Variable(torch.FloatTensor(ll_w))
     m_label = Variable(torch.FloatTensor(ll_label)).cuda() \
-        if use_cuda else Variable(torch.FloatTensor(ll_label))
+        if use_cuda() else Variable(torch.FloatTensor(ll_label))
     ts_e_distance = Variable(
         torch.LongTensor(lll_e_distance)).cuda() \
-        if use_cuda else Variable(torch.LongTensor(lll_e_distance))
+        if use_cuda() else Variable(torch.LongTensor(lll_e_distance))
     h_packed_data = {
         "mtx_e": m_e,
         "mtx_score": m_w,
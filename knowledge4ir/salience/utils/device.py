@@ -0,0 +1,58 @@
+"""
+the device the salience models and data io run on
+
+models and io check use_cuda() when they create tensors or sub modules,
+instead of each module probing torch.cuda.is_available() at import time.
+The device is set once by set_device(), via the device config of
+SalienceModelCenter, before any model or io is constructed.
+    auto: cuda if available, else cpu
+    cpu: always cpu, even if a GPU is visible
+    cuda: always cuda, fails if not available
+"""
+
+import logging
+
+import torch
+
+_h_device = {
+    'use_cuda': torch.cuda.is_available()
+}
+
+
+def set_device(device='auto'):
+    if device == 'auto':
+        _h_device['use_cuda'] = torch.cuda.is_available()
+    elif device == 'cpu':
+        _h_device['use_cuda'] = False
+    elif device == 'cuda':
+        if not torch.cuda.is_available():
+            logging.error('device [cuda] requested but cuda is not available')
+            raise ValueError
+        _h_device['use_cuda'] = True
+    else:
+        logging.error('device [%s] not in auto | cpu | cuda', device)
+        raise NotImplementedError
+    logging.info('salience models run on [%s]',
+                 'cuda' if _h_device['use_cuda'] else 'cpu')
+
+
+def use_cuda():
+    return _h_device['use_cuda']
+
+
+def to_device(data):
+    """
+    move a tensor, Variable, or nn.Module to the current device
+    """
+    if use_cuda():
+        return data.cuda()
+    return data.cpu()
+
+
+def map_location():
+    """
+    map_location for torch.load, so models saved on GPU load on CPU hosts
+    """
+    if use_cuda():
+        return None
+    return lambda storage, loc: storage
@@ -30,6 +30,14 @@ class SalienceEva(Configurable):
             "accuracy": self.accuracy,
             "auc": self.auc,
         }
+        self.h_batch_eva_metric = {
+            "p": self._batch_p_at_k,
+            'r': self._batch_r_at_k,
+            "precision": self._batch_precision,
+            "recall": self._batch_recall,
+            "accuracy": self._batch_accuracy,
+            "auc": self._batch_auc,
+        }
 
     def evaluate(self, l_score, l_label):
         h_eva_res = {}
@@ -113,6 +121,106 @@ class SalienceEva(Configurable):
             auc_score = roc_auc_score(l_label, l_score)
         return {'auc': auc_score}
 
+    def evaluate_batch(self, m_score, m_label, m_mask):
+        """
+        evaluate all docs of a padded batch at once
+        gives the same numbers as evaluate() on each doc's unpadded lists
+        (auc up to float rounding)
+        :param m_score: batch * e per doc, predicted scores
+        :param m_label: batch * e per doc, labels
+        :param m_mask: batch * e per doc, 1 for real entities, 0 for padding
+        :return: a list of h_eva_res, one per doc
+        """
+        m_score = np.asarray(m_score, dtype=np.float64)
+        m_mask = np.asarray(m_mask) > 0
+        m_label = np.where(m_mask, np.asarray(m_label), 0)
+        l_h_eva_res = [{} for __ in xrange(m_score.shape[0])]
+        for metric in self.l_metrics:
+            for h_eva_res, h_res in zip(
+                    l_h_eva_res,
+                    self.h_batch_eva_metric[metric](m_score, m_label, m_mask)):
+                h_eva_res.update(h_res)
+        return l_h_eva_res
+
+    def _batch_correct_at_depth(self, m_score, m_label, m_mask):
+        """
+        number of positive labels in the top 1 to max depth of each doc
+        padding is ranked after all real entities, ties keep their order,
+        the same as the stable sort in p_at_k
+        :return: batch * max depth
+        """
+        max_depth = max(self.l_depth)
+        m_key = np.where(m_mask, -m_score, np.inf)
+        m_rank = np.argsort(m_key, axis=1, kind='mergesort')[:, :max_depth]
+        m_hit = m_label[np.arange(m_label.shape[0])[:, None], m_rank] > 0
+        m_correct = np.zeros((m_label.shape[0], max_depth), dtype=np.int64)
+        m_correct[:, :m_hit.shape[1]] = np.cumsum(m_hit, axis=1)
+        if m_hit.shape[1] < max_depth:
+            # no more entities, deeper positions are all label 0
+            m_correct[:, m_hit.shape[1]:] = m_correct[:, m_hit.shape[1] - 1:
+                                                         m_hit.shape[1]]
+        return m_correct
+
+    def _batch_p_at_k(self, m_score, m_label, m_mask):
+        m_correct = self._batch_correct_at_depth(m_score, m_label, m_mask)
+        l_depth = sorted(set(self.l_depth))
+        return [dict([('p@%02d' % depth, float(v_correct[depth - 1]) / depth)
+                      for depth in l_depth])
+                for v_correct in m_correct]
+
+    def _batch_r_at_k(self, m_score, m_label, m_mask):
+        m_correct = self._batch_correct_at_depth(m_score, m_label, m_mask)
+        v_z = np.maximum(1, np.clip(m_label, 0, 1).sum(axis=1))
+        l_depth = sorted(set(self.l_depth))
+        return [dict([('r@%02d' % depth, float(v_correct[depth - 1]) / int(z))
+                      for depth in l_depth])
+                for v_correct, z in zip(m_correct, v_z)]
+
+    def _batch_precision(self, m_score, m_label, m_mask):
+        m_predict = (m_score > 0) & m_mask
+        v_z = m_predict.sum(axis=1)
+        v_c = (m_predict & (m_label > 0)).sum(axis=1)
+        return [{'precision': float(c) / max(z, 1.0)}
+                for c, z in zip(v_c, v_z)]
+
+    def _batch_recall(self, m_score, m_label, m_mask):
+        m_pos = m_label > 0
+        v_z = m_pos.sum(axis=1)
+        v_c = (m_pos & (m_score > 0) & m_mask).sum(axis=1)
+        return [{'recall': float(c) / max(z, 1.0)}
+                for c, z in zip(v_c, v_z)]
+
+    def _batch_accuracy(self, m_score, m_label, m_mask):
+        v_c = ((m_label > 0) & (m_score > 0) & m_mask).sum(axis=1)
+        v_z = m_mask.sum(axis=1)
+        return [{'accuracy': float(c) / max(z, 1.0)}
+                for c, z in zip(v_c, v_z)]
+
+    def _batch_auc(self, m_score, m_label, m_mask):
+        """
+        auc as the fraction of (positive, negative) pairs ranked right,
+        ties count half, which is the area roc_auc_score computes
+        """
+        m_pos = (m_label > 0) & m_mask
+        m_neg = (m_label <= 0) & m_mask
+        v_pos = m_pos.sum(axis=1)
+        v_neg = m_neg.sum(axis=1)
+        # batch * positive candidate * negative candidate
+        ts_diff = m_score[:, :, None] - m_score[:, None, :]
+        ts_pair = m_pos[:, :, None] & m_neg[:, None, :]
+        v_right = ((ts_diff > 0) & ts_pair).sum(axis=(1, 2)) + 0.5 * (
+            (ts_diff == 0) & ts_pair).sum(axis=(1, 2))
+        l_res = []
+        for right, pos, neg in zip(v_right, v_pos, v_neg):
+            if not neg:
+                auc_score = 1
+            elif not pos:
+                auc_score = 0
+            else:
+                auc_score = float(right) / (int(pos) * int(neg))
+            l_res.append({'auc': auc_score})
+        return l_res
+
 
 def histo(l, k=10):
     interval = len(l) * 1.0 / k
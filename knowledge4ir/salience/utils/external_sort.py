@@ -0,0 +1,96 @@
+"""
+external sort of json line files by docno
+
+the input is read in chunks of chunk_lines lines, each chunk is sorted in
+memory and written to a tmp file, and the tmp files are merged with a heap.
+memory is bounded by the chunk size, not the file size.
+the sort is stable: docs with the same key keep their input order.
+empty lines are dropped.
+
+usage:
+    python -m knowledge4ir.salience.utils.external_sort in_name out_name [chunk_lines]
+"""
+
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+def doc_key(h_info):
+    """
+    docno, or qid if no docno, the same key AlignPredicted uses
+    """
+    key = h_info.get('docno')
+    if not key:
+        key = h_info.get('qid')
+    return key
+
+
+def _read_chunk_file(chunk_name):
+    for line in open(chunk_name):
+        key, seq, doc_line = line.rstrip('\n').split('\t', 2)
+        yield json.loads(key), int(seq), doc_line
+
+
+def _dump_chunk(l_item, tmp_dir, chunk_no):
+    chunk_name = os.path.join(tmp_dir, 'chunk_%06d' % chunk_no)
+    l_item.sort()
+    with open(chunk_name, 'w') as out:
+        for key, seq, doc_line in l_item:
+            print >> out, '%s\t%d\t%s' % (json.dumps(key), seq, doc_line)
+    return chunk_name
+
+
+def external_sort(in_name, out_name, key_func=doc_key, chunk_lines=100000,
+                  tmp_dir=None):
+    """
+    sort the json lines in in_name by key_func, to out_name
+    :param in_name: json line file
+    :param out_name: sorted output
+    :param key_func: h_info -> sort key
+    :param chunk_lines: lines sorted in memory at a time
+    :param tmp_dir: where to put the sorted chunks, default a system tmp dir
+    """
+    chunk_dir = tempfile.mkdtemp(prefix='external_sort_', dir=tmp_dir)
+    l_chunk_name = []
+    l_item = []
+    seq = 0
+    for line in open(in_name):
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        l_item.append((key_func(json.loads(line)), seq, line))
+        seq += 1
+        if len(l_item) >= chunk_lines:
+            l_chunk_name.append(_dump_chunk(l_item, chunk_dir,
+                                            len(l_chunk_name)))
+            l_item = []
+    if l_item:
+        l_chunk_name.append(_dump_chunk(l_item, chunk_dir, len(l_chunk_name)))
+    logging.info('[%s] [%d] lines sorted in [%d] chunks', in_name, seq,
+                 len(l_chunk_name))
+
+    with open(out_name, 'w') as out:
+        for __, __, doc_line in heapq.merge(
+                *[_read_chunk_file(chunk_name) for chunk_name in l_chunk_name]):
+            print >> out, doc_line
+    shutil.rmtree(chunk_dir)
+    logging.info('sorted [%s] to [%s]', in_name, out_name)
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import set_basic_log
+
+    set_basic_log(logging.INFO)
+    if 3 > len(sys.argv):
+        print "sort json lines by docno (or qid)"
+        print "2+ para: in name + out name + chunk lines (opt)"
+        sys.exit(-1)
+    if 4 <= len(sys.argv):
+        external_sort(sys.argv[1], sys.argv[2], chunk_lines=int(sys.argv[3]))
+    else:
+        external_sort(sys.argv[1], sys.argv[2])
@@ -0,0 +1,300 @@
+"""
+columnar binary layout of hashed corpora (CorpusHasher output)
+
+each list in the hashed docs is a column, named by its path in the doc, e.g.
+bodyText (word ids), spot.bodyText.entities, spot.bodyText.features,
+event.bodyText.sparse_features.LexicalHead, adjacent.
+a column of nested lists of depth d is stored as:
+    [column].values.bin: the scalars of all docs, concatenated
+    [column].offsets_[k].bin: int64, for k = 0..d-1, offsets into the next
+        level, offsets_0 has nb_doc + 1 entries, one range per doc
+    [column].present.bin: uint8, whether each doc has the column
+with in the dir:
+    schema.json: version, nb of docs, dtype and depth of each column
+    docno.txt: key name \t docno (or qid), utf-8, one line per doc, docnos
+        with tabs or newlines are rejected
+the features and salience columns are float64, so the ints stored in them
+come back as equal floats, e.g. 1.0 for 1, the other columns are int64.
+
+HashedBinaryWriter writes docs to the layout, streamed, columns first met in
+later docs are added as absent in the earlier ones.
+HashedBinaryCorpus memory-maps the files, and get_doc(p) builds the doc's
+dict (a HashedDoc) from slices of them, without any json decoding.
+DataIO, EventDataIO and the centers take HashedDoc in place of a doc line.
+"""
+
+import gzip
+import json
+import logging
+import os
+
+import numpy as np
+
+HASHED_BINARY_VERSION = 1
+SCHEMA_NAME = 'schema.json'
+
+
+class HashedDoc(dict):
+    """
+    a hashed doc read from the binary layout, the same dict as the json line
+    """
+    pass
+
+
+def column_spec(l_path):
+    """
+    :param l_path: path of a list in the hashed doc
+    :return: dtype, depth
+    """
+    name = l_path[-1]
+    if l_path[0] == 'adjacent':
+        return 'int64', 2
+    if len(l_path) == 1:
+        # text field, word ids
+        return 'int64', 1
+    if 'sparse_features' in l_path or name == 'entities':
+        return 'int64', 1
+    if name == 'features':
+        return 'float64', 2
+    if name == 'loc':
+        return 'int64', 3
+    # salience
+    return 'float64', 1
+
+
+def is_hashed_binary(in_name):
+    return os.path.isdir(in_name) and os.path.exists(
+        os.path.join(in_name, SCHEMA_NAME))
+
+
+def iter_hashed_info(in_name):
+    """
+    the hashed docs in a json line file (gz or not) or a binary layout dir
+    """
+    if is_hashed_binary(in_name):
+        corpus = HashedBinaryCorpus(in_name)
+        for p in xrange(len(corpus)):
+            yield corpus.get_doc(p)
+        return
+    open_func = gzip.open if in_name.endswith('gz') else open
+    for line in open_func(in_name):
+        yield json.loads(line)
+
+
+def docno_line(key_name, docno):
+    """
+    the docno.txt line of a doc: key name \t docno, utf-8
+    """
+    if isinstance(docno, unicode):
+        docno = docno.encode('utf-8')
+    else:
+        docno = str(docno)
+    if '\t' in docno or '\n' in docno:
+        logging.error('%s [%r] has a tab or newline', key_name, docno)
+        raise ValueError
+    return '%s\t%s' % (key_name, docno)
+
+
+def load_docno_lines(in_name):
+    """
+    :return: [key name, docno] of each docno.txt line, docno in unicode as
+        json loads it
+    """
+    return [line.rstrip('\n').decode('utf-8').split('\t')
+            for line in open(in_name)]
+
+
+def _list_columns(h, l_path, l_column):
+    for key, value in h.items():
+        assert '.' not in key
+        if type(value) is dict:
+            _list_columns(value, l_path + [key], l_column)
+        elif type(value) is list:
+            l_column.append((l_path + [key], value))
+    return l_column
+
+
+class HashedBinaryWriter(object):
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        schema_name = os.path.join(out_dir, SCHEMA_NAME)
+        if os.path.exists(schema_name):
+            os.remove(schema_name)
+        self.h_column = {}
+        self.s_dict_key = set()
+        self.nb_doc = 0
+        self.docno_out = open(os.path.join(out_dir, 'docno.txt'), 'w')
+
+    def _open(self, column, suffix):
+        return open(os.path.join(self.out_dir, column + suffix), 'wb')
+
+    def _add_column(self, column, l_path):
+        dtype, depth = column_spec(l_path)
+        h = {
+            'dtype': dtype,
+            'depth': depth,
+            'values': self._open(column, '.values.bin'),
+            'present': self._open(column, '.present.bin'),
+            'offsets': [self._open(column, '.offsets_%d.bin' % level)
+                        for level in xrange(depth)],
+            'totals': [0] * depth,
+        }
+        for out in h['offsets']:
+            np.zeros(1, dtype='int64').tofile(out)
+        # absent in the docs before
+        np.zeros(self.nb_doc, dtype='uint8').tofile(h['present'])
+        np.zeros(self.nb_doc, dtype='int64').tofile(h['offsets'][0])
+        self.h_column[column] = h
+        return h
+
+    def _add_data(self, column, h, data):
+        l_item = data
+        for level in xrange(h['depth']):
+            if level:
+                l_len = []
+                l_next = []
+                for item in l_item:
+                    if type(item) is not list:
+                        logging.error('column [%s] is not %d deep', column,
+                                      h['depth'])
+                        raise ValueError
+                    l_len.append(len(item))
+                    l_next.extend(item)
+                v_offset = h['totals'][level] + np.cumsum(l_len,
+                                                          dtype='int64')
+                v_offset.tofile(h['offsets'][level])
+                h['totals'][level] += sum(l_len)
+                l_item = l_next
+            else:
+                h['totals'][0] += len(l_item)
+                np.array([h['totals'][0]], dtype='int64').tofile(
+                    h['offsets'][0])
+        np.array(l_item, dtype=h['dtype']).reshape(-1).tofile(h['values'])
+
+    def add(self, h_hashed):
+        h_data = dict([('.'.join(l_path), (l_path, data)) for l_path, data in
+                       _list_columns(h_hashed, [], [])])
+        self.s_dict_key.update([key for key, value in h_hashed.items()
+                                if type(value) is dict])
+        for column, (l_path, __) in h_data.items():
+            if column not in self.h_column:
+                self._add_column(column, l_path)
+        for column, h in self.h_column.items():
+            if column in h_data:
+                np.ones(1, dtype='uint8').tofile(h['present'])
+                self._add_data(column, h, h_data[column][1])
+            else:
+                np.zeros(1, dtype='uint8').tofile(h['present'])
+                np.array([h['totals'][0]], dtype='int64').tofile(
+                    h['offsets'][0])
+        key_name = 'docno' if 'docno' in h_hashed else 'qid'
+        print >> self.docno_out, docno_line(key_name,
+                                            h_hashed.get(key_name, ''))
+        self.nb_doc += 1
+
+    def close(self):
+        for h in self.h_column.values():
+            for out in [h['values'], h['present']] + h['offsets']:
+                out.close()
+        self.docno_out.close()
+        h_schema = {
+            'version': HASHED_BINARY_VERSION,
+            'nb_doc': self.nb_doc,
+            'dict_keys': sorted(self.s_dict_key),
+            'columns': dict([(column, {'dtype': h['dtype'],
+                                       'depth': h['depth']})
+                             for column, h in self.h_column.items()]),
+        }
+        json.dump(h_schema, open(os.path.join(self.out_dir, SCHEMA_NAME), 'w'),
+                  indent=1)
+        logging.info('[%d] hashed docs written to [%s], [%d] columns',
+                     self.nb_doc, self.out_dir, len(self.h_column))
+
+
+class HashedBinaryCorpus(object):
+    """
+    random access to the docs of a binary layout
+    with io_parser, only the non-empty docs (by io_parser.is_empty_info) are
+    kept, and doc_size() gives their io_parser.doc_size(), as LineCorpus
+    """
+
+    def __init__(self, in_dir, io_parser=None):
+        self.in_dir = in_dir
+        h_schema = json.load(open(os.path.join(in_dir, SCHEMA_NAME)))
+        if h_schema.get('version') != HASHED_BINARY_VERSION:
+            logging.error('hashed binary [%s] version [%s] is not [%d]',
+                          in_dir, h_schema.get('version'),
+                          HASHED_BINARY_VERSION)
+            raise ValueError
+        self.nb_doc = h_schema['nb_doc']
+        self.l_dict_key = h_schema['dict_keys']
+        self.h_column = {}
+        for column, h_spec in h_schema['columns'].items():
+            self.h_column[column] = {
+                'path': column.split('.'),
+                'depth': h_spec['depth'],
+                'values': self._mmap(column + '.values.bin', h_spec['dtype']),
+                'present': self._mmap(column + '.present.bin', 'uint8'),
+                'offsets': [self._mmap(column + '.offsets_%d.bin' % level,
+                                       'int64')
+                            for level in xrange(h_spec['depth'])],
+            }
+        self.l_key_docno = load_docno_lines(os.path.join(in_dir, 'docno.txt'))
+        assert len(self.l_key_docno) == self.nb_doc
+
+        self.l_p = range(self.nb_doc)
+        self.l_size = None
+        if io_parser is not None:
+            self.l_p = []
+            self.l_size = []
+            for p in xrange(self.nb_doc):
+                h_info = self._decode(p)
+                if not io_parser.is_empty_info(h_info):
+                    self.l_p.append(p)
+                    self.l_size.append(io_parser.doc_size(h_info))
+        logging.info('hashed binary [%s] loaded, [%d] docs, [%d] columns',
+                     in_dir, len(self.l_p), len(self.h_column))
+
+    def __len__(self):
+        return len(self.l_p)
+
+    def _mmap(self, name, dtype):
+        path = os.path.join(self.in_dir, name)
+        if not os.path.getsize(path):
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def _slice(self, h, level, st, ed):
+        if level == h['depth']:
+            return h['values'][st:ed].tolist()
+        v_offset = h['offsets'][level][st:ed + 1]
+        return [self._slice(h, level + 1, v_offset[i], v_offset[i + 1])
+                for i in xrange(ed - st)]
+
+    def _decode(self, p):
+        h_info = HashedDoc()
+        for key in self.l_dict_key:
+            h_info[key] = {}
+        for h in self.h_column.values():
+            if not h['present'][p]:
+                continue
+            node = h_info
+            for key in h['path'][:-1]:
+                node = node.setdefault(key, {})
+            node[h['path'][-1]] = self._slice(h, 1, h['offsets'][0][p],
+                                              h['offsets'][0][p + 1])
+        for h_field in h_info.get('event', {}).values():
+            h_field.setdefault('sparse_features', {})
+        key_name, docno = self.l_key_docno[p]
+        if docno:
+            h_info[key_name] = docno
+        return h_info
+
+    def get_doc(self, p):
+        return self._decode(self.l_p[p])
+
+    def doc_size(self):
+        return self.l_size
@@ -25,8 +25,9 @@ from traitlets import (
     Bool
 )
 import math
-
-use_cuda = torch.cuda.is_available()
+import itertools
+from scipy.sparse import coo_matrix
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 class EventDataIO(DataIO):
@@ -38,9 +39,17 @@ class EventDataIO(DataIO):
                               default_value=[],
                               help='List of features to include'
                               ).tag(config=True)
+    sparse_adjacent_nodes = Int(
+        0, help='use a sparse block-diagonal ts_adjacent for batches whose'
+                ' graphs have at least this many nodes, 0 to always use dense'
+    ).tag(config=True)
 
     def __init__(self, **kwargs):
         super(EventDataIO, self).__init__(**kwargs)
+        if self.entity_id_map_in:
+            # the joint parsing does not map the entity ids of the docs
+            logging.error('entity_id_map_in is not supported by EventDataIO')
+            raise NotImplementedError
         if self.event_labels_only:
             logging.info("Will only train on event labels.")
 
@@ -96,25 +105,45 @@ class EventDataIO(DataIO):
             'joint_graph_detail': ['ts_args', 'mtx_e', 'mtx_evm'],
         }
 
-        # Natural NP data. Different padding; Different conversion.
+        # Natural NP data (scipy coo matrices per doc).
+        # Different padding; Different conversion.
         self.h_np_data = {
             'ts_adjacent': {'dim': 2},
         }
 
-    def is_empty_line(self, line):
+        self.h_np_type = {
+            'Int': np.int64,
+            'Float': np.float32,
+        }
+
+    def is_empty_info(self, h_info):
         if self.group_name.startswith('event'):
-            h = json.loads(line)
-            l_s = h[self.event_spot_field].get(self.content_field, {}).get(
+            l_s = h_info[self.event_spot_field].get(self.content_field, {}).get(
                 'salience')
             return not l_s
         if self.group_name.startswith('joint'):
-            h = json.loads(line)
-            l_s = h[self.event_spot_field].get(self.content_field, {}).get(
+            l_s = h_info[self.event_spot_field].get(self.content_field, {}).get(
                 'salience')
-            empty_entity = super(EventDataIO, self).is_empty_line(line)
+            empty_entity = super(EventDataIO, self).is_empty_info(h_info)
             return (not l_s) and empty_entity
         else:
-            return super(EventDataIO, self).is_empty_line(line)
+            return super(EventDataIO, self).is_empty_info(h_info)
+
+    def doc_size(self, h_info):
+        """
+        joint groups put the events after the entities in mtx_e
+        :return: (nb of nodes, nb of events)
+        """
+        event_spots = h_info.get(self.event_spot_field, {}).get(
+            self.content_field, {})
+        # _parse_event adds a dummy event to docs without events
+        nb_evm = max(min(
+            len(event_spots.get('sparse_features', {}).get('LexicalHead', [])),
+            self.max_e_per_d), 1)
+        if self.group_name.startswith('event'):
+            return nb_evm, nb_evm
+        nb_e = super(EventDataIO, self).doc_size(h_info)[0]
+        return nb_e + nb_evm, nb_evm
 
     def parse_data(self, l_line):
         l_data = []
@@ -124,7 +153,7 @@ class EventDataIO(DataIO):
         h_parsed_data = dict(zip(self.l_target_data, l_data))
 
         for line in l_line:
-            h_info = json.loads(line)
+            h_info = self.load_info(line)
             if self.group_name.startswith('event'):
                 h_this_data, _ = self._parse_event(h_info)
             elif self.group_name.startswith('joint'):
@@ -170,14 +199,30 @@ class EventDataIO(DataIO):
         return h_parsed_data, h_parsed_data['label']
 
     def _canonicalize_data(self, h_parsed_data):
+        """
+        pad each field into one preallocated array, compute the masks from the
+        padded arrays, and convert them to variables.
+        gives the same tensors as padding the lists with two_d_padding,
+        three_d_padding, two_d_np_padding and masking with _2d_pad_mask and
+        _3d_pad_mask, without the python loops over the elements
+        """
         for key in h_parsed_data:
             if key in self.h_np_data:
-                dim = self.h_np_data[key]['dim']
-                padded = self._pad_np(h_parsed_data[key], dim)
+                l_mtx = h_parsed_data[key]
+                if self.sparse_adjacent_nodes and max(
+                        [mtx.shape[0] for mtx in l_mtx]
+                ) >= self.sparse_adjacent_nodes:
+                    padded = self.block_diagonal_sparse(l_mtx)
+                else:
+                    padded = self.coo_array_padding(l_mtx, np.float32)
             else:
                 dim = self.h_data_meta[key]['dim']
-                padded = self._padding(h_parsed_data[key], dim)
-
+                if self._is_empty(h_parsed_data[key], dim):
+                    padded = None
+                else:
+                    padded = self.array_padding(
+                        h_parsed_data[key], dim,
+                        self.h_np_type[self.h_data_meta[key]['d_type']])
             h_parsed_data[key] = padded
 
         # Compute masks from the padded value.
@@ -185,37 +230,118 @@ class EventDataIO(DataIO):
 
         for key in self.h_data_mask.get(self.group_name, []):
             data = h_parsed_data[key]
-            if not self._is_empty(data, self.h_data_meta[key]['dim']):
-                mask = self._pad_mask(data, key)
-                mask_data[key] = self._data_to_variable(mask, data_type='Float')
+            if data is not None:
+                mask_data[key] = self._array_to_variable(
+                    (data != 0).astype(np.float32))
             else:
                 # Empty data will have empty mask.
                 mask_data[key] = None
 
         for key in h_parsed_data:
-            if key in self.h_np_data:
-                h_parsed_data[key] = self._np_data_to_variable(
-                    h_parsed_data[key]
-                )
-            else:
-                dim = self.h_data_meta[key]['dim']
-                data = h_parsed_data[key]
-
-                if not self._is_empty(data, dim):
-                    h_parsed_data[key] = self._data_to_variable(
-                        h_parsed_data[key],
-                        data_type=self.h_data_meta[key]['d_type']
-                    )
-                else:
-                    h_parsed_data[key] = None
+            if h_parsed_data[key] is None:
+                continue
+            h_parsed_data[key] = self._array_to_variable(h_parsed_data[key])
 
         h_parsed_data['masks'] = mask_data
 
         return h_parsed_data
 
+    def _array_to_variable(self, array):
+        if isinstance(array, np.ndarray):
+            array = torch.from_numpy(array)
+        v = Variable(array)
+        if use_cuda():
+            v = v.cuda()
+        return v
+
+    @classmethod
+    def array_padding(cls, data, dim, dtype, default_value=0):
+        if dim == 2:
+            return cls.two_d_array_padding(data, dtype, default_value)
+        if dim == 3:
+            return cls.three_d_array_padding(data, dtype, default_value)
+        raise NotImplementedError
+
+    @classmethod
+    def two_d_array_padding(cls, ll, dtype, default_value=0):
+        """
+        pad a list of lists into a [len(ll), max len] array
+        the values are scattered to (row, offset in row) in one assignment
+        """
+        l_len = np.array([len(l) for l in ll], dtype=np.int64)
+        padded = np.full((len(ll), l_len.max() if len(ll) else 0),
+                         default_value, dtype=dtype)
+        l_flat = list(itertools.chain.from_iterable(ll))
+        if l_flat:
+            l_st = np.cumsum(l_len) - l_len
+            v_row = np.repeat(np.arange(len(ll)), l_len)
+            v_col = np.arange(len(l_flat)) - np.repeat(l_st, l_len)
+            padded[v_row, v_col] = l_flat
+        return padded
+
+    @classmethod
+    def three_d_array_padding(cls, lll, dtype, default_value=0):
+        """
+        pad a list of lists of lists into a
+        [len(lll), max nb of rows, max row len] array
+        """
+        l_nb_row = np.array([len(ll) for ll in lll], dtype=np.int64)
+        l_row = list(itertools.chain.from_iterable(lll))
+        l_len = np.array([len(l) for l in l_row], dtype=np.int64)
+        padded = np.full(
+            (len(lll), l_nb_row.max() if len(lll) else 0,
+             l_len.max() if len(l_row) else 0),
+            default_value, dtype=dtype)
+        l_flat = list(itertools.chain.from_iterable(l_row))
+        if l_flat:
+            l_row_st = np.cumsum(l_nb_row) - l_nb_row
+            v_row_doc = np.repeat(np.arange(len(lll)), l_nb_row)
+            v_row_p = np.arange(len(l_row)) - np.repeat(l_row_st, l_nb_row)
+            l_st = np.cumsum(l_len) - l_len
+            v_doc = np.repeat(v_row_doc, l_len)
+            v_row = np.repeat(v_row_p, l_len)
+            v_col = np.arange(len(l_flat)) - np.repeat(l_st, l_len)
+            padded[v_doc, v_row, v_col] = l_flat
+        return padded
+
+    @classmethod
+    def coo_array_padding(cls, l_mtx, dtype):
+        """
+        pad a list of scipy coo matrices into one dense
+        [len, max row, max col] array, zero padded
+        """
+        max_row = max([mtx.shape[0] for mtx in l_mtx])
+        max_col = max([mtx.shape[1] for mtx in l_mtx])
+        padded = np.zeros((len(l_mtx), max_row, max_col), dtype=dtype)
+        v_doc = np.repeat(np.arange(len(l_mtx)), [mtx.nnz for mtx in l_mtx])
+        padded[v_doc,
+               np.concatenate([mtx.row for mtx in l_mtx]),
+               np.concatenate([mtx.col for mtx in l_mtx])] = np.concatenate(
+            [mtx.data for mtx in l_mtx])
+        return padded
+
+    @classmethod
+    def block_diagonal_sparse(cls, l_mtx):
+        """
+        a list of square scipy coo matrices as one sparse block-diagonal
+        [len * n, len * n] FloatTensor, n is the max size. It multiplies the
+        [len * n, d] view of a batch's [len, n, d] node features.
+        """
+        n = max([mtx.shape[0] for mtx in l_mtx])
+        v_offset = np.repeat(np.arange(len(l_mtx)) * n,
+                             [mtx.nnz for mtx in l_mtx])
+        indices = np.stack(
+            [np.concatenate([mtx.row for mtx in l_mtx]) + v_offset,
+             np.concatenate([mtx.col for mtx in l_mtx]) + v_offset]
+        ).astype(np.int64)
+        values = np.concatenate([mtx.data for mtx in l_mtx]).astype(np.float32)
+        return torch.sparse.FloatTensor(
+            torch.from_numpy(indices), torch.from_numpy(values),
+            torch.Size([len(l_mtx) * n, len(l_mtx) * n]))
+
     def _np_data_to_variable(self, list_data):
         v = Variable(torch.from_numpy(np.stack(list_data)).float())
-        if use_cuda:
+        if use_cuda():
             v = v.cuda()
         return v
 
@@ -350,46 +476,50 @@ class EventDataIO(DataIO):
         return h_res
 
     def _compute_adjacent(self, ll_args, l_e):
+        """
+        the event -> argument entity links
+        :return: rows (events, after the entities) and cols (entities),
+            each link once
+        """
         h_e = dict([(e, i) for i, e in enumerate(l_e)])
-        dim = len(l_e) + len(ll_args)
-
-        adjacent = np.zeros((dim, dim))
+        l_row = []
+        l_col = []
+        s_link = set()
 
         # Only add self link to entities.
         for index, l_args in enumerate(ll_args):
             row = index + len(l_e)
             for arg in l_args:
                 # Some error in data processing cause this.
-                if arg in h_e:
-                    adjacent[row, h_e[arg]] = 1
+                if arg in h_e and (row, h_e[arg]) not in s_link:
+                    s_link.add((row, h_e[arg]))
+                    l_row.append(row)
+                    l_col.append(h_e[arg])
 
-        return adjacent
+        return np.array(l_row, dtype=np.int64), np.array(l_col, dtype=np.int64)
 
     def _average_adjacent(self, ll_args, l_e):
         # A_aver = D^-1 * A
         dim = len(l_e) + len(ll_args)
-        adjacent = self._compute_adjacent(ll_args, l_e)
+        v_row, v_col = self._compute_adjacent(ll_args, l_e)
 
         # The degree matrix contains at least 1 (not plus 1).
         # This allow the average to work, and no zero divisions.
         ds = [1.0] * len(l_e)
         for index, l_args in enumerate(ll_args):
             ds.append(1.0 / len(l_args) if l_args else 1)
+        ds = np.array(ds, dtype=np.float64)
 
-        rcpr_degree = np.diag(ds)
-
-        return np.matmul(rcpr_degree, adjacent)
+        return coo_matrix((ds[v_row], (v_row, v_col)), shape=(dim, dim))
 
     def _symmetric_self_loop_adjacent(self, ll_args, l_e):
         # A_sym = D^-1/2 * A * D^-1/2
         dim = len(l_e) + len(ll_args)
-
-        adjacent = self._compute_adjacent(ll_args, l_e)
+        v_row, v_col = self._compute_adjacent(ll_args, l_e)
 
         # Add self loop.
-        identity = np.eye(dim)
-
-        adjacent = adjacent + identity
+        v_row = np.concatenate([v_row, np.arange(dim)])
+        v_col = np.concatenate([v_col, np.arange(dim)])
 
         # Link degrees also consider self links, which ensures that the
         # reciprocal exists.
@@ -400,10 +530,10 @@ class EventDataIO(DataIO):
         # Part 2: the events have arguments.
         for index, l_args in enumerate(ll_args):
             ds.append(1.0 / math.sqrt(len(l_args) + 1))
-        rcpr_sqrt_degree = np.diag(ds)
+        ds = np.array(ds, dtype=np.float64)
 
-        return np.matmul(np.matmul(rcpr_sqrt_degree, adjacent),
-                         rcpr_sqrt_degree)
+        return coo_matrix((ds[v_row] * ds[v_col], (v_row, v_col)),
+                          shape=(dim, dim))
 
     def _parse_joint(self, h_info):
         """
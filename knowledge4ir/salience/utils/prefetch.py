@@ -0,0 +1,232 @@
+"""
+background prefetching of training batches
+
+PrefetchLoader takes the raw batches (lists of doc lines, or docs from a
+BinaryCorpus), and parses and pads upcoming ones in worker processes with a
+configured DataIO/EventDataIO, while the training step runs on the current one.
+    a feeder thread puts raw batches into a bounded input queue
+    nb_worker processes parse them on cpu, into a bounded output queue
+    the main process moves the results to the device and yields them
+at most nb_worker + queue_size batches are in flight at any time.
+If ordered, the batches are yielded in the input order, otherwise as soon as
+they are ready.
+an exception in batch_iter or in a worker, or a worker killed (e.g. by oom),
+raises RuntimeError in the main process instead of blocking it.
+"""
+
+import logging
+import threading
+import traceback
+from Queue import Empty, Full
+
+import multiprocessing as mp
+
+import torch
+from torch.autograd import Variable
+
+from knowledge4ir.salience.utils.device import (
+    set_device,
+    to_device,
+)
+
+
+class PackedBatch(list):
+    """
+    a batch of docs with its parsed data
+    _data_io of the centers returns packed directly, instead of parsing again
+    """
+
+    def __init__(self, l_doc, packed):
+        super(PackedBatch, self).__init__(l_doc)
+        self.packed = packed
+
+
+class _SparseArrays(object):
+    """
+    a sparse tensor as numpy arrays
+    """
+
+    def __init__(self, tensor):
+        tensor = tensor.coalesce()
+        self.indices = tensor._indices().numpy()
+        self.values = tensor._values().numpy()
+        self.size = tuple(tensor.size())
+
+    def to_tensor(self):
+        return torch.sparse.FloatTensor(torch.from_numpy(self.indices),
+                                        torch.from_numpy(self.values),
+                                        torch.Size(self.size))
+
+
+def _unwrap(data):
+    """
+    variables to numpy arrays, to send through the queues
+    """
+    if data is None:
+        return None
+    if type(data) in (list, tuple):
+        return [_unwrap(item) for item in data]
+    if type(data) is dict:
+        return dict([(key, _unwrap(value)) for key, value in data.items()])
+    if data.data.is_sparse:
+        return _SparseArrays(data.data.cpu())
+    return data.data.cpu().numpy()
+
+
+def _wrap(data):
+    """
+    numpy arrays back to variables on the current device
+    """
+    if data is None:
+        return None
+    if type(data) in (list, tuple):
+        return [_wrap(item) for item in data]
+    if type(data) is dict:
+        return dict([(key, _wrap(value)) for key, value in data.items()])
+    if isinstance(data, _SparseArrays):
+        return to_device(Variable(data.to_tensor()))
+    return to_device(Variable(torch.from_numpy(data)))
+
+
+def _worker_loop(io_parser, in_queue, out_queue):
+    set_device('cpu')
+    torch.set_num_threads(1)
+    while True:
+        item = in_queue.get()
+        if item is None:
+            break
+        batch_id, l_doc = item
+        try:
+            h_packed_data, label = io_parser.parse_data(l_doc)
+            out_queue.put(
+                ('batch', batch_id, (_unwrap(h_packed_data), _unwrap(label))))
+        except Exception:
+            out_queue.put(('error', batch_id, traceback.format_exc()))
+            break
+
+
+class PrefetchLoader(object):
+    # seconds between checks of the workers while waiting for a batch
+    poll_interval = 5
+
+    def __init__(self, io_parser, nb_worker=2, queue_size=4, ordered=True):
+        """
+        :param io_parser: DataIO or EventDataIO, with target group configured
+        :param nb_worker: number of parsing processes
+        :param queue_size: max number of parsed batches waiting to be used
+        :param ordered: whether to keep the input order
+        """
+        assert io_parser.l_target_data
+        self.io_parser = io_parser
+        self.nb_worker = max(nb_worker, 1)
+        self.queue_size = max(queue_size, 1)
+        self.ordered = ordered
+
+    def __call__(self, batch_iter):
+        """
+        yield PackedBatch of the raw batches from batch_iter
+        :param batch_iter: iterator of lists of docs
+        :return:
+        """
+        max_in_flight = self.nb_worker + self.queue_size
+        in_queue = mp.Queue(max_in_flight)
+        out_queue = mp.Queue(max_in_flight)
+        in_flight = threading.Semaphore(max_in_flight)
+        h_stop = {'stop': False}
+        h_raw = {}
+
+        def put(queue, item):
+            # gives up once the main process stops, the workers may be gone
+            while not h_stop['stop']:
+                try:
+                    queue.put(item, timeout=self.poll_interval)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def feed():
+            nb_batch = 0
+            try:
+                for l_doc in batch_iter:
+                    in_flight.acquire()
+                    if h_stop['stop']:
+                        break
+                    h_raw[nb_batch] = l_doc
+                    if not put(in_queue, (nb_batch, l_doc)):
+                        break
+                    nb_batch += 1
+                else:
+                    put(out_queue, ('end', nb_batch, None))
+            except Exception:
+                put(out_queue, ('feed_error', nb_batch, traceback.format_exc()))
+            finally:
+                for __ in xrange(self.nb_worker):
+                    try:
+                        in_queue.put_nowait(None)
+                    except Full:
+                        break
+
+        l_worker = [mp.Process(target=_worker_loop,
+                               args=(self.io_parser, in_queue, out_queue))
+                    for __ in xrange(self.nb_worker)]
+        for worker in l_worker:
+            worker.daemon = True
+            worker.start()
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+        logging.debug('prefetching with [%d] workers', self.nb_worker)
+
+        try:
+            nb_batch = None
+            next_id = 0
+            h_ready = {}
+            while (nb_batch is None) or (next_id < nb_batch):
+                if (not self.ordered) and h_ready:
+                    batch_id = h_ready.keys()[0]
+                elif next_id in h_ready:
+                    batch_id = next_id
+                else:
+                    try:
+                        status, batch_id, res = out_queue.get(
+                            timeout=self.poll_interval)
+                    except Empty:
+                        self._check_workers(l_worker)
+                        continue
+                    if status == 'end':
+                        nb_batch = batch_id
+                    elif status == 'error':
+                        logging.error('io worker failed on batch [%d]:\n%s',
+                                      batch_id, res)
+                        raise RuntimeError
+                    elif status == 'feed_error':
+                        logging.error('reading raw batch [%d] failed:\n%s',
+                                      batch_id, res)
+                        raise RuntimeError
+                    else:
+                        h_ready[batch_id] = res
+                    continue
+                h_packed_data, label = h_ready.pop(batch_id)
+                l_doc = h_raw.pop(batch_id)
+                next_id += 1
+                in_flight.release()
+                yield PackedBatch(l_doc, (_wrap(h_packed_data), _wrap(label)))
+        finally:
+            h_stop['stop'] = True
+            in_flight.release()
+            in_queue.cancel_join_thread()
+            out_queue.cancel_join_thread()
+            for worker in l_worker:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            feeder.join(self.poll_interval)
+
+    @classmethod
+    def _check_workers(cls, l_worker):
+        for worker in l_worker:
+            if worker.exitcode not in (None, 0):
+                logging.error('io worker [%d] died with exit code [%d]',
+                              worker.pid, worker.exitcode)
+                raise RuntimeError
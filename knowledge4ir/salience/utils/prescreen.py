@@ -0,0 +1,193 @@
+"""
+two stage prediction: a cheap scorer pre-screens the candidates of each doc,
+and only the top ones go to the (kernel CRF) model
+
+the cheap scorer works on the hashed doc:
+    entities: their frequency (features[0]), as FrequencySalience,
+        or a trained FeatureLR model (model_in) on their features
+    events: their head count frequency, as EventDataIO ranks them
+the top_n entities and top_n events are kept in the doc; their per candidate
+fields (entities, features, salience, loc, the sparse feature lists, and the
+event arguments in adjacent) are cut with them, so any DataIO group parses
+the pruned doc as usual. EventDataIO normalizes the event tf over the kept
+events only, so the model scores of a screened doc are not the same as those
+of the full doc.
+
+after the model predicts the pruned doc, merge() adds the pruned candidates
+back to the predictions with their cheap scores, moved below the lowest model
+score (score - 1 + squash(cheap score), keeping their cheap score order), and
+evaluates the doc again with all its candidates' labels.
+
+only the new hashed format (spots with 'entities' and 'features') is pruned,
+docs in the old list format are kept as they are.
+"""
+
+import logging
+
+import torch
+from torch.autograd import Variable
+from traitlets import (
+    Int,
+    Unicode,
+)
+from traitlets.config import Configurable
+
+from knowledge4ir.salience.utils.device import (
+    use_cuda,
+    map_location,
+)
+
+
+class PreScreener(Configurable):
+    top_n = Int(
+        0, help='entities (and events) per doc kept for the model, ranked by'
+                ' the cheap scorer, 0 to disable').tag(config=True)
+    model_in = Unicode(
+        help='trained FeatureLR model ranking the entities by their features,'
+             ' empty to rank them by frequency').tag(config=True)
+
+    def __init__(self, io_parser, **kwargs):
+        super(PreScreener, self).__init__(**kwargs)
+        self.io_parser = io_parser
+        self.cheap_model = None
+        if self.model_in:
+            logging.info('loading pre-screen model [%s]', self.model_in)
+            self.cheap_model = torch.load(self.model_in,
+                                          map_location=map_location())
+            self.cheap_model.eval()
+
+    def _entity_scores(self, entity_spots):
+        ll_feature = entity_spots.get('features', [])
+        if self.cheap_model is None:
+            return [l_feature[0] for l_feature in ll_feature]
+        ts_feature = Variable(torch.FloatTensor([ll_feature]), volatile=True)
+        if use_cuda():
+            ts_feature = ts_feature.cuda()
+        output = self.cheap_model({'ts_feature': ts_feature})
+        return output.cpu().data[0].numpy().tolist()
+
+    @classmethod
+    def _event_scores(cls, event_spots):
+        # the head count, see EventDataIO._parse_event
+        return [l_feature[-2] for l_feature in event_spots.get('features', [])]
+
+    def _cut(self, h_spots, l_keep, nb_candidate):
+        """
+        cut the per candidate fields of a spot dict to the kept positions
+        """
+        h_spots = dict(h_spots)
+        for key in ['entities', 'features', 'loc',
+                    self.io_parser.salience_label_field]:
+            if key not in h_spots:
+                continue
+            if len(h_spots[key]) != nb_candidate:
+                logging.error('[%s] has [%d] values for [%d] candidates', key,
+                              len(h_spots[key]), nb_candidate)
+                raise ValueError
+            h_spots[key] = [h_spots[key][p] for p in l_keep]
+        if 'sparse_features' in h_spots:
+            # a sparse feature missing in some events is not aligned to them,
+            # it is kept as it is
+            h_spots['sparse_features'] = dict([
+                (name, [l_value[p] for p in l_keep]
+                 if len(l_value) == nb_candidate else l_value)
+                for name, l_value in h_spots['sparse_features'].items()])
+        return h_spots
+
+    def _screen_candidates(self, l_id, l_score, l_label):
+        """
+        :return: positions of the kept candidates, in their doc order,
+            [(id, cheap score, label)] of the pruned ones
+        """
+        l_rank = sorted(range(len(l_id)), key=lambda p: -l_score[p])
+        l_keep = sorted(l_rank[:self.top_n])
+        l_pruned = [(l_id[p], l_score[p], l_label[p])
+                    for p in l_rank[self.top_n:]]
+        return l_keep, l_pruned
+
+    def screen(self, h_info):
+        """
+        :param h_info: a hashed doc
+        :return: the doc with only the top candidates,
+            h_pruned: {'entity': [(id, cheap score, label)],
+                       'event': [(id, cheap score, label)]}
+        """
+        io = self.io_parser
+        h_pruned = {'entity': [], 'event': []}
+        h_info = dict(h_info)
+
+        h_spot = dict(h_info.get(io.spot_field, {}))
+        entity_spots = h_spot.get(io.content_field, {})
+        if type(entity_spots) is dict:
+            l_e = entity_spots.get('entities', [])
+            if len(l_e) > self.top_n:
+                l_label = [1 if label > 0 else -1 for label in
+                           entity_spots[io.salience_label_field]]
+                l_keep, h_pruned['entity'] = self._screen_candidates(
+                    l_e, self._entity_scores(entity_spots), l_label)
+                h_spot[io.content_field] = self._cut(entity_spots, l_keep,
+                                                     len(l_e))
+                h_info[io.spot_field] = h_spot
+
+        h_event_spot = dict(h_info.get(io.event_spot_field, {}))
+        event_spots = h_event_spot.get(io.content_field, {})
+        l_h = event_spots.get('sparse_features', {}).get('LexicalHead', [])
+        if len(l_h) > self.top_n:
+            l_label = [1 if label == 1 else -1 for label in event_spots.get(
+                io.salience_label_field, [0] * len(l_h))]
+            l_keep, h_pruned['event'] = self._screen_candidates(
+                l_h, self._event_scores(event_spots), l_label)
+            h_event_spot[io.content_field] = self._cut(event_spots, l_keep,
+                                                       len(l_h))
+            h_info[io.event_spot_field] = h_event_spot
+            l_args = h_info.get(io.adjacent_field, [])
+            # the arguments are only hashed for the body events
+            if len(l_args) == len(l_h):
+                h_info[io.adjacent_field] = [l_args[p] for p in l_keep]
+        return h_info, h_pruned
+
+    def merge(self, h_out, l_pruned, h_label, evaluator):
+        """
+        add the pruned candidates to a predicted doc, and evaluate it again
+        :param h_out: the prediction of the pruned doc
+        :param l_pruned: [(id, cheap score, label)] of its pruned candidates
+        :param h_label: label of each candidate kept, by id
+        :param evaluator: SalienceEva
+        :return: h_out
+        """
+        if not h_out or not l_pruned:
+            return h_out
+        content_field = self.io_parser.content_field
+        l_predict = list(h_out[content_field]['predict'])
+        floor = min([score for __, score in l_predict]) - 1.0
+        l_label = [h_label.get(c_id, -1) for c_id, __ in l_predict]
+        for c_id, cheap_score, label in l_pruned:
+            l_predict.append(
+                (c_id, floor + cheap_score / (1.0 + abs(cheap_score))))
+            l_label.append(label)
+        h_out[content_field]['predict'] = l_predict
+        if 'eval' in h_out:
+            h_out['eval'] = evaluator.evaluate(
+                [score for __, score in l_predict], l_label)
+        return h_out
+
+    def kept_labels(self, h_info):
+        """
+        the labels of the candidates of a hashed doc, by id
+        :return: {'entity': {id: label}, 'event': {id: label}}
+        """
+        io = self.io_parser
+        h_label = {'entity': {}, 'event': {}}
+        entity_spots = h_info.get(io.spot_field, {}).get(io.content_field, {})
+        if type(entity_spots) is dict:
+            h_label['entity'] = dict(zip(
+                entity_spots.get('entities', []),
+                [1 if label > 0 else -1 for label in
+                 entity_spots.get(io.salience_label_field, [])]))
+        event_spots = h_info.get(io.event_spot_field, {}).get(
+            io.content_field, {})
+        h_label['event'] = dict(zip(
+            event_spots.get('sparse_features', {}).get('LexicalHead', []),
+            [1 if label == 1 else -1 for label in
+             event_spots.get(io.salience_label_field, [])]))
+        return h_label
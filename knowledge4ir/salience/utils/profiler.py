@@ -0,0 +1,179 @@
+"""
+per module and per phase time and tensor bytes of salience training
+
+attach(model) adds forward hooks to every sub module of the model (named by
+named_modules(), the model itself as 'model'), which record per module:
+    calls, forward_sec: inclusive wall time of its forwards
+    output_mb: bytes of its outputs
+    backward_sec: time from the gradient reaching its outputs to it reaching
+        its inputs, only for modules whose inputs require grad
+    grad_mb: bytes of the gradients reaching its outputs
+timed(phase, func) and timed_iter(phase, iterator) record the wall time of
+the center's phases (waiting for batches, data io, train steps, optimizer
+steps, validation).
+
+summary() returns the recorded stats, reset() clears them.
+detach(model) removes all the hooks. Nothing is attached unless profiling is
+on, so it costs nothing when off. The hooks are module level partials, so
+models saved while profiling still pickle, and re-attaching first removes
+the hooks a loaded model carries.
+on cuda, each record synchronizes first, so that the times are accurate.
+"""
+
+import time
+from functools import partial
+
+from torch.autograd import Variable
+
+from knowledge4ir.salience.utils.device import use_cuda
+
+_h_profile = {
+    'on': False,
+    'modules': {},
+    'phases': {},
+    'forward_start': {},
+    'grad_start': {},
+}
+
+
+def _now():
+    if use_cuda():
+        import torch
+        torch.cuda.synchronize()
+    return time.time()
+
+
+def _nbytes(data):
+    if data is None:
+        return 0
+    if type(data) in (list, tuple):
+        return sum([_nbytes(item) for item in data])
+    if type(data) is dict:
+        return sum([_nbytes(item) for item in data.values()])
+    if isinstance(data, Variable):
+        data = data.data
+    if hasattr(data, 'element_size') and not data.is_sparse:
+        return data.numel() * data.element_size()
+    return 0
+
+
+def _grad_variables(data):
+    if type(data) in (list, tuple):
+        return [v for item in data for v in _grad_variables(item)]
+    if isinstance(data, Variable) and data.requires_grad:
+        return [data]
+    return []
+
+
+def _module_stat(name):
+    if name not in _h_profile['modules']:
+        _h_profile['modules'][name] = {
+            'calls': 0, 'forward_sec': 0.0, 'output_mb': 0.0,
+            'backward_sec': 0.0, 'grad_mb': 0.0,
+        }
+    return _h_profile['modules'][name]
+
+
+def _forward_pre_hook(name, module, input):
+    if not _h_profile['on']:
+        return
+    for v in _grad_variables(input):
+        v.register_hook(partial(_input_grad_hook, name))
+    _h_profile['forward_start'][name] = _now()
+
+
+def _forward_hook(name, module, input, output):
+    if not _h_profile['on']:
+        return
+    h_stat = _module_stat(name)
+    h_stat['calls'] += 1
+    h_stat['forward_sec'] += _now() - _h_profile['forward_start'].pop(
+        name, _now())
+    h_stat['output_mb'] += _nbytes(output) / 1e6
+    for v in _grad_variables(output):
+        v.register_hook(partial(_output_grad_hook, name))
+
+
+def _output_grad_hook(name, grad):
+    h_stat = _module_stat(name)
+    h_stat['grad_mb'] += _nbytes(grad) / 1e6
+    _h_profile['grad_start'][name] = _now()
+
+
+def _input_grad_hook(name, grad):
+    if name in _h_profile['grad_start']:
+        _module_stat(name)['backward_sec'] += _now() - _h_profile[
+            'grad_start'].pop(name)
+
+
+def _is_profile_hook(hook):
+    return isinstance(hook, partial) and hook.func in (_forward_pre_hook,
+                                                       _forward_hook)
+
+
+def detach(model):
+    _h_profile['on'] = False
+    for module in model.modules():
+        for h_hooks in (module._forward_pre_hooks, module._forward_hooks):
+            for key, hook in list(h_hooks.items()):
+                if _is_profile_hook(hook):
+                    del h_hooks[key]
+
+
+def attach(model):
+    detach(model)
+    for name, module in model.named_modules():
+        name = name if name else 'model'
+        module.register_forward_pre_hook(partial(_forward_pre_hook, name))
+        module.register_forward_hook(partial(_forward_hook, name))
+    _h_profile['on'] = True
+
+
+def add_phase_time(phase, sec):
+    if phase not in _h_profile['phases']:
+        _h_profile['phases'][phase] = {'calls': 0, 'sec': 0.0}
+    _h_profile['phases'][phase]['calls'] += 1
+    _h_profile['phases'][phase]['sec'] += sec
+
+
+def timed(phase, func):
+    """
+    func, recording its wall time as phase
+    """
+    def timed_func(*args, **kwargs):
+        st = _now()
+        res = func(*args, **kwargs)
+        add_phase_time(phase, _now() - st)
+        return res
+    return timed_func
+
+
+def timed_iter(phase, iterator):
+    """
+    iterator, recording the wall time of waiting for each item as phase
+    """
+    iterator = iter(iterator)
+    while True:
+        st = _now()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        add_phase_time(phase, _now() - st)
+        yield item
+
+
+def summary():
+    return {
+        'phases': dict([(phase, dict(h_stat))
+                        for phase, h_stat in _h_profile['phases'].items()]),
+        'modules': dict([(name, dict(h_stat))
+                         for name, h_stat in _h_profile['modules'].items()]),
+    }
+
+
+def reset():
+    _h_profile['modules'] = {}
+    _h_profile['phases'] = {}
+    _h_profile['forward_start'] = {}
+    _h_profile['grad_start'] = {}
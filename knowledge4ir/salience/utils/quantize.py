@@ -0,0 +1,100 @@
+"""
+post-training quantization of the embedding tables of salience models
+
+a trained model's nn.Embedding layers are replaced by QuantizedEmbedding,
+which keeps the table in a compact numpy array, and dequantizes only the
+looked up rows to float32:
+    float16: the table in float16, half the memory
+    int8: each row in int8 with its own float32 scale (max abs / 127),
+        about a quarter of the memory
+for inference only, the quantized tables are not trained.
+"""
+
+import logging
+
+import numpy as np
+import torch
+from torch import nn
+from torch.autograd import Variable
+
+from knowledge4ir.salience.utils.device import use_cuda
+
+QUANTIZATION_MODES = ['float16', 'int8']
+
+
+class QuantizedEmbedding(nn.Module):
+    """
+    lookup only embedding over a float16 or per-row scaled int8 table
+    init:
+        emb_mtx: the float numpy table
+        mode: float16 | int8
+    input:
+        same as nn.Embedding, a LongTensor Variable of ids, any shape
+    output:
+        ids' shape x embedding dim, float32
+    """
+
+    def __init__(self, emb_mtx, mode='int8'):
+        super(QuantizedEmbedding, self).__init__()
+        assert mode in QUANTIZATION_MODES
+        self.mode = mode
+        self.num_embeddings, self.embedding_dim = emb_mtx.shape
+        emb_mtx = np.asarray(emb_mtx, dtype=np.float32)
+        self.scale = None
+        if mode == 'float16':
+            self.q_weight = emb_mtx.astype(np.float16)
+        else:
+            scale = np.abs(emb_mtx).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            self.q_weight = np.round(emb_mtx / scale[:, None]).astype(np.int8)
+            self.scale = scale.astype(np.float32)
+
+    @classmethod
+    def from_embedding(cls, embedding, mode='int8'):
+        return cls(embedding.weight.data.cpu().numpy(), mode)
+
+    def forward(self, input):
+        ids = input.data.cpu().numpy()
+        emb = self.q_weight[ids].astype(np.float32)
+        if self.scale is not None:
+            emb *= self.scale[ids][..., None]
+        output = Variable(torch.from_numpy(emb))
+        if use_cuda():
+            output = output.cuda()
+        return output
+
+    def nbytes(self):
+        nb = self.q_weight.nbytes
+        if self.scale is not None:
+            nb += self.scale.nbytes
+        return nb
+
+
+def quantize_embeddings(model, mode='int8'):
+    """
+    replace every nn.Embedding in the model by its QuantizedEmbedding
+    :param model: a trained model, nn.Module
+    :param mode: float16 | int8
+    :return: the model, quantized in place
+    """
+    for module in list(model.modules()):
+        for name, sub_module in list(module._modules.items()):
+            if isinstance(sub_module, nn.Embedding):
+                logging.info('quantizing embedding [%s] %s to [%s]', name,
+                             str(sub_module.weight.size()), mode)
+                setattr(module, name,
+                        QuantizedEmbedding.from_embedding(sub_module, mode))
+    return model
+
+
+def embedding_nbytes(model):
+    """
+    total bytes of the model's embedding tables, quantized or not
+    """
+    nb = 0
+    for module in model.modules():
+        if isinstance(module, QuantizedEmbedding):
+            nb += module.nbytes()
+        elif isinstance(module, nn.Embedding):
+            nb += module.weight.data.numel() * module.weight.data.element_size()
+    return nb
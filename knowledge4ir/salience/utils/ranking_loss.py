@@ -4,7 +4,7 @@ classification hinge
 pairwise loss
 """
 import torch
-use_cuda = torch.cuda.is_available()
+from knowledge4ir.salience.utils.device import use_cuda
 
 
 def _assert(output, target):
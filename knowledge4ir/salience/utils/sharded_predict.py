@@ -0,0 +1,176 @@
+"""
+multi-process sharded prediction
+
+the test file is split by line ranges into nb_worker shards. Each shard is
+predicted by the center's own predict() in a forked cpu worker process, so
+the workers share the model weights and ExtData of the parent copy-on-write.
+the center must run on cpu: the forked workers can not use the parent's cuda
+context, nor move a model it already put on the GPU.
+The shard outputs are then concatenated back in input order, and the
+SalienceEva metrics are averaged over all the output docs, the same as
+predict() does in one process.
+
+works for any center whose _predict_out_names() lists the files its predict()
+writes, SalienceModelCenter and JointSalienceModelCenter.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import traceback
+
+import multiprocessing as mp
+from Queue import Empty
+
+import torch
+
+from knowledge4ir.salience.utils.device import use_cuda
+from knowledge4ir.salience.utils.hashed_binary import is_hashed_binary
+from knowledge4ir.utils import (
+    add_svm_feature,
+    mutiply_svm_feature,
+)
+
+
+def split_lines(in_name, nb_shard, shard_dir):
+    """
+    split in_name into at most nb_shard files of consecutive line ranges
+    :return: the shard file names, in input order
+    """
+    nb_line = sum([1 for __ in open(in_name)])
+    shard_size = max(1, (nb_line + nb_shard - 1) / nb_shard)
+    l_shard_in = []
+    out = None
+    for p, line in enumerate(open(in_name)):
+        if not p % shard_size:
+            if out:
+                out.close()
+            l_shard_in.append(os.path.join(shard_dir,
+                                           'shard_%04d' % len(l_shard_in)))
+            out = open(l_shard_in[-1], 'w')
+        out.write(line)
+    if out:
+        out.close()
+    logging.info('[%s] [%d] lines split into [%d] shards', in_name, nb_line,
+                 len(l_shard_in))
+    return l_shard_in
+
+
+def _predict_shard(center, shard_in, shard_out, queue):
+    torch.set_num_threads(1)
+    center.nb_predict_worker = 0
+    try:
+        center.predict(shard_in, shard_out)
+        queue.put((shard_in, None))
+    except Exception:
+        queue.put((shard_in, traceback.format_exc()))
+
+
+def _wait_shards(h_shard_proc, queue, poll_interval=5):
+    """
+    wait for the result of each shard's process, a process that died without
+    one (e.g. killed for OOM) counts as failed
+    :return: the failed shards
+    """
+    h_pending = dict(h_shard_proc)
+    l_error = []
+    while h_pending:
+        try:
+            shard_in, error = queue.get(timeout=poll_interval)
+        except Empty:
+            l_dead = [shard_in for shard_in, proc in h_pending.items()
+                      if not proc.is_alive()]
+            if not l_dead:
+                continue
+            # they may have put the result right before exiting
+            try:
+                shard_in, error = queue.get(timeout=poll_interval)
+            except Empty:
+                for shard_in in l_dead:
+                    logging.error('predicting shard [%s] died with exit code'
+                                  ' [%s]', shard_in,
+                                  h_pending.pop(shard_in).exitcode)
+                    l_error.append(shard_in)
+                continue
+        h_pending.pop(shard_in, None)
+        if error:
+            logging.error('predicting shard [%s] failed:\n%s', shard_in, error)
+            l_error.append(shard_in)
+    return l_error
+
+
+def merge_outputs(l_shard_out, out_name):
+    """
+    concatenate the shard outputs, and average their docs' eval
+    :return: the mean eval, as predict() dumps to [out_name].eval
+    """
+    h_total_eva = dict()
+    p = 0
+    with open(out_name, 'w') as out:
+        for shard_out in l_shard_out:
+            if not os.path.exists(shard_out):
+                continue
+            for line in open(shard_out):
+                out.write(line)
+                h_total_eva = add_svm_feature(
+                    h_total_eva, json.loads(line).get('eval', {}))
+                p += 1
+    h_mean_eva = mutiply_svm_feature(h_total_eva, 1.0 / max(p, 1.0))
+    l_mean_eva = sorted(h_mean_eva.items(), key=lambda item: item[0])
+    json.dump(l_mean_eva, open(out_name + '.eval', 'w'), indent=1)
+    logging.info('merged [%d] predicted docs to [%s], eva %s', p, out_name,
+                 json.dumps(l_mean_eva))
+    return l_mean_eva
+
+
+def sharded_predict(center, test_in_name, label_out_name, nb_worker,
+                    l_out_name=None):
+    """
+    predict test_in_name with nb_worker processes
+    :param center: SalienceModelCenter or JointSalienceModelCenter, model ready
+    :param test_in_name: test data
+    :param label_out_name: the label_out_name of center.predict()
+    :param nb_worker: number of worker processes
+    :param l_out_name: the merged output files, default the ones
+        center.predict() writes for label_out_name
+    """
+    if is_hashed_binary(test_in_name):
+        logging.error('sharded predict splits json lines, [%s] is a hashed'
+                      ' binary layout', test_in_name)
+        raise NotImplementedError
+    if use_cuda():
+        logging.error('sharded predict forks cpu workers, set device to cpu'
+                      ' to use nb_predict_worker > 1')
+        raise NotImplementedError
+    if l_out_name is None:
+        l_out_name = center._predict_out_names(label_out_name)
+    res_dir = os.path.dirname(label_out_name)
+    if not os.path.exists(res_dir):
+        os.makedirs(res_dir)
+    shard_dir = tempfile.mkdtemp(prefix='sharded_predict_', dir=res_dir)
+    l_shard_in = split_lines(test_in_name, nb_worker, shard_dir)
+
+    queue = mp.Queue()
+    l_proc = []
+    for shard_in in l_shard_in:
+        proc = mp.Process(target=_predict_shard,
+                          args=(center, shard_in, shard_in + '.predict', queue))
+        proc.start()
+        l_proc.append(proc)
+    l_error = _wait_shards(dict(zip(l_shard_in, l_proc)), queue)
+    for proc in l_proc:
+        proc.join()
+    if l_error:
+        shutil.rmtree(shard_dir)
+        raise RuntimeError('predicting shards %s failed' % json.dumps(l_error))
+
+    ll_shard_out = [center._predict_out_names(shard_in + '.predict')
+                    for shard_in in l_shard_in]
+    l_mean_eva = []
+    for i, out_name in enumerate(l_out_name):
+        l_mean_eva.append(merge_outputs(
+            [l_shard_out[i] for l_shard_out in ll_shard_out], out_name))
+    shutil.rmtree(shard_dir)
+    return l_mean_eva
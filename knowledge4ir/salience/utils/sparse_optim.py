@@ -0,0 +1,73 @@
+"""
+sparse gradient training of the embedding tables
+
+sparse_embeddings(model) switches the model's nn.Embedding layers to sparse
+gradients, so backward only produces the rows of the ids in the batch.
+SparseDenseAdam then updates those embedding weights with SparseAdam, which
+only touches the rows (and their moment estimates) in the gradient, and the
+other parameters with Adam as usual.
+
+without it, each step builds a dense gradient and a dense Adam update of the
+whole vocabulary x dimension table, no matter how few ids the batch has.
+"""
+
+import logging
+
+import torch
+from torch import nn
+
+
+def sparse_embeddings(model):
+    """
+    set the trained nn.Embedding layers of the model to sparse gradients
+    :return: their weights
+    """
+    l_weight = []
+    for name, module in model.named_modules():
+        if isinstance(module, nn.Embedding) and module.weight.requires_grad:
+            module.sparse = True
+            l_weight.append(module.weight)
+            logging.info('embedding [%s] %s uses sparse gradients', name,
+                         list(module.weight.size()))
+    return l_weight
+
+
+class SparseDenseAdam(object):
+    """
+    SparseAdam on the sparse embedding weights, Adam on the other parameters
+    with the optimizer interface the center uses: zero_grad, step, state_dict,
+    load_state_dict
+    """
+
+    def __init__(self, model, lr):
+        if not hasattr(torch.optim, 'SparseAdam'):
+            logging.error('sparse embedding training needs'
+                          ' torch.optim.SparseAdam')
+            raise NotImplementedError
+        l_sparse = sparse_embeddings(model)
+        s_sparse = set([id(weight) for weight in l_sparse])
+        l_dense = [model_para for model_para in model.parameters()
+                   if model_para.requires_grad
+                   and id(model_para) not in s_sparse]
+        self.l_optimizer = []
+        if l_dense:
+            self.l_optimizer.append(torch.optim.Adam(l_dense, lr=lr))
+        if l_sparse:
+            self.l_optimizer.append(torch.optim.SparseAdam(l_sparse, lr=lr))
+
+    def zero_grad(self):
+        for optimizer in self.l_optimizer:
+            optimizer.zero_grad()
+
+    def step(self):
+        for optimizer in self.l_optimizer:
+            optimizer.step()
+
+    def state_dict(self):
+        return {'optimizers': [optimizer.state_dict()
+                               for optimizer in self.l_optimizer]}
+
+    def load_state_dict(self, h_state):
+        for optimizer, h_opt_state in zip(self.l_optimizer,
+                                          h_state['optimizers']):
+            optimizer.load_state_dict(h_opt_state)
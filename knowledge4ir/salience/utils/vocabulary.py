@@ -0,0 +1,270 @@
+"""
+compact term <-> id vocabulary, memory-mapped, in place of the pickled dicts
+
+a vocabulary dir has:
+    meta.json: version, nb of terms, nb of hash slots, md5 digest of the
+        terms and ids
+    terms.bin: the utf-8 terms, sorted, concatenated
+    offsets.bin: int64, nb_term + 1, the byte range of each sorted term
+    ids.bin: int64, the id of each sorted term
+    ranks.bin: int64, for each id, the position of its term, -1 if unused
+    slots.bin: int64, open addressing hash index (crc32, linear probing),
+        the position of a term or -1
+term -> id probes the slots and compares the bytes; id -> term goes through
+ranks and offsets; both are O(1), with nothing decoded at load time.
+the files are only read through mmap, so forked hashing workers and other
+processes on the same host share the pages of the os cache.
+
+Vocabulary has the dict interface the pickled dicts were used with
+(get, [], in, len, items), and load_vocabulary() takes either a vocabulary
+dir or the old pickle, so configs keep working with both.
+lookups match the pickles made from word2vec files, which have utf-8 str
+keys: a unicode term is found only if it is ascii, as py2 does not match
+non-ascii unicode to utf-8 str, so both give the same hashed corpora.
+vocabulary_version() is the content digest of either, see
+CorpusHasher.incremental.
+
+convert a pickle:
+    python -m knowledge4ir.salience.utils.vocabulary [pickle in] [out dir]
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+import numpy as np
+
+VOCABULARY_VERSION = 1
+META_NAME = 'meta.json'
+
+
+def _to_bytes(term):
+    if isinstance(term, unicode):
+        return term.encode('utf-8')
+    return term
+
+
+def _lookup_bytes(term):
+    """
+    the bytes a term matches in a pickle with utf-8 str keys, None if none
+    """
+    if isinstance(term, unicode):
+        try:
+            return term.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+    return term
+
+
+def _hash(b_term):
+    return zlib.crc32(b_term) & 0xffffffff
+
+
+def is_vocabulary(in_name):
+    return os.path.isdir(in_name) and os.path.exists(
+        os.path.join(in_name, META_NAME))
+
+
+def load_vocabulary(in_name):
+    """
+    :param in_name: a vocabulary dir, or a pickled term -> id dict
+    """
+    if is_vocabulary(in_name):
+        return Vocabulary(in_name)
+    logging.info('loading pickled vocabulary [%s]', in_name)
+    return pickle.load(open(in_name))
+
+
+def vocabulary_version(in_name):
+    """
+    md5 digest of the terms and ids of a vocabulary dir, or of a pickle file
+    """
+    if is_vocabulary(in_name):
+        h_meta = json.load(open(os.path.join(in_name, META_NAME)))
+        if 'digest' in h_meta:
+            return h_meta['digest']
+        l_name = [os.path.join(in_name, name) for name in ['terms.bin',
+                                                           'ids.bin']]
+    else:
+        l_name = [in_name]
+    md5 = hashlib.md5()
+    for name in l_name:
+        with open(name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                md5.update(block)
+    return md5.hexdigest()
+
+
+def dump_vocabulary(h_term_id, out_dir):
+    """
+    write a term -> id dict (or (term, id) pairs) as a vocabulary dir
+    """
+    h_bytes_id = {}
+    for term, t_id in (h_term_id.items() if hasattr(h_term_id, 'items')
+                       else h_term_id):
+        b_term = _to_bytes(term)
+        if b_term in h_bytes_id and h_bytes_id[b_term] != t_id:
+            logging.error('term [%s] has ids [%d] and [%d]', b_term,
+                          h_bytes_id[b_term], t_id)
+            raise ValueError
+        h_bytes_id[b_term] = t_id
+    l_term = sorted(h_bytes_id.keys())
+    nb_term = len(l_term)
+    v_id = np.array([h_bytes_id[b_term] for b_term in l_term], dtype='int64')
+    if nb_term and v_id.min() < 0:
+        logging.error('vocabulary ids must be non negative')
+        raise ValueError
+    v_rank = np.full(v_id.max() + 1 if nb_term else 0, -1, dtype='int64')
+    v_rank[v_id] = np.arange(nb_term, dtype='int64')
+
+    nb_slot = 1
+    while nb_slot < 2 * nb_term:
+        nb_slot *= 2
+    mask = nb_slot - 1
+    l_slot = [-1] * nb_slot
+    for rank, b_term in enumerate(l_term):
+        p = _hash(b_term) & mask
+        while l_slot[p] != -1:
+            p = (p + 1) & mask
+        l_slot[p] = rank
+
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    md5 = hashlib.md5()
+    with open(os.path.join(out_dir, 'terms.bin'), 'wb') as out:
+        for b_term in l_term:
+            out.write(b_term)
+            md5.update(b_term)
+    md5.update(v_id.tostring())
+    v_offset = np.zeros(nb_term + 1, dtype='int64')
+    v_offset[1:] = np.cumsum([len(b_term) for b_term in l_term])
+    v_offset.tofile(os.path.join(out_dir, 'offsets.bin'))
+    v_id.tofile(os.path.join(out_dir, 'ids.bin'))
+    v_rank.tofile(os.path.join(out_dir, 'ranks.bin'))
+    np.array(l_slot, dtype='int64').tofile(os.path.join(out_dir, 'slots.bin'))
+    json.dump({'version': VOCABULARY_VERSION,
+               'nb_term': nb_term,
+               'nb_slot': nb_slot,
+               'digest': md5.hexdigest(),
+               },
+              open(os.path.join(out_dir, META_NAME), 'w'), indent=1)
+    logging.info('[%d] terms vocabulary written to [%s]', nb_term, out_dir)
+
+
+class Vocabulary(object):
+    """
+    read only term -> id dict on a vocabulary dir
+    terms can be str (utf-8) or ascii unicode, term() and items() give the
+    utf-8 str, as the pickles made from word2vec files have
+    """
+
+    def __init__(self, in_dir):
+        self.in_dir = in_dir
+        h_meta = json.load(open(os.path.join(in_dir, META_NAME)))
+        if h_meta.get('version') != VOCABULARY_VERSION:
+            logging.error('vocabulary [%s] version [%s] is not [%d]', in_dir,
+                          h_meta.get('version'), VOCABULARY_VERSION)
+            raise ValueError
+        self.nb_term = h_meta['nb_term']
+        self.mask = h_meta['nb_slot'] - 1
+        self.terms = self._mmap('terms.bin')
+        self.offsets = self._mmap('offsets.bin')
+        self.ids = self._mmap('ids.bin')
+        self.ranks = self._mmap('ranks.bin')
+        self.slots = self._mmap('slots.bin')
+        self.nb_id = len(self.ranks) // 8
+        logging.info('vocabulary [%s] loaded, [%d] terms', in_dir, self.nb_term)
+
+    def __getstate__(self):
+        # sent to other processes by path, they map the same files
+        return {'in_dir': self.in_dir}
+
+    def __setstate__(self, h_state):
+        self.__init__(h_state['in_dir'])
+
+    def _mmap(self, name):
+        with open(os.path.join(self.in_dir, name), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return ''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def _int(cls, buf, p):
+        return struct.unpack_from('<q', buf, 8 * p)[0]
+
+    def _term_bytes(self, rank):
+        st, ed = struct.unpack_from('<2q', self.offsets, 8 * rank)
+        return self.terms[st:ed]
+
+    def _rank(self, term):
+        b_term = _lookup_bytes(term)
+        if not self.nb_term or b_term is None:
+            return -1
+        p = _hash(b_term) & self.mask
+        while True:
+            rank = self._int(self.slots, p)
+            if rank == -1 or self._term_bytes(rank) == b_term:
+                return rank
+            p = (p + 1) & self.mask
+
+    def get(self, term, default=None):
+        rank = self._rank(term)
+        if rank == -1:
+            return default
+        return self._int(self.ids, rank)
+
+    def __getitem__(self, term):
+        rank = self._rank(term)
+        if rank == -1:
+            raise KeyError(term)
+        return self._int(self.ids, rank)
+
+    def __contains__(self, term):
+        return self._rank(term) != -1
+
+    def __len__(self):
+        return self.nb_term
+
+    def term(self, t_id, default=None):
+        """
+        id -> term
+        """
+        if not 0 <= t_id < self.nb_id:
+            return default
+        rank = self._int(self.ranks, t_id)
+        if rank == -1:
+            return default
+        return self._term_bytes(rank)
+
+    def iteritems(self):
+        """
+        (term, id), in the sorted term order
+        """
+        for rank in xrange(self.nb_term):
+            yield self._term_bytes(rank), self._int(self.ids, rank)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def close(self):
+        for buf in [self.terms, self.offsets, self.ids, self.ranks,
+                    self.slots]:
+            if buf:
+                buf.close()
+
+
+if __name__ == '__main__':
+    import sys
+    from knowledge4ir.utils import set_basic_log
+
+    set_basic_log(logging.INFO)
+    if 3 != len(sys.argv):
+        print "convert a pickled term -> id dict to a vocabulary dir"
+        print "2 para: pickle in + out dir"
+        sys.exit(-1)
+    dump_vocabulary(pickle.load(open(sys.argv[1])), sys.argv[2])